@@ -0,0 +1,310 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+
+import sys
+import logging
+import time
+import argparse
+import json
+import struct
+import array
+import threading
+
+import kafka.log
+import kafka.protocol
+import kafka.producer
+import kafka.consumer
+
+
+logger = logging.getLogger(__name__)
+
+BENCH_TOPIC = "kafka-bench"
+MESSAGE_BYTES = 100
+BATCH_MESSAGES = 1000 # messages per producer send()
+DURATION_SECONDS = 10
+DRAIN_SECONDS = 5 # how long the consumer keeps going after the producer is done
+ACK_TIMEOUT_SECONDS = 30 # how long the async producer's messages wait for acks, after the flush
+FAKE_PARTITIONS = 4
+FAKE_BROKERS = 1
+
+# every payload starts with the time it was sent, and its sequence number,
+# and is padded out to the message size
+_HEADER = struct.Struct('>dq')
+
+
+def encode_payload(sequence, size, sent=None):
+    header = _HEADER.pack(time.time() if sent is None else sent, sequence)
+    return header + "x" * (size - len(header))
+
+
+def decode_payload(payload):
+    # -> (time sent, sequence number)
+    return _HEADER.unpack_from(payload)
+
+
+def percentile(values, p):
+    # nearest rank, 'values' sorted
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class ProducerLoop(threading.Thread):
+
+    # sends batches of 'batch' messages, at 'rate' messages per second (or
+    # flat out, if rate is 0), until 'messages' are sent, or 'seconds' go by
+
+    def __init__(self, producer, size=MESSAGE_BYTES, batch=BATCH_MESSAGES, rate=0, messages=0, seconds=DURATION_SECONDS):
+        super(ProducerLoop, self).__init__(name="kafka-bench-producer")
+        self.daemon = True
+        self.producer = producer
+        self.size = max(size, _HEADER.size)
+        self.batch = batch
+        self.rate = rate
+        self.messages = messages
+        self.seconds = seconds
+        self.sent = 0
+        self.errors = 0
+        self.futures = [] # of the async producer's messages not yet acked
+        self.started = None
+        self.finished = None
+        self.stopped = threading.Event()
+
+
+    def __repr__(self):
+        return "ProducerLoop(size=%i, batch=%i, rate=%i, messages=%i, seconds=%f)" % (self.size, self.batch, self.rate, self.messages, self.seconds)
+
+
+    def stop(self):
+        self.stopped.set()
+        return
+
+
+    def run(self):
+
+        self.started = time.time()
+        try:
+            while not self.stopped.is_set():
+                now = time.time()
+                if self.seconds and now - self.started >= self.seconds:
+                    break
+                count = self.batch
+                if self.messages:
+                    count = min(count, self.messages - self.sent)
+                    if count <= 0:
+                        break
+                # the batch is due when the messages before it are, at 'rate'
+                if self.rate:
+                    wait = self.started + float(self.sent) / self.rate - now
+                    if wait > 0:
+                        time.sleep(wait)
+                payloads = [encode_payload(self.sent + i, self.size) for i in range(count)]
+                self._send(payloads)
+                self.sent += count
+
+            if isinstance(self.producer, kafka.producer.KafkaAsyncProducer):
+                self.producer.flush()
+                self._collect(wait=True)
+
+        except Exception as exc:
+            logger.error("producer: %r", exc, exc_info=True)
+
+        finally:
+            self.finished = time.time()
+
+
+    def _send(self, payloads):
+        if isinstance(self.producer, kafka.producer.KafkaAsyncProducer):
+            self.futures.extend(self.producer.send(payloads))
+            self._collect()
+            return
+        partitioned, responses = self.producer.send(payloads)
+        for r in responses:
+            if r.error:
+                self.errors += len(partitioned[r.partition])
+        return
+
+
+    def _collect(self, wait=False):
+
+        # counts the failed messages among the futures which are done (or
+        # among all of them, with 'wait'), and lets go of those futures
+        pending = []
+        for future in self.futures:
+            if not wait and not future.done():
+                pending.append(future)
+                continue
+            try:
+                future.result(ACK_TIMEOUT_SECONDS)
+            except Exception:
+                self.errors += 1
+        self.futures = pending
+        return
+
+
+def consume(consumer, loop, drain_seconds=DRAIN_SECONDS):
+
+    # -> (messages, bytes, latencies in seconds, seconds); consumes until
+    # the producer loop is done and everything it sent came in, or
+    # until 'drain_seconds' after the producer loop is done
+    latencies = array.array('d')
+    received = 0
+    size_b = 0
+    started = time.time()
+    while True:
+        values = consumer.fetch()
+        now = time.time()
+        for value in values:
+            sent, sequence = decode_payload(value)
+            latencies.append(now - sent)
+            size_b += len(value)
+        received += len(values)
+        if loop.finished:
+            if received >= loop.sent - loop.errors or now > loop.finished + drain_seconds:
+                break
+    return received, size_b, latencies, time.time() - started
+
+
+def run(hosts, topic=BENCH_TOPIC, size=MESSAGE_BYTES, batch=BATCH_MESSAGES, rate=0, messages=0, seconds=DURATION_SECONDS, async=False, codec=kafka.protocol.CODEC_NONE, drain_seconds=DRAIN_SECONDS):
+
+    # -> report dict; the consumer starts at the tail of the topic, before
+    # the producer starts sending, so that it gets everything that is sent
+    if async:
+        producer = kafka.producer.KafkaAsyncProducer(hosts=hosts, topic=topic, codec=codec, batch_bytes=batch * size)
+    else:
+        producer = kafka.producer.KafkaProducer(hosts=hosts, topic=topic, codec=codec)
+    consumer = kafka.consumer.KafkaConsumer(hosts=hosts, topic=topic, whence=kafka.consumer.WHENCE_TAIL, min_bytes=1)
+
+    with producer, consumer:
+        consumer.seek()
+        loop = ProducerLoop(producer, size=size, batch=batch, rate=rate, messages=messages, seconds=seconds)
+        loop.start()
+        try:
+            received, received_b, latencies, consume_s = consume(consumer, loop, drain_seconds)
+        finally:
+            loop.stop()
+            loop.join()
+
+    produce_s = max(loop.finished - loop.started, 1e-6)
+    consume_s = max(consume_s, 1e-6)
+    latencies = sorted(latencies)
+    ms = lambda v: None if v is None else v * 1000
+    return {
+        'topic': topic,
+        'message_bytes': loop.size,
+        'batch_messages': batch,
+        'target_rate': rate,
+        'async': async,
+        'codec': codec,
+        'sent': loop.sent,
+        'errors': loop.errors,
+        'received': received,
+        'produce_seconds': produce_s,
+        'produce_messages_per_second': loop.sent / produce_s,
+        'produce_mb_per_second': loop.sent * loop.size / produce_s / 2**20,
+        'consume_seconds': consume_s,
+        'consume_messages_per_second': received / consume_s,
+        'consume_mb_per_second': received_b / consume_s / 2**20,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.5)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'p999': ms(percentile(latencies, 0.999)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def format_report(report):
+    lines = [
+        "sent: %i messages (%i errors), %.0f msg/s, %.2f MB/s" % (report['sent'], report['errors'], report['produce_messages_per_second'], report['produce_mb_per_second']),
+        "received: %i messages, %.0f msg/s, %.2f MB/s" % (report['received'], report['consume_messages_per_second'], report['consume_mb_per_second']),
+    ]
+    if report['received']:
+        lines.append("latency: p50 %(p50).2fms, p99 %(p99).2fms, p999 %(p999).2fms, max %(max).2fms" % report['latency_ms'])
+    return "\n".join(lines)
+
+
+def args_parser():
+
+    epilog = """
+The producer sends messages of --size bytes, --batch messages at a time,
+at --rate messages per second (or as fast as it can, with --rate 0),
+for --seconds, or until --messages are sent. At the same time the
+consumer reads them from the tail of the topic. Each message carries
+the time it was sent, so the produce to consume latency is measured for
+every message (the producer and the consumer are in the same process,
+so the clocks agree).
+
+With --fake, the benchmark runs against an in-process fake broker (see
+kafka/test/fakebroker.py), with --partitions partitions, instead of
+against 'hosts'; this measures the client alone.
+
+"""
+
+    parser = argparse.ArgumentParser(description="Kafka load generator (%s)" % (kafka.__version__, ), epilog=epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('hosts', type=str, nargs='?', action='store', default='localhost:9092', help="broker1:port1,broker2:port2; (%(default)s)")
+    parser.add_argument('--verbose', '-v', action='count', default=0, help="try -v, -vv, -vvv")
+    parser.add_argument('--topic', type=str, action='store', default=BENCH_TOPIC, help="(%(default)s)")
+    parser.add_argument('--size', metavar='BYTES', type=int, action='store', default=MESSAGE_BYTES, help="message size, at least %i; (%%(default)s)" % _HEADER.size)
+    parser.add_argument('--batch', metavar='N', type=int, action='store', default=BATCH_MESSAGES, help="messages per send; (%(default)s)")
+    parser.add_argument('--rate', metavar='N', type=int, action='store', default=0, help="messages per second, 0 for flat out; (%(default)s)")
+    parser.add_argument('--seconds', metavar='N', type=float, action='store', default=DURATION_SECONDS, help="how long to send for, 0 for no limit; (%(default)s)")
+    parser.add_argument('--messages', metavar='N', type=int, action='store', default=0, help="how many messages to send, 0 for no limit; (%(default)s)")
+    parser.add_argument('--async', action='store_true', help="send with KafkaAsyncProducer, a --batch worth of bytes per partition")
+    parser.add_argument('--compression', choices=sorted(kafka.producer.CODECS), action='store', default='none', help="(%(default)s)")
+    parser.add_argument('--drain', metavar='SECONDS', type=float, action='store', default=DRAIN_SECONDS, help="how long to wait for the last messages; (%(default)s)")
+    parser.add_argument('--fake', action='store_true', help="run against an in-process fake broker")
+    parser.add_argument('--partitions', metavar='N', type=int, action='store', default=FAKE_PARTITIONS, help="partitions of the topic on the fake broker; (%(default)s)")
+    parser.add_argument('--brokers', metavar='N', type=int, action='store', default=FAKE_BROKERS, help="number of fake brokers; (%(default)s)")
+    parser.add_argument('--output', metavar='PATH', type=str, action='store', default=None, help="save the report as JSON")
+
+    return parser
+
+
+def main():
+
+    args = args_parser().parse_args()
+    kafka.log.set_up_logging(level=logging.ERROR-(args.verbose*10))
+    if not args.seconds and not args.messages:
+        sys.exit("one of --seconds and --messages must be set")
+
+    cluster = None
+    try:
+
+        hosts = args.hosts
+        if args.fake:
+            from kafka.test.fakebroker import FakeCluster
+            cluster = FakeCluster(brokers=args.brokers)
+            cluster.create_topic(args.topic, partitions=args.partitions)
+            hosts = cluster.hosts
+
+        report = run(
+            hosts,
+            topic=args.topic,
+            size=args.size,
+            batch=args.batch,
+            rate=args.rate,
+            messages=args.messages,
+            seconds=args.seconds,
+            async=args.async,
+            codec=kafka.producer.CODECS[args.compression],
+            drain_seconds=args.drain,
+        )
+        print format_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+
+    except KeyboardInterrupt:
+        logger.info("keyboard interrupt")
+
+    finally:
+        if cluster:
+            cluster.close()
+
+
+if __name__ == "__main__":
+    main()
+
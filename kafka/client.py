@@ -8,30 +8,50 @@ import logging
 import itertools
 import socket
 import base64
+import collections
+import time
 
 import kafka.connection
 import kafka.protocol
+import kafka.metrics
 
 logger = logging.getLogger(__name__)
 
 FETCH_BUFFER_SIZE_BYTES = 2**24 # 16MB max message size, anything bigger will effectively choke the partition
+MAX_IN_FLIGHT_REQUESTS = 8 # per connection, see send_requests()
+METADATA_TTL_SECONDS = 300
+CONNECTION_IDLE_SECONDS = 540 # connections to brokers not used for this long get closed
 ID_GEN = itertools.count()
 
 
 class KafkaClient(object):
 
-    def __init__(self, brokers):
+    def __init__(self, brokers, topics=None, metadata_ttl=METADATA_TTL_SECONDS, metrics=None):
 
         self.client_id = 'kafka-python'
-
+        # if 'topics' is set, metadata is requested only for these topics
+        # (and for any other topic when it is first used), instead of for
+        # all the topics in the cluster
+        self.topics = list(topics) if topics else None
+        self.metadata_ttl = metadata_ttl
+        # per broker and api in the connections, per topic and partition here
+        self.metrics = metrics if metrics is not None else kafka.metrics.REGISTRY
+
+        # 'brokers' are only the seed brokers, used for metadata requests;
+        # connections to the leaders found in the metadata are opened
+        # as needed, and kept in self.broker_conns
         self.conns = []
         for broker in brokers.split(","):
             host, port = broker.split(":")
-            self.conns.append(kafka.connection.KafkaConnection(host, port))
+            self.conns.append(kafka.connection.KafkaConnection(host, port, metrics=self.metrics))
+        self.broker_conns = {}       # broker_id -> KafkaConnection
+        self.broker_conns_used = {}  # broker_id -> time last used
+        self.idle_check_at = time.time() + CONNECTION_IDLE_SECONDS
 
         self.brokers = {}            # broker_id -> BrokerMetadata
         self.topics_to_brokers = {}  # topic_id -> broker_id
         self.topic_partitions = {}   # topic_id -> [0, 1, 2, ...]
+        self.topics_refreshed = {}   # topic_id -> time metadata was fetched, 0 if stale
 
         self.get_metadata()
 
@@ -39,23 +59,131 @@ class KafkaClient(object):
 
 
     def close(self):
-        for conn in self.conns:
+        for conn in self.conns + self.broker_conns.values():
             conn.close()
 
 
     def get_topic_leader(self, topic, partition):   
+        if self.topics_refreshed.get(topic, 0) + self.metadata_ttl < time.time():
+            self.refresh_topic(topic)
         leader = self.topics_to_brokers[kafka.protocol.TopicAndPartition(topic, partition)]
 #         logger.debug("leader: %r for topic: %s for partition: %i", leader, topic, partition)
         return leader
 
 
+    def group_by_leader(self, requests):
+
+        # any requests with 'topic' and 'partition' -> {leader: [request, ...]}
+        by_leader = collections.defaultdict(list)
+        for request in requests:
+            leader = self.get_topic_leader(request.topic, request.partition)
+            by_leader[leader].append(request)
+        return by_leader
+
+
+    def get_connection(self, broker):
+
+        if not broker:
+            return self.conns[0]
+
+        now = time.time()
+        if self.idle_check_at < now:
+            self.close_idle(CONNECTION_IDLE_SECONDS)
+
+        conn = self.broker_conns.get(broker.nodeId)
+        if conn is None or (conn.host, conn.port) != (broker.host, broker.port):
+            conn = self._open_connection(broker)
+        self.broker_conns_used[broker.nodeId] = now
+        return conn
+
+
+    def _open_connection(self, broker):
+
+        # the broker moved, or hasn't been connected to yet; the actual
+        # socket is opened on first send()
+        old = self.broker_conns.pop(broker.nodeId, None)
+        if old is not None and old not in self.conns:
+            old.close()
+        conn = kafka.connection.KafkaConnection(broker.host, broker.port, metrics=self.metrics)
+        for seed in self.conns:
+            if seed == conn:
+                conn = seed
+                break
+        self.broker_conns[broker.nodeId] = conn
+        logger.debug("connection for broker: %s, %r", broker, conn)
+        return conn
+
+
+    def close_idle(self, idle_seconds):
+
+        now = time.time()
+        for broker_id, used in self.broker_conns_used.items():
+            if used + idle_seconds < now:
+                conn = self.broker_conns.pop(broker_id, None)
+                del self.broker_conns_used[broker_id]
+                if conn is not None and conn not in self.conns:
+                    logger.debug("closing idle connection: %r", conn)
+                    conn.close()
+        self.idle_check_at = now + idle_seconds
+        return
+
+
+    def send_requests(self, requests, max_in_flight=MAX_IN_FLIGHT_REQUESTS):
+
+        # 'requests' is an iterable of (request_id, request, broker); the
+        # requests are pipelined: up to 'max_in_flight' of them are sent
+        # on each connection before waiting for a response, so requests
+        # to different brokers (and consecutive requests to the same
+        # broker) overlap; (request_id, response) is yielded for each
+        # response, and it is valid only until the next response from
+        # the same broker is read, so decode it before moving on
+        in_flight = collections.deque() # (request_id, conn), in order sent
+        counts = collections.Counter() # conn -> number of requests in flight
+        conn = None
+
+        try:
+            for request_id, request, broker in requests:
+                conn = self.get_connection(broker)
+                if counts[conn] >= max_in_flight:
+                    oldest = next(r for r in in_flight if r[1] is conn)
+                    in_flight.remove(oldest)
+                    counts[conn] -= 1
+                    yield oldest[0], conn.recv(oldest[0])
+                conn.send(request_id, request)
+                in_flight.append((request_id, conn))
+                counts[conn] += 1
+
+            while in_flight:
+                request_id, conn = in_flight.popleft()
+                counts[conn] -= 1
+                yield request_id, conn.recv(request_id)
+
+        except (IOError, GeneratorExit) as exc:
+            if isinstance(exc, IOError):
+                logger.warning(
+                    "conn: %s, %s (errno: %i)", 
+                    conn, 
+                    exc.__class__, 
+                    (-1 if not exc.errno else exc.errno), 
+                    exc_info=False
+                )
+            # responses still in flight would come back to whoever uses
+            # the connections next, so these connections have to be reset
+            for c in set([c for _, c in in_flight] + ([conn] if conn else [])):
+                c.close()
+            raise
+
+
     def send_request(self, request_id, request, broker=None):
 
-        for conn in self.conns:
+        # to the broker, or if it is not set, to whichever broker answers
+        # first, trying the seed brokers first
+        if broker:
+            conns = [self.get_connection(broker)]
+        else:
+            conns = self.conns + [c for c in self.broker_conns.values() if c not in self.conns]
 
-            if broker:
-                if (conn.host, conn.port) != (broker.host, broker.port):
-                    continue
+        for conn in conns:
 
             try:
                 conn.send(request_id, request)
@@ -73,39 +201,83 @@ class KafkaClient(object):
                 )
                 if exc.errno == 32:
                     conn.connect() # this will raise #61 if the broker went away
+                else:
+                    conn.close() # so that a late response isn't read for the next request
                 continue
 
         raise kafka.protocol.BrokerResponseError("no responses from brokers")
 
 
 
-    def get_metadata(self):
+    def get_metadata(self, topics=None):
 
-        self.brokers.clear() # as opposed to self.brokers = {} this will keep the same dict instance
-        self.topics_to_brokers.clear()
-        self.topic_partitions.clear()
+        # with no 'topics', get metadata for self.topics, or if that's not
+        # set, for all the topics; otherwise, only the given topics are
+        # updated, and metadata for the other topics is kept as it is
+        refresh_all = not topics
+        topics = self.topics if refresh_all else list(topics)
 
         try:
             request_id = kafka.client.ID_GEN.next()
-            request = kafka.protocol.encode_metadata_request(self.client_id, request_id, topics=None)
+            request = kafka.protocol.encode_metadata_request(self.client_id, request_id, topics=topics)
 #             logger.debug(base64.b64encode(request)) # get the wire dump
             response = self.send_request(request_id, request)
 #             logger.debug(base64.b64encode(response)) # get the wire dump
-            self.brokers, topics = kafka.protocol.decode_metadata_response(response)
-            for topic, partitions in topics.items():
-                if not partitions: continue
-                self.topic_partitions[topic] = []
-                for partition, meta in partitions.items():
-                    topic_part = kafka.protocol.TopicAndPartition(topic, partition)
-                    self.topics_to_brokers[topic_part] = self.brokers[meta.leader] if meta.leader != -1 else None
-                    self.topic_partitions[topic].append(partition)
-
-            logger.debug(self.topics_to_brokers)
+            brokers, topics_meta = kafka.protocol.decode_metadata_response(response)
 
         except kafka.protocol.BrokerResponseError as exc:
             logger.debug("%r in get_metadata()", exc)
             raise
 
+        # as opposed to self.brokers = {} this will keep the same dict instances
+        self.brokers.clear()
+        self.brokers.update(brokers)
+        if refresh_all:
+            self.topics_to_brokers.clear()
+            self.topic_partitions.clear()
+            self.topics_refreshed.clear()
+        for topic in topics_meta:
+            for partition in self.topic_partitions.pop(topic, []):
+                del self.topics_to_brokers[kafka.protocol.TopicAndPartition(topic, partition)]
+
+        now = time.time()
+        for topic, partitions in topics_meta.items():
+            if not partitions: continue
+            self.topic_partitions[topic] = []
+            self.topics_refreshed[topic] = now
+            for partition, meta in partitions.items():
+                topic_part = kafka.protocol.TopicAndPartition(topic, partition)
+                self.topics_to_brokers[topic_part] = self.brokers[meta.leader] if meta.leader != -1 else None
+                self.topic_partitions[topic].append(partition)
+
+        logger.debug(self.topics_to_brokers)
+        return
+
+
+    def refresh_topic(self, topic):
+
+        # called when the metadata for the topic is older than the ttl
+        # (or was marked stale), or when the topic hasn't been seen yet;
+        # if the refresh fails, the old metadata stays in place
+        try:
+            self.get_metadata([topic])
+        except (IOError, kafka.protocol.BrokerResponseError) as exc:
+            logger.warning("can't refresh metadata for topic: %s; %r", topic, exc)
+        return
+
+
+    def invalidate_topic(self, topic):
+
+        # metadata for the topic will be refreshed on next use
+        if topic in self.topics_refreshed:
+            self.topics_refreshed[topic] = 0
+        return
+
+
+    def _invalidate_requested(self, by_leader):
+        for leader_requests in by_leader.values():
+            for request in leader_requests:
+                self.invalidate_topic(request.topic)
         return
 
 
@@ -124,38 +296,140 @@ class KafkaClient(object):
         return offsets[0]
 
 
+    def commit_offsets(self, group, requests):
+
+        # 'requests' is a list of OffsetCommitRequest, all committed in a
+        # single request, to any broker (v0 offsets are in zookeeper)
+        request_id = kafka.client.ID_GEN.next()
+        encoded = kafka.protocol.encode_offset_commit_request(self.client_id, request_id, group, requests)
+#         logger.debug(base64.b64encode(encoded)) # get the wire dump
+        response = self.send_request(request_id, encoded)
+        return list(kafka.protocol.decode_offset_commit_response(response))
+
+
+    def fetch_offsets(self, group, requests):
+
+        # 'requests' is a list of OffsetFetchRequest, returns a list of
+        # OffsetFetchResponse, offset is -1 where nothing was committed
+        request_id = kafka.client.ID_GEN.next()
+        encoded = kafka.protocol.encode_offset_fetch_request(self.client_id, request_id, group, requests)
+#         logger.debug(base64.b64encode(encoded)) # get the wire dump
+        response = self.send_request(request_id, encoded)
+        return list(kafka.protocol.decode_offset_fetch_response(response))
+
+
     def fetch(self, topic, partition, offset):
 
+        request = kafka.protocol.FetchRequest(topic, partition, offset, FETCH_BUFFER_SIZE_BYTES)
+        messages = self.fetch_multi([request])
+        return messages.get(kafka.protocol.TopicAndPartition(topic, partition), [])
+
+
+    def fetch_iter(self, requests, views=False, max_wait_time=kafka.protocol.FETCH_MAX_WAIT_MS, min_bytes=kafka.protocol.FETCH_MIN_BYTES):
+
+        # yields a FetchResponse for every partition, with 'messages' an
+        # iterator decoding the messages lazily, from the connection's
+        # receive buffer, so consume each response's messages before
+        # moving on to the next response; the brokers hold the response
+        # for up to 'max_wait_time' ms, until they have 'min_bytes' to send
+        # (long poll); with 'views' set, message keys and values are
+        # memoryviews into the receive buffers, and they are valid only
+        # until the next request to the same broker
+
         if not self.brokers:
             self.get_metadata()
 
-        request_id = kafka.client.ID_GEN.next()
-        request = kafka.protocol.FetchRequest(topic, partition, offset, FETCH_BUFFER_SIZE_BYTES)
-        encoded = kafka.protocol.encode_fetch_request(self.client_id, request_id, request)
-#         logger.debug(base64.b64encode(encoded)) # get the wire dump
-#         leader = self.topics_to_brokers[kafka.protocol.TopicAndPartition(topic, partition)]
-        leader = self.get_topic_leader(topic, partition)
-        response = self.send_request(request_id, encoded, broker=leader)
-#         logger.debug(base64.b64encode(response)) # get the wire dump
+        # group the FetchRequests by the broker leading their partition,
+        # and send a single request (for all topics and partitions) to
+        # each broker, instead of doing a round trip per partition
+        by_leader = self.group_by_leader(requests)
+        pipelined = []
+        for leader, leader_requests in by_leader.items():
+            request_id = kafka.client.ID_GEN.next()
+            encoded = kafka.protocol.encode_fetch_request(self.client_id, request_id, leader_requests, max_wait_time=max_wait_time, min_bytes=min_bytes)
+#             logger.debug(base64.b64encode(encoded)) # get the wire dump
+            pipelined.append((request_id, encoded, leader))
+
+        # requests to all the brokers are sent before reading responses
+        try:
+            for request_id, response in self.send_requests(pipelined):
+#                 logger.debug(base64.b64encode(response)) # get the wire dump
+                for r in kafka.protocol.decode_fetch_response(response, views=views):
+                    if r.error in kafka.protocol.LEADER_ERRORS:
+                        self.invalidate_topic(r.topic)
+                    if r.error:
+                        self.metrics.incr('partition_errors', topic=r.topic, partition=r.partition, api='fetch', error=r.error)
+                    else:
+                        self.metrics.gauge('highwater', r.highwaterMark, topic=r.topic, partition=r.partition)
+                    yield r
+
+        except IOError:
+            # the broker may have gone away, and the leadership moved
+            self._invalidate_requested(by_leader)
+            raise
+
 
-        messages = []
-        for r in kafka.protocol.decode_fetch_response(response):
-            for m in r.messages:
-                messages.append(m)
+    def fetch_multi(self, requests, views=False, too_small=None, max_wait_time=kafka.protocol.FETCH_MAX_WAIT_MS, min_bytes=kafka.protocol.FETCH_MIN_BYTES):
+
+        # same as fetch_iter(), but the messages are read into lists; if
+        # 'too_small' is a set, the partitions where not even the first
+        # message fit in the request's max_bytes are added to it (and come
+        # back with no messages), otherwise ConsumerFetchSizeTooSmall is
+        # raised
+        messages = {} # TopicAndPartition -> [OffsetAndMessage, ...]
+        for r in self.fetch_iter(requests, views=views, max_wait_time=max_wait_time, min_bytes=min_bytes):
+            topic_part = kafka.protocol.TopicAndPartition(r.topic, r.partition)
+            try:
+                messages[topic_part] = list(r.messages)
+            except kafka.protocol.ConsumerFetchSizeTooSmall:
+                if too_small is None:
+                    raise
+                too_small.add(topic_part)
+                messages[topic_part] = []
 
         return messages
 
 
     def send(self, topic, partition, messages): 
 
-        request_id = kafka.client.ID_GEN.next()
         request = kafka.protocol.ProduceRequest(topic, partition, messages)
-#         logger.debug(request)
-        encoded = kafka.protocol.encode_produce_request(self.client_id, request_id, request)
-#         logger.debug(base64.b64encode(encoded)) # get the wire dump 
-        leader = self.get_topic_leader(topic, partition)
-        response = self.send_request(request_id, encoded, broker=leader)
-#         logger.debug(base64.b64encode(response)) # get the wire dump
-        responses = list(kafka.protocol.decode_produce_response(response))
-#         logger.debug(responses)
+        responses = self.send_multi([request])
         return responses[0]
+
+
+    def send_multi(self, requests, codec=kafka.protocol.CODEC_NONE):
+
+        # same as with fetch_multi(), one ProduceRequest per leader,
+        # covering all the topics and partitions that broker leads; with
+        # 'codec' set, each partition's messages are compressed together
+        by_leader = self.group_by_leader(requests)
+        # messages are counted out once the broker acks them
+        sent = dict(((r.topic, r.partition), r) for r in requests)
+        pipelined = []
+        for leader, leader_requests in by_leader.items():
+            request_id = kafka.client.ID_GEN.next()
+            encoded = kafka.protocol.encode_produce_request(self.client_id, request_id, leader_requests, codec=codec)
+#             logger.debug(base64.b64encode(encoded)) # get the wire dump 
+            pipelined.append((request_id, encoded, leader))
+
+        responses = []
+        try:
+            for request_id, response in self.send_requests(pipelined):
+#                 logger.debug(base64.b64encode(response)) # get the wire dump
+                for r in kafka.protocol.decode_produce_response(response):
+                    if r.error in kafka.protocol.LEADER_ERRORS:
+                        self.invalidate_topic(r.topic)
+                    if r.error:
+                        self.metrics.incr('partition_errors', topic=r.topic, partition=r.partition, api='produce', error=r.error)
+                    elif (r.topic, r.partition) in sent:
+                        messages = sent[(r.topic, r.partition)].messages
+                        self.metrics.incr('messages_out', len(messages), topic=r.topic, partition=r.partition)
+                        self.metrics.incr('message_bytes_out', sum(len(m.value or '') for m in messages), topic=r.topic, partition=r.partition)
+                    responses.append(r)
+
+        except IOError:
+            self._invalidate_requested(by_leader)
+            raise
+
+#         logger.debug(responses)
+        return responses
@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import zlib
+import struct
+
+try:
+    import snappy
+    _has_snappy = True
+except ImportError:
+    _has_snappy = False
+
+
+GZIP_COMPRESS_LEVEL = 6
+GZIP_WBITS = 16 + zlib.MAX_WBITS # gzip header and trailer, not zlib
+
+# the JVM clients write snappy in the 'xerial' framing (from the
+# snappy-java library): a 16 byte header (magic, version, compatible
+# version), followed by blocks, each prefixed with its compressed size
+XERIAL_HEADER = struct.pack('>8sii', '\x82SNAPPY\x00', 1, 1)
+XERIAL_BLOCK_BYTES = 2**15 # 32KB, same as snappy-java
+
+
+def has_snappy():
+    return _has_snappy
+
+
+def gzip_encode(payload):
+    compressor = zlib.compressobj(GZIP_COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def gzip_decode(payload):
+    return zlib.decompress(payload, GZIP_WBITS)
+
+
+def is_xerial(payload):
+    return payload[:len(XERIAL_HEADER)] == XERIAL_HEADER
+
+
+def snappy_encode(payload, xerial=True, block_size=XERIAL_BLOCK_BYTES):
+
+    if not xerial:
+        return snappy.compress(payload)
+
+    out = [XERIAL_HEADER]
+    for cur in xrange(0, len(payload), block_size):
+        block = snappy.compress(payload[cur:cur + block_size])
+        out.append(struct.pack('>i', len(block)))
+        out.append(block)
+    return "".join(out)
+
+
+def snappy_decode(payload):
+
+    # plain snappy, or xerial framed, whichever it is
+    if not is_xerial(payload):
+        return snappy.decompress(payload)
+
+    out = []
+    cur = len(XERIAL_HEADER)
+    while cur < len(payload):
+        (size,) = struct.unpack_from('>i', payload, cur)
+        cur += 4
+        out.append(snappy.decompress(payload[cur:cur + size]))
+        cur += size
+    return "".join(out)
+
@@ -8,21 +8,76 @@ import logging
 import itertools
 import socket
 import base64
+import errno
+import collections
+import threading
+import time
 
 import kafka.protocol
+import kafka.metrics
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_SOCKET_TIMEOUT_SECONDS = 5
+BUFFER_POOL_MIN_BYTES = 2**12 # 4KB, the smallest size class
+BUFFER_POOL_MAX_FREE = 4 # per size class
+
+
+class BufferPool(object):
+
+    # receive buffers come in power-of-2 size classes, so that a buffer
+    # released by one connection (or by the same connection on a
+    # previous poll) fits the next response of similar size; this way
+    # a 16MB fetch response is not reallocated on every poll
+
+    def __init__(self, min_bytes=BUFFER_POOL_MIN_BYTES, max_free=BUFFER_POOL_MAX_FREE):
+        self.min_bytes = min_bytes
+        self.max_free = max_free
+        self.free = collections.defaultdict(list) # size class -> [bytearray, ...]
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "BufferPool(min_bytes=%i, max_free=%i)" % (self.min_bytes, self.max_free)
+
+    def size_class(self, size_b):
+        size = self.min_bytes
+        while size < size_b:
+            size <<= 1
+        return size
+
+    def acquire(self, size_b):
+        size = self.size_class(size_b)
+        with self.lock:
+            if self.free[size]:
+                return self.free[size].pop()
+        return bytearray(size)
+
+    def release(self, buf):
+        with self.lock:
+            free = self.free[len(buf)]
+            if len(free) < self.max_free:
+                free.append(buf)
+        return
+
+
+BUFFER_POOL = BufferPool()
 
 
 class KafkaConnection(object):
 
-    def __init__(self, host, port, timeout=DEFAULT_SOCKET_TIMEOUT_SECONDS):
+    def __init__(self, host, port, timeout=DEFAULT_SOCKET_TIMEOUT_SECONDS, pool=None, metrics=None):
         self.host = host
         self.port = int(port)
-        self.timeout = float(DEFAULT_SOCKET_TIMEOUT_SECONDS)
+        self.timeout = float(timeout)
         self.sock = None
+        self.pool = pool if pool is not None else BUFFER_POOL
+        self.metrics = metrics if metrics is not None else kafka.metrics.REGISTRY
+        self.broker = "%s:%i" % (self.host, self.port) # metrics tag
+        self.sent_at = {} # request_id -> (api name, time sent), for latency
+        self.header = bytearray(4)
+        self.buffer = None # from self.pool, reused for every response
+        self.in_flight = set() # ids of requests sent, not yet received
+        self.pending = {} # request_id -> response, received out of order
 
     def __str__(self):
         return "('%s', %s)" % (self.host, self.port)
@@ -57,38 +112,112 @@ class KafkaConnection(object):
     def close(self):
         if self.sock: self.sock.close()
         self.sock = None
+        if self.buffer is not None:
+            self.pool.release(self.buffer)
+        self.buffer = None
+        # whatever was in flight on the old socket is gone
+        self.in_flight.clear()
+        self.pending.clear()
+        self.sent_at.clear()
         return
 
     def send(self, request_id, payload):
-        if not self.sock: self.connect()
-        self.sock.sendall(payload)
+        api = self._api(payload)
+        try:
+            if not self.sock: self.connect()
+            self.sock.sendall(payload)
+        except socket.error:
+            self.metrics.incr('errors', broker=self.broker, api=api)
+            raise
+        self._sent(request_id, api, len(payload))
+        return
+
+    def _api(self, payload):
+        # the api key is right after the size prefix
+        return kafka.metrics.api_name(struct.unpack_from('>h', payload, 4)[0]) if len(payload) >= 6 else 'unknown'
+
+    def _sent(self, request_id, api, size_b):
+        self.in_flight.add(request_id)
+        self.sent_at[request_id] = (api, time.time())
+        self.metrics.incr('requests', broker=self.broker, api=api)
+        self.metrics.incr('bytes_out', size_b, broker=self.broker, api=api)
         return
 
-    def _read_bytes(self, size_b):
-        resp = ''
-        data = ''
-        while size_b:
+    def _received(self, request_id, size_b, wait_s):
+        # the response to 'request_id' was read, after waiting 'wait_s'
+        # on the network and the broker (see wait_seconds in kafka.metrics)
+        if request_id not in self.sent_at:
+            return
+        api, sent = self.sent_at.pop(request_id)
+        self.metrics.observe('wait_seconds', wait_s, broker=self.broker, api=api)
+        self.metrics.incr('bytes_in', size_b, broker=self.broker, api=api)
+        return
+
+    def _failed(self):
+        # the connection broke, and every request in flight on it with it
+        for api, sent in self.sent_at.values():
+            self.metrics.incr('errors', broker=self.broker, api=api)
+        self.sent_at.clear()
+        return
+
+    def _read_into(self, view):
+        while len(view):
             try:
-                data = self.sock.recv(size_b)
+                size_b = self.sock.recv_into(view, len(view))
             except socket.error as exc:
 #                 logger.warning('%r (%i)', exc, exc.errno)
                 logger.warning(exc)
                 raise
-            size_b -= len(data)
-            resp += data
-        return resp
+            if not size_b:
+                raise socket.error(errno.ECONNRESET, "connection closed by broker")
+            view = view[size_b:]
+        return
 
 
-    def recv(self, request_id):
-        if not self.sock: self.connect()
+    def _read_response(self):
         # read header
-#         resp = self.sock.recv(4, socket.MSG_WAITALL)
-        resp = self._read_bytes(4)
-        (size,) = struct.unpack('>i', resp)
+        self._read_into(memoryview(self.header))
+        (size,) = struct.unpack_from('>i', self.header)
+        if self.buffer is None or len(self.buffer) < size:
+            if self.buffer is not None:
+                self.pool.release(self.buffer)
+            self.buffer = self.pool.acquire(size)
         # read the rest of the message
-#         resp = self.sock.recv(size, socket.MSG_WAITALL)
-        resp = self._read_bytes(size)
-        data = str(resp)
+        data = memoryview(self.buffer)[:size]
+        self._read_into(data)
         return data
 
 
+    def recv(self, request_id):
+        # the returned memoryview is over this connection's receive
+        # buffer, and it is valid only until the next call to recv() or
+        # close(); whatever needs to outlive that has to be copied out
+        if not self.sock: self.connect()
+
+        if request_id in self.pending:
+            self.in_flight.discard(request_id)
+            return memoryview(self.pending.pop(request_id))
+
+        # many requests can be in flight on the connection at once, the
+        # responses are matched to requests on their correlation id
+        # (the broker answers in order, so normally the first response
+        # read is the one asked for)
+        while True:
+            # only the time blocked on the socket counts as the wait, not
+            # whatever the caller did with the responses read before
+            t1 = time.time()
+            try:
+                data = self._read_response()
+            except socket.error:
+                self._failed()
+                raise
+            (correlation_id,) = struct.unpack_from('>i', data)
+            self._received(correlation_id, len(data) + 4, time.time() - t1)
+            if correlation_id == request_id:
+                self.in_flight.discard(request_id)
+                return data
+            if correlation_id in self.in_flight:
+                self.pending[correlation_id] = data.tobytes()
+            else:
+                logger.warning("conn: %s, discarding response to unknown request: %i", self, correlation_id)
+
@@ -6,12 +6,17 @@ import logging
 import time
 import argparse
 import os.path
-import json
-import sys
+import threading
+import Queue
+import collections
 
 import kafka.log
+import kafka.connection
 import kafka.client
 import kafka.protocol
+import kafka.offsets
+import kafka.framing
+import kafka.metrics
 
 
 logger = logging.getLogger(__name__)
@@ -21,22 +26,138 @@ OFFSETS_FILE_PATH = os.path.expanduser("~/.kafka-consumer.offsets")
 WHENCE_SAVED = 0
 WHENCE_HEAD = -2 # see offset api in https://cwiki.apache.org/confluence/display/KAFKA/A+Guide+To+The+Kafka+Protocol
 WHENCE_TAIL = -1
+FETCH_MEMORY_BYTES = 2**26 # 64MB, max_bytes of all the partitions in a fetch (and in the prefetched batches) together
+FETCH_MIN_PARTITION_BYTES = 2**16 # 64KB, per partition, regardless of the memory budget
+FETCH_MAX_PARTITION_BYTES = 2**27 # 128MB, how far a partition's max_bytes grows to fit a large message
+OFFSETS_COMMIT_INTERVAL_SECONDS = 5 # with broker_offsets, how often commit() sends the offsets to the broker
+IDLE_SLEEP_MIN_SECONDS = 0.01 # cli, backoff after an empty fetch, doubled on each empty fetch ...
+IDLE_SLEEP_MAX_SECONDS = 1 # ... up to this
 
 class KafkaConsumerError(RuntimeError): pass
 
 
+ConsumedMessage = collections.namedtuple("ConsumedMessage", ["partition", "offset", "key", "value"])
+
+
+class Prefetcher(threading.Thread):
+
+    # fetches batches for the consumer in the background, while the
+    # previous batch is being processed; batches are queued (at most
+    # 'size' of them, so that memory stays capped) together with the
+    # offsets they were fetched from, and the offsets they end at; the
+    # consumer only takes a batch that starts exactly at its committed
+    # offsets, so commit() / rollback() / seek() work as without the
+    # prefetcher - after a rollback the queued batches are discarded,
+    # and the prefetcher goes back to the committed offsets
+
+    def __init__(self, consumer, offsets, size):
+        super(Prefetcher, self).__init__(name="kafka-prefetcher")
+        self.daemon = True
+        self.consumer = consumer
+        self.queue = Queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.cursor = offsets.copy() # where the next fetch starts
+        self.generation = 0 # bumped on every reset()
+
+    def __repr__(self):
+        return "Prefetcher(%r, %r, %i)" % (self.consumer, self.cursor, self.queue.maxsize)
+
+    def reset(self, offsets):
+        with self.lock:
+            self.cursor = offsets.copy()
+            self.generation += 1
+        return
+
+    def stop(self):
+        self.stopped.set()
+        return
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                continue
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                # the consumer owns (and changes) the dicts it gets, so
+                # the prefetcher only ever hands out copies
+                with self.lock:
+                    generation, start = self.generation, self.cursor.copy()
+                values, end = self.consumer._fetch(start)
+                with self.lock:
+                    # unless reset() was called in the meantime
+                    if self.generation == generation:
+                        self.cursor = end
+                self._put((start, values, end.copy()))
+
+        except Exception as exc:
+            logger.warning("prefetcher stopped: %r", exc)
+            self._put((None, exc, None))
+
+    def get(self, offsets):
+
+        # next batch starting at 'offsets': (values, offsets after values)
+        reset = False
+        while True:
+            try:
+                start, values, end = self.queue.get(timeout=1)
+            except Queue.Empty:
+                if not self.is_alive():
+                    raise KafkaConsumerError("prefetcher is not running")
+                continue
+            if start is None:
+                raise values
+            if start == offsets:
+                return values, end
+            # fetched from offsets other than the committed ones (after a
+            # rollback, or seek), so discard, and restart from 'offsets'
+            if not reset:
+                self.reset(offsets)
+                reset = True
+
+
 class KafkaConsumer(object):
 
-    def __init__(self, hosts="", group="", topic="", failfast=False, whence=WHENCE_SAVED, offsets_file_path=""):
+    def __init__(self, hosts="", group="", topic="", failfast=False, whence=WHENCE_SAVED, offsets_file_path="", prefetch=0, fetch_memory=FETCH_MEMORY_BYTES, max_fetch_bytes=FETCH_MAX_PARTITION_BYTES, max_wait_time=kafka.protocol.FETCH_MAX_WAIT_MS, min_bytes=kafka.protocol.FETCH_MIN_BYTES, broker_offsets=False, checkpoint_seconds=kafka.offsets.CHECKPOINT_EVERY_N_SECONDS, checkpoint_messages=kafka.offsets.CHECKPOINT_EVERY_N_MESSAGES, metrics=None):
+        # the broker holding the fetch longer than this would look like a dead connection
+        if max_wait_time >= kafka.connection.DEFAULT_SOCKET_TIMEOUT_SECONDS * 1000:
+            raise KafkaConsumerError("max_wait_time must be under the socket timeout: %is" % kafka.connection.DEFAULT_SOCKET_TIMEOUT_SECONDS)
         self.failfast = failfast
         self.hosts = hosts
-        self.client = kafka.client.KafkaClient(hosts)
+        self.metrics = metrics if metrics is not None else kafka.metrics.REGISTRY
+        self.client = kafka.client.KafkaClient(hosts, topics=([topic] if topic else None), metrics=self.metrics)
         self.group = group
         self.topic = topic
         self.whence = whence
         self.offsets_file_path = offsets_file_path
         self.offsets = {} # {partition: offset}
         self.offsets_pending = {}
+        self.prefetch = prefetch # if set, number of batches to fetch ahead
+        self.prefetcher = None
+        self.fetch_memory = fetch_memory
+        self.max_fetch_bytes = max_fetch_bytes
+        self.fetch_sizes = {} # {partition: max_bytes}, for partitions grown past their share
+        # the broker holds a fetch for up to 'max_wait_time' ms, until it
+        # has 'min_bytes' for it; with min_bytes=1 a fetch returns as soon
+        # as there is any message (long poll)
+        self.max_wait_time = max_wait_time
+        self.min_bytes = min_bytes
+        # if set, the group's offsets are kept by the brokers, instead of
+        # in the offsets file
+        self.broker_offsets = broker_offsets
+        self.offsets_client = None # for offset commits while prefetching
+        self.offsets_committed_at = time.time()
+        # otherwise they are kept in the offsets log file, and saved in the
+        # background, every 'checkpoint_seconds' or 'checkpoint_messages'
+        self.offsets_log = None
+        self.checkpoint_seconds = checkpoint_seconds
+        self.checkpoint_messages = checkpoint_messages
+        self.checkpointer = None
         logger.debug("created consumer: %r", self)
 
 
@@ -47,15 +168,25 @@ class KafkaConsumer(object):
     def __exit__(self, exctype, value, tb): 
     	if exctype and not (exctype == KeyboardInterrupt):
     		logger.error("exiting with error: %s, %s", exctype, tb)
-        self.client.close()
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher.join(kafka.connection.DEFAULT_SOCKET_TIMEOUT_SECONDS)
+        if self.checkpointer:
+            self.checkpointer.stop()
+            self.checkpointer.join()
         self.save_offsets()
+        self.client.close()
+        if self.offsets_client:
+            self.offsets_client.close()
+        if self.offsets_log:
+            self.offsets_log.close()
         return False # http://docs.python.org/2/reference/datamodel.html#object.__exit__
         
         
     
     def __repr__(self):
-        return "KafkaConsumer(hosts='%s', group='%s', topic='%s', failfast=%s, whence=%i, offsets_file_path='%s')" % \
-            (self.hosts, self.group, self.topic, self.failfast, self.whence, self.offsets_file_path)
+        return "KafkaConsumer(hosts='%s', group='%s', topic='%s', failfast=%s, whence=%i, offsets_file_path='%s', prefetch=%i, fetch_memory=%i, max_fetch_bytes=%i, max_wait_time=%i, min_bytes=%i, broker_offsets=%s, checkpoint_seconds=%f, checkpoint_messages=%i)" % \
+            (self.hosts, self.group, self.topic, self.failfast, self.whence, self.offsets_file_path, self.prefetch, self.fetch_memory, self.max_fetch_bytes, self.max_wait_time, self.min_bytes, self.broker_offsets, self.checkpoint_seconds, self.checkpoint_messages)
 
 
     def init_offsets(self):
@@ -73,34 +204,42 @@ class KafkaConsumer(object):
         return
 
 
+    def get_offsets_log(self):
+        if not self.offsets_log:
+            self.offsets_log = kafka.offsets.OffsetLog(self.offsets_file_path)
+        return self.offsets_log
+
+
     def load_offsets(self):
 
         if not self.group:
             return
 
-        try: 
-            with open(self.offsets_file_path, "rU") as f:
-                offsets = f.read()
-            offsets = json.loads(offsets)
-            # json doesn't allow integer keys, all keys are strings,
-            # so here the partition keys need to be coneverted back to ints
-            if self.group in offsets: 
-                self.offsets = {int(k): v for k, v in offsets[self.group][self.topic].items()}
-                logger.debug("loaded offsets from file: %s, %s", self.offsets_file_path, self.offsets)
-            else:
-                logger.debug("group %s not in offsets file, skipping offset load", self.group)
-                pass
+        if self.broker_offsets:
+            self.load_broker_offsets()
+            return
+
+        try:
+            offsets = self.get_offsets_log().get(self.group, self.topic)
 
-        except IOError as exc: 
+        except (IOError, OSError) as exc:
             logger.warning("can't open offsets file: %s", exc)
             if self.failfast:
-                raise KafkaConsumerError("can't open offsets file: %s", self.offsets_file_path)
-        
-        except (ValueError, KeyError, TypeError) as exc: 
-            logger.warning("can't parse offsets file: %s", exc)
+                raise KafkaConsumerError("can't open offsets file: %s" % self.offsets_file_path)
+            return
+
+        except kafka.offsets.OffsetLogError as exc:
+            logger.warning(exc)
             if self.failfast:
-                raise KafkaConsumerError("can't parse offsets file: %s, fix it by hand or delete it", self.offsets_file_path)
-        
+                raise KafkaConsumerError(str(exc))
+            return
+
+        if offsets:
+            self.offsets.update(offsets)
+            logger.debug("loaded offsets from file: %s, %s", self.offsets_file_path, self.offsets)
+        else:
+            logger.debug("group %s not in offsets file, skipping offset load", self.group)
+
         return
         
 
@@ -128,35 +267,79 @@ class KafkaConsumer(object):
             return            
 
 
+    def get_offsets_client(self):
+
+        # while the prefetcher is running it has the consumer's client to
+        # itself, so offsets are committed over a separate one
+        if not self.prefetcher:
+            return self.client
+        if not self.offsets_client:
+            self.offsets_client = kafka.client.KafkaClient(self.hosts, topics=[self.topic])
+        return self.offsets_client
+
+
+    def load_broker_offsets(self):
+
+        requests = [kafka.protocol.OffsetFetchRequest(self.topic, partition) for partition in self.offsets]
+        try:
+            responses = self.get_offsets_client().fetch_offsets(self.group, requests)
+
+        except (IOError, kafka.protocol.BrokerResponseError) as exc:
+            logger.warning("can't fetch offsets for group: %s; %r", self.group, exc)
+            if self.failfast:
+                raise KafkaConsumerError("can't fetch offsets for group: %s" % self.group)
+            return
+
+        for r in responses:
+            # -1 means that nothing was committed for the partition yet
+            if r.error or r.offset < 0 or r.partition not in self.offsets:
+                logger.debug("no offset for group: %s, %r", self.group, r)
+                continue
+            self.offsets[r.partition] = r.offset
+        logger.debug("loaded offsets from brokers: %s", self.offsets)
+        return
+
+
+    def save_broker_offsets(self):
+
+        if not self.offsets:
+            return
+
+        # all the partitions of the topic in a single request
+        requests = [kafka.protocol.OffsetCommitRequest(self.topic, partition, offset, "") for partition, offset in self.offsets.items()]
+        try:
+            responses = self.get_offsets_client().commit_offsets(self.group, requests)
+
+        except (IOError, kafka.protocol.BrokerResponseError) as exc:
+            logger.warning("can't commit offsets for group: %s; %r", self.group, exc)
+            if self.failfast:
+                raise KafkaConsumerError("can't commit offsets for group: %s" % self.group)
+            return
+
+        for r in responses:
+            if r.error:
+                logger.warning("can't commit offset for group: %s, %r", self.group, r)
+        self.offsets_committed_at = time.time()
+        logger.debug("committed offsets to brokers: %s", self.offsets)
+        return
+
+
     def save_offsets(self):
     
         if not self.group:
             return
+
+        if self.broker_offsets:
+            self.save_broker_offsets()
+            return
         
-        try: 
-            with open(self.offsets_file_path, "rU") as f:
-                offsets = f.read()
-                offsets = json.loads(offsets)
-        except IOError, ValueError:
-            logger.warning("can't open offsets file (for update before saving): %s", exc)
-            offsets = {}
-        except Exception as exc:
-            logger.warning(exc, exc_info=True)
-            offsets = {}
-
-        try: 
-            group_offsets = offsets.setdefault(self.group, {})
-            group_offsets[self.topic] = self.offsets
-#             logger.debug(offsets)
-#             logger.debug(json.dumps(offsets))
-            with open(self.offsets_file_path, "w") as f:
-                f.write(json.dumps(offsets))
-            logger.debug("saved offsets to file: %s", self.offsets_file_path)
-
-        except IOError as exc: 
-            logger.warning("can't open offsets file: %s", exc)
-        except Exception as exc: 
-            logger.warning("can't open offsets file: %s", exc)
+        try:
+            count = self.get_offsets_log().save(self.group, self.topic, dict(self.offsets))
+            if count:
+                logger.debug("saved offsets for %i partitions to file: %s", count, self.offsets_file_path)
+
+        except (IOError, OSError, kafka.offsets.OffsetLogError) as exc:
+            logger.warning("can't save offsets to file: %s", exc)
 
         return
     
@@ -166,9 +349,14 @@ class KafkaConsumer(object):
         if not self.offsets_pending:
             return
 
+        if self.checkpointer:
+            self.checkpointer.committed(sum(o - self.offsets.get(p, o) for p, o in self.offsets_pending.items()))
         self.offsets = self.offsets_pending
         self.offsets_pending = {}
 
+        if self.group and self.broker_offsets and self.offsets_committed_at + OFFSETS_COMMIT_INTERVAL_SECONDS < time.time():
+            self.save_broker_offsets()
+
         return
 
 
@@ -178,34 +366,194 @@ class KafkaConsumer(object):
         return
 
 
-    def fetch(self):
+    def _fetch_sizes(self, partitions):
 
-        if not self.offsets:
-            self.seek()
+        # the memory budget (shared by the batches being prefetched) is
+        # split evenly between the partitions, except for the partitions
+        # which had a message too big for their share, and were grown
+        budget = self.fetch_memory // (self.prefetch + 1)
+        grown = [p for p in partitions if p in self.fetch_sizes]
+        budget -= sum(self.fetch_sizes[p] for p in grown)
+        share = budget // max(1, len(partitions) - len(grown))
+        share = max(FETCH_MIN_PARTITION_BYTES, min(kafka.client.FETCH_BUFFER_SIZE_BYTES, self.max_fetch_bytes, share))
+        sizes = {p: share for p in partitions}
+        sizes.update((p, self.fetch_sizes[p]) for p in grown)
+        return sizes, share
 
-        # commit pending offsets before doing a read
-        self.commit()
 
-        self.offsets_pending = self.offsets.copy()
-        values = []
+    def _grow(self, partition, size, offset):
+
+        # double the partition's max_bytes, up to max_fetch_bytes; returns
+        # False if the partition is already there, and can't grow
+        if size >= self.max_fetch_bytes:
+            logger.error("topic: %s, partition: %i, message at offset: %i is bigger than max_fetch_bytes: %i", self.topic, partition, offset, self.max_fetch_bytes)
+            if self.failfast:
+                raise kafka.protocol.ConsumerFetchSizeTooSmall("message at offset: %i, partition: %i, is bigger than max_fetch_bytes" % (offset, partition))
+            return False
+        self.fetch_sizes[partition] = min(size * 2, self.max_fetch_bytes)
+        logger.info("topic: %s, partition: %i, fetch size grown to: %i", self.topic, partition, self.fetch_sizes[partition])
+        return True
+
+
+    def _shrink(self, partition, largest, share):
+
+        # once the large messages are through, go back towards the share;
+        # 'largest' is the size of the largest message just fetched
+        size = self.fetch_sizes[partition] // 2
+        if largest * 2 > size:
+            return
+        if size <= share:
+            del self.fetch_sizes[partition]
+        else:
+            self.fetch_sizes[partition] = size
+        return
+
 
-        for partition in self.offsets:
+    def _iter_fetch(self, offsets):
 
+        # fetch from 'offsets', yield (partition, OffsetAndMessage) as the
+        # messages are decoded from the response; partitions where the
+        # first message didn't fit are fetched again, with max_bytes
+        # doubled, until the message fits (or max_fetch_bytes)
+        grown = set()
+        todo = offsets
+        while todo:
+            sizes, share = self._fetch_sizes(offsets)
+            requests = [kafka.protocol.FetchRequest(self.topic, partition, offset, sizes[partition]) for partition, offset in todo.items()]
+            retry = {}
             try:
-                messages = self.client.fetch(self.topic, partition, self.offsets[partition])
-                offset = max(messages, key=lambda x: x.offset) if messages else None
-                if offset: self.offsets_pending[partition] = offset.offset + 1
-                for m in messages:
-                    values.append(m.message.value)
+                for r in self.client.fetch_iter(requests, max_wait_time=self.max_wait_time, min_bytes=self.min_bytes):
+                    if r.topic != self.topic or r.partition not in offsets:
+                        continue
+                    largest = 0
+                    count = 0
+                    size_b = 0
+                    next_offset = offsets[r.partition]
+                    try:
+                        for m in r.messages:
+                            # a compressed message set comes back whole,
+                            # even if the fetch offset points into its middle
+                            if m.offset < offsets[r.partition]:
+                                continue
+                            message_b = len(m.message.key or '') + len(m.message.value or '')
+                            largest = max(largest, message_b)
+                            count += 1
+                            size_b += message_b
+                            next_offset = m.offset + 1
+                            yield r.partition, m
+                    except kafka.protocol.ConsumerFetchSizeTooSmall:
+                        if self._grow(r.partition, sizes[r.partition], offsets[r.partition]):
+                            grown.add(r.partition)
+                            retry[r.partition] = offsets[r.partition]
+                        continue
+                    finally:
+                        self._record_fetched(r, count, size_b, next_offset)
+                    if r.partition in self.fetch_sizes and r.partition not in grown:
+                        self._shrink(r.partition, largest, share)
 
             except (IOError, kafka.protocol.BrokerResponseError) as exc:
-                logger.warning("fetching topic: %s, partition: %i; %r" % (self.topic, partition, exc))
+                logger.warning("fetching topic: %s, partitions: %s; %r" % (self.topic, sorted(todo), exc))
                 if self.failfast:
                     raise
+                return
+
+            todo = retry
+
+
+    def _record_fetched(self, response, count, size_b, next_offset):
+
+        # lag is how far behind the partition's high water mark the
+        # consumer is, after the messages from the response
+        if count:
+            self.metrics.incr('messages_in', count, topic=self.topic, partition=response.partition)
+            self.metrics.incr('message_bytes_in', size_b, topic=self.topic, partition=response.partition)
+        if not response.error:
+            self.metrics.gauge('lag', max(0, response.highwaterMark - next_offset), topic=self.topic, partition=response.partition)
+        return
 
+
+    def _fetch(self, offsets):
+
+        # fetch from 'offsets', return (values, offsets after the values);
+        # fetch_seconds covers the requests, waiting for the responses,
+        # and decoding them (see kafka.metrics)
+        t1 = time.time()
+        pending = offsets.copy()
+        values = []
+        for partition, m in self._iter_fetch(offsets):
+            pending[partition] = m.offset + 1
+            values.append(m.message.value)
+        self.metrics.observe('fetch_seconds', time.time() - t1, topic=self.topic)
+        return values, pending
+
+
+    def _start_checkpointer(self):
+        if self.group and not self.broker_offsets and not self.checkpointer:
+            self.checkpointer = kafka.offsets.Checkpointer(self.save_offsets, seconds=self.checkpoint_seconds, messages=self.checkpoint_messages)
+            self.checkpointer.start()
+        return
+
+
+    def fetch(self):
+
+        if not self.offsets:
+            self.seek()
+
+        self._start_checkpointer()
+
+        # commit pending offsets before doing a read
+        self.commit()
+
+        if not self.prefetch:
+            values, self.offsets_pending = self._fetch(self.offsets)
+            return values
+
+        # from here on the client is used only by the prefetcher thread
+        if not self.prefetcher:
+            self.prefetcher = Prefetcher(self, self.offsets, self.prefetch)
+            self.prefetcher.start()
+        values, self.offsets_pending = self.prefetcher.get(self.offsets)
         return values
 
 
+    def __iter__(self):
+
+        # for message in consumer: ... yields ConsumedMessage, decoding
+        # the messages one at a time, as they are asked for, so memory
+        # holds the fetch responses (whose buffers are reused) and what
+        # the caller keeps, instead of every message of every partition;
+        # offsets_pending advances past each message as it is yielded, and
+        # it is committed when the next fetch is made (as with fetch())
+        if self.prefetcher:
+            raise KafkaConsumerError("can't iterate over a consumer which is prefetching")
+
+        if not self.offsets:
+            self.seek()
+
+        self._start_checkpointer()
+
+        idle = 0
+        while True:
+            self.commit()
+            self.offsets_pending = self.offsets.copy()
+            t1 = time.time()
+            count = 0
+            for partition, m in self._iter_fetch(self.offsets):
+                self.offsets_pending[partition] = m.offset + 1
+                count += 1
+                yield ConsumedMessage(partition, m.offset, m.message.key, m.message.value)
+
+            # the broker waits for messages (see max_wait_time), back off
+            # only if the fetches come back empty right away, say on errors
+            if count:
+                idle = 0
+            else:
+                idle = min(self.max_wait_time / 1000.0, max(IDLE_SLEEP_MIN_SECONDS, idle * 2))
+                wait = t1 + idle - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+
 
 def args_parser():
 
@@ -217,8 +565,8 @@ when there is a problem with connection to individual broker, the
 connection will be retried.
 
 If you set the 'group' argument, then offsets will be read from the
-file specified with the 'offsets' argument. Setting 'head' or 'tail'
-will override that. 
+file specified with the 'offsets' argument (or from the brokers, with
+'broker-offsets'). Setting 'head' or 'tail' will override that. 
 
 Output 'plays nice' with pipes and named pipes. Specifically, if you are
 outputting to a named pipe (with the 'output' argument), the consumer
@@ -238,8 +586,22 @@ previous process left off.
     whence = parser.add_mutually_exclusive_group()
     whence.add_argument('--head', action='store_true', help='read from the beginning')
     whence.add_argument('--tail', action='store_true', help="read only 'new' messages")
+    parser.add_argument('--broker-offsets', action='store_true', help="keep the group's offsets in kafka, instead of in the offsets file")
     parser.add_argument('--offsets', metavar='PATH', type=str, action='store', default=OFFSETS_FILE_PATH, help="'%(default)s'")
+    parser.add_argument('--checkpoint-seconds', metavar='N', type=float, action='store', default=kafka.offsets.CHECKPOINT_EVERY_N_SECONDS, help="save offsets to the offsets file every N seconds ...; (%(default)s)")
+    parser.add_argument('--checkpoint-messages', metavar='N', type=int, action='store', default=kafka.offsets.CHECKPOINT_EVERY_N_MESSAGES, help="... or every N messages; (%(default)s)")
     parser.add_argument('--output', metavar='PATH', type=str, action='store', default='/dev/stdout', help="output in 'append' mode; ('%(default)s')")
+    parser.add_argument('--framing', choices=kafka.framing.FRAMINGS, action='store', default='newline', help="message separator, 'length' prefixes every message with its 4 byte big endian length, for binary payloads; (%(default)s)")
+    parser.add_argument('--output-buffer', metavar='BYTES', type=int, action='store', default=kafka.framing.OUTPUT_BUFFER_BYTES, help="(%(default)s)")
+    parser.add_argument('--prefetch', metavar='N', type=int, action='store', default=0, help="fetch up to N batches ahead, while writing output; (%(default)s)")
+    parser.add_argument('--fetch-memory', metavar='BYTES', type=int, action='store', default=FETCH_MEMORY_BYTES, help="max bytes fetched at once, from all partitions together; (%(default)s)")
+    parser.add_argument('--follow', '-f', action='store_true', help="long poll: the broker returns messages as soon as there are any, instead of the consumer sleeping when there are none; implied by --tail")
+    parser.add_argument('--max-wait', metavar='MS', type=int, action='store', default=kafka.protocol.FETCH_MAX_WAIT_MS, help="how long the broker waits for --min-bytes; (%(default)s)")
+    parser.add_argument('--min-bytes', metavar='BYTES', type=int, action='store', default=None, help="how much the broker waits for; (%i, 1 with --follow)" % kafka.protocol.FETCH_MIN_BYTES)
+    parser.add_argument('--max-fetch-bytes', metavar='BYTES', type=int, action='store', default=FETCH_MAX_PARTITION_BYTES, help="largest message that can be consumed; (%(default)s)")
+    parser.add_argument('--metrics-file', metavar='PATH', type=str, action='store', default=None, help="append client metrics to this file, as JSON lines; (%(default)s)")
+    parser.add_argument('--metrics-statsd', metavar='PORT', type=int, action='store', default=None, help="send client metrics to a statsd on localhost; (%(default)s)")
+    parser.add_argument('--metrics-seconds', metavar='N', type=float, action='store', default=kafka.metrics.REPORT_EVERY_N_SECONDS, help="(%(default)s)")
     
 
     return parser
@@ -250,60 +612,60 @@ def main():
     args = args_parser().parse_args()
     kafka.log.set_up_logging(level=logging.ERROR-(args.verbose*10))
 
-    output_fh = None
+    sink = kafka.framing.OutputSink(args.output, framing=args.framing, buffer_bytes=args.output_buffer)
+    reporter = kafka.metrics.start_reporter(path=args.metrics_file, statsd_port=args.metrics_statsd, seconds=args.metrics_seconds)
     
     try: 
 
         if args.head: whence = WHENCE_HEAD
         elif args.tail: whence = WHENCE_TAIL
         else: whence = WHENCE_SAVED
+
+        follow = args.follow or args.tail
+        if args.min_bytes is not None: min_bytes = args.min_bytes
+        elif follow: min_bytes = 1
+        else: min_bytes = kafka.protocol.FETCH_MIN_BYTES
+        # when following, the broker does the waiting, and the consumer
+        # backs off (at most for as long as the broker would wait) only
+        # if the fetches come back empty right away, say on errors
+        idle_max = args.max_wait / 1000.0 if follow else IDLE_SLEEP_MAX_SECONDS
+        idle = 0
         
-        with KafkaConsumer(hosts=args.hosts, group=args.group, topic=args.topic, failfast=args.failfast, whence=whence, offsets_file_path=args.offsets) as consumer:
+        with KafkaConsumer(hosts=args.hosts, group=args.group, topic=args.topic, failfast=args.failfast, whence=whence, offsets_file_path=args.offsets, prefetch=args.prefetch, fetch_memory=args.fetch_memory, max_fetch_bytes=args.max_fetch_bytes, max_wait_time=args.max_wait, min_bytes=min_bytes, broker_offsets=args.broker_offsets, checkpoint_seconds=args.checkpoint_seconds, checkpoint_messages=args.checkpoint_messages) as consumer:
 
             while True:
 
                 t1 = time.time()
                 messages = consumer.fetch()
-                bytesize = sum([len(m) for m in messages])
+                fetch_s = time.time() - t1
+                bytesize = sum([len(m or '') for m in messages])
                 if messages:
                     logger.debug("took %.2fs to fetch %i messages, bytesize: %i", time.time()-t1, len(messages), bytesize)
 
                 t1 = time.time()
-                for message in messages:
-                    # the reason why i don't just open the output file
-                    # once is that i want to reconnect gracefully if the
-                    # output file disappeared at some point while the
-                    # program is running - say if a named pipe was
-                    # deleted, but then put back in place
-                    for retry in range(3): 
-                        try: 
-                            output_fh.write("%s\n" % message)
-                            break
-                        except (IOError, AttributeError) as exc: 
-                            logger.debug(exc)
-                            if args.output == '/dev/stdout': 
-                                output_fh = sys.stdout
-                            else:
-                                output_fh = open(os.path.abspath(args.output), 'a', buffering=1)
-                            logger.debug("opened %r (%s) for output", output_fh, args.output)
-
-#                     output_fh.flush()
+                sink.write(messages)
                 if messages:
                     logger.debug("took %.2fs to output %i messages, bytesize: %i", time.time()-t1, len(messages), bytesize)
 
-                # if there were no messages, sleep for a bit
-                if not messages: 
-                    time.sleep(1)
+                # if there were no messages, back off for a bit; the
+                # time the broker spent waiting counts towards that
+                if messages:
+                    idle = 0
+                else:
+                    idle = min(idle_max, max(IDLE_SLEEP_MIN_SECONDS, idle * 2))
+                    if idle > fetch_s:
+                        time.sleep(idle - fetch_s)
 
 
     except KeyboardInterrupt:
         logger.info("keyboard interrupt")
         
     finally:
-        if output_fh:
-            output_fh.flush()
-            output_fh.close()
-            logger.debug("flushed and closed output file: %r (%s)", output_fh, args.output)
+        sink.close()
+        if reporter:
+            reporter.stop()
+            reporter.join()
+        logger.debug("flushed and closed output: %r", sink)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+
+import sys
+import os
+import os.path
+import stat
+import struct
+import logging
+import select
+import time
+import mmap
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_BUFFER_BYTES = 2**20 # 1MB
+OUTPUT_RETRIES = 3
+INPUT_CHUNK_BYTES = 2**20 # 1MB, read() size for pipes
+INPUT_BATCH_BYTES = 2**20 # 1MB, read_batches() yields batches about this big ...
+INPUT_BATCH_SECONDS = 2 # ... or whatever came in this long, if the input is slow
+# messages are separated with a delimiter (which then can't be in the
+# messages), or prefixed with their 4 byte, big endian length (so they
+# can be anything); a null message is empty, or with length -1
+DELIMITERS = {
+    'newline': "\n",
+    'nul': "\0",
+}
+FRAMINGS = sorted(DELIMITERS) + ['length']
+
+_LENGTH = struct.Struct('>i')
+
+
+def encode_batch(values, framing='newline'):
+
+    # all the values, framed, in a single string, so that a batch goes
+    # out in one write()
+    if framing == 'length':
+        parts = [None] * (2 * len(values))
+        parts[0::2] = [_LENGTH.pack(-1 if v is None else len(v)) for v in values]
+        parts[1::2] = [v or "" for v in values]
+        return "".join(parts)
+
+    delimiter = DELIMITERS[framing]
+    if not values:
+        return ""
+    if None in values:
+        values = [v or "" for v in values]
+    return delimiter.join(values) + delimiter
+
+
+class OutputSink(object):
+
+    # writes batches of messages to a file, named pipe, or stdout: each
+    # batch is framed into one string, and written through a large
+    # buffer, then flushed, so that it takes a single write() call. The
+    # file isn't just opened once: if the output disappears while the
+    # program is running (say a named pipe is deleted, and then put back
+    # in place, or whatever process was reading from the pipe goes away
+    # with EPIPE), the file is reopened, and the batch written again
+
+    def __init__(self, path='/dev/stdout', framing='newline', buffer_bytes=OUTPUT_BUFFER_BYTES, retries=OUTPUT_RETRIES):
+        if framing not in FRAMINGS:
+            raise ValueError("unknown framing: %s" % framing)
+        self.path = path
+        self.framing = framing
+        self.buffer_bytes = buffer_bytes
+        self.retries = retries
+        self.fh = None
+
+    def __repr__(self):
+        return "OutputSink('%s', framing='%s', buffer_bytes=%i)" % (self.path, self.framing, self.buffer_bytes)
+
+    def open(self):
+        self.close()
+        if self.path in ('/dev/stdout', '-'):
+            self.fh = sys.stdout
+        else:
+            self.fh = open(os.path.abspath(self.path), 'ab', self.buffer_bytes)
+        logger.debug("opened %r (%s) for output", self.fh, self.path)
+        return
+
+    def close(self):
+        if self.fh is None:
+            return
+        try:
+            self.fh.flush()
+            if self.fh is not sys.stdout:
+                self.fh.close()
+        except IOError as exc:
+            logger.debug(exc)
+        self.fh = None
+        return
+
+    def write(self, values):
+
+        # returns the number of bytes written; raises the last IOError if
+        # the batch couldn't be written in 'retries' attempts
+        data = encode_batch(values, self.framing)
+        if not data:
+            return 0
+        for retry in range(self.retries):
+            try:
+                if self.fh is None:
+                    self.open()
+                self.fh.write(data)
+                self.fh.flush()
+                return len(data)
+            except IOError as exc:
+                logger.debug("%r (attempt: %i)", exc, retry + 1)
+                self._discard()
+                error = exc
+        raise error
+
+    def _discard(self):
+        # whatever is left in the buffer was for the old file, and closing
+        # it tries to flush that (and fails), but the file is closed anyway
+        try:
+            if self.fh not in (None, sys.stdout):
+                self.fh.close()
+        except IOError:
+            pass
+        self.fh = None
+        return
+
+
+def split_delimited(data, delimiter):
+    # -> [message, ...], whatever is left after the last delimiter
+    messages = data.split(delimiter)
+    leftover = messages.pop()
+    return messages, leftover
+
+
+def split_length(data):
+    # -> [message, ...], whatever is left after the last whole message
+    messages = []
+    cur = 0
+    while cur + _LENGTH.size <= len(data):
+        (size,) = _LENGTH.unpack_from(data, cur)
+        if size < 0:
+            messages.append(None)
+            cur += _LENGTH.size
+            continue
+        if len(data) < cur + _LENGTH.size + size:
+            break
+        messages.append(data[cur + _LENGTH.size:cur + _LENGTH.size + size])
+        cur += _LENGTH.size + size
+    return messages, data[cur:]
+
+
+def read_batches(fh, framing='newline', batch_bytes=INPUT_BATCH_BYTES, batch_seconds=INPUT_BATCH_SECONDS):
+
+    # yields lists of messages read from 'fh' (framed as with
+    # encode_batch()), about 'batch_bytes' at a time; regular files are
+    # mmapped, and cut into batches on the last delimiter before
+    # 'batch_bytes', anything else (pipes, stdin) is read in large
+    # chunks, and a batch is yielded when it's full, or when nothing more
+    # came in for 'batch_seconds' since the batch was started; either
+    # way the messages are split out with a single call, not line by line
+    if framing not in FRAMINGS:
+        raise ValueError("unknown framing: %s" % framing)
+    if framing != 'length' and stat.S_ISREG(os.fstat(fh.fileno()).st_mode):
+        return _read_mmap_batches(fh, DELIMITERS[framing], batch_bytes)
+    return _read_chunk_batches(fh, framing, batch_bytes, batch_seconds)
+
+
+def _read_mmap_batches(fh, delimiter, batch_bytes):
+
+    size = os.fstat(fh.fileno()).st_size
+    if not size:
+        return
+    mm = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        pos = 0
+        while pos < size:
+            end = pos + batch_bytes
+            if end < size:
+                cut = mm.rfind(delimiter, pos, end)
+                if cut == -1:
+                    # a single message bigger than batch_bytes
+                    cut = mm.find(delimiter, end)
+                end = size if cut == -1 else cut + len(delimiter)
+            else:
+                end = size
+            messages = mm[pos:end].split(delimiter)
+            # the last message may not have the delimiter after it
+            if messages[-1] == "":
+                messages.pop()
+            pos = end
+            yield messages
+    finally:
+        mm.close()
+
+
+def _read_chunk_batches(fh, framing, batch_bytes, batch_seconds):
+
+    # a message spanning chunks is kept as a list of its chunks, and
+    # joined up once, when it is complete, so that a message many chunks
+    # long isn't copied over and over; the delimiters are single bytes,
+    # so only the new chunk needs to be searched for one
+    fd = fh.fileno()
+    partial = [] # chunks of the message not yet complete
+    partial_b = 0
+    batch = []
+    size_b = 0
+    started = None
+    while True:
+
+        chunk = os.read(fd, INPUT_CHUNK_BYTES)
+        if not chunk:
+            break
+        if framing == 'length':
+            # the partial message's length is known once its first
+            # chunk has the whole length prefix
+            if partial and len(partial[0]) >= _LENGTH.size and partial_b + len(chunk) < _LENGTH.size + _LENGTH.unpack_from(partial[0])[0]:
+                messages, rest = [], None
+            else:
+                messages, rest = split_length("".join(partial) + chunk)
+        else:
+            if DELIMITERS[framing] not in chunk:
+                messages, rest = [], None
+            else:
+                messages, rest = split_delimited(chunk, DELIMITERS[framing])
+                if partial:
+                    messages[0] = "".join(partial) + messages[0]
+        if rest is None:
+            partial.append(chunk)
+            partial_b += len(chunk)
+        else:
+            partial = [rest] if rest else []
+            partial_b = len(rest)
+        if messages and not batch:
+            started = time.time()
+        batch.extend(messages)
+        size_b += len(chunk)
+
+        if not batch:
+            continue
+        if size_b < batch_bytes:
+            wait = started + batch_seconds - time.time()
+            if wait > 0 and select.select([fd], [], [], wait)[0]:
+                continue
+        yield batch
+        batch = []
+        size_b = partial_b
+
+    if partial:
+        if framing == 'length':
+            logger.warning("discarding %i bytes of a partial message at the end of input", partial_b)
+        else:
+            batch.append("".join(partial))
+    if batch:
+        yield batch
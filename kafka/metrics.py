@@ -0,0 +1,324 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+# Counters, gauges, and latency histograms, kept by the connections (per
+# broker and api), the client (per topic and partition), and the consumer
+# (lag, per partition), in the process-wide REGISTRY:
+#
+#     kafka.metrics.REGISTRY.snapshot()
+#     {'counters': {'requests{api=fetch,broker=10.0.0.1:9092}': 120, ...},
+#      'gauges': {'lag{partition=0,topic=topic1}': 5000, ...},
+#      'histograms': {'wait_seconds{api=fetch,broker=10.0.0.1:9092}':
+#           {'count': 120, 'p50': 0.0016, 'p99': 0.1, ...}, ...}}
+#
+# A MetricsReporter dumps the snapshot every so often to a FileSink (a
+# JSON line at a time) or a StatsdSink (UDP, to a statsd on localhost).
+#
+# The histograms are:
+#
+# wait_seconds{broker,api}   time waiting on the network and the broker
+#                            for a response, and nothing else: with a
+#                            KafkaConnection, the time blocked reading it
+#                            (so with requests pipelined to several
+#                            brokers, a response which came in while an
+#                            earlier one was being decoded waits ~0, since
+#                            the broker's time overlapped the decoding);
+#                            with a PollingConnection, from the request
+#                            being sent until select() found the response
+#                            readable
+# fetch_seconds{topic}       a whole KafkaConsumer._fetch(): encoding,
+#                            waiting, and decoding the messages; it runs
+#                            in one thread, so the sum of fetch_seconds
+#                            less the sum of the fetch wait_seconds is
+#                            (about) the time spent decoding
+
+import time
+import json
+import math
+import socket
+import logging
+import threading
+import collections
+
+import kafka.protocol
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_MIN_SECONDS = 1e-5 # 10µs, upper bound of the first bucket ...
+HISTOGRAM_BUCKETS = 24 # ... each bucket twice the previous, up to ~168s
+REPORT_EVERY_N_SECONDS = 10
+STATSD_PORT = 8125
+STATSD_PREFIX = "kafka"
+STATSD_PACKET_BYTES = 1400 # metrics are sent several to a packet, under the MTU
+API_NAMES = {
+    kafka.protocol.PRODUCE_KEY: 'produce',
+    kafka.protocol.FETCH_KEY: 'fetch',
+    kafka.protocol.OFFSET_KEY: 'offset',
+    kafka.protocol.METADATA_KEY: 'metadata',
+    kafka.protocol.OFFSET_COMMIT_KEY: 'offset_commit',
+    kafka.protocol.OFFSET_FETCH_KEY: 'offset_fetch',
+}
+
+
+def api_name(api_key):
+    return API_NAMES.get(api_key, str(api_key))
+
+
+def format_key(key):
+    # ('requests', (('api', 'fetch'), ('broker', 'host:9092'))) -> 'requests{api=fetch,broker=host:9092}'
+    name, tags = key
+    if not tags:
+        return name
+    return "%s{%s}" % (name, ",".join("%s=%s" % tag for tag in tags))
+
+
+class Histogram(object):
+
+    # values (seconds) are counted in log scale buckets, so recording is
+    # cheap and memory is fixed; percentiles are the upper bounds of the
+    # buckets they fall in (so within 2x), but never more than the max
+
+    def __init__(self, min_value=HISTOGRAM_MIN_SECONDS, buckets=HISTOGRAM_BUCKETS):
+        self.min_value = min_value
+        self.counts = [0] * buckets
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "Histogram(count=%i, sum=%f, max=%f)" % (self.count, self.sum, self.max)
+
+    def add(self, value):
+        if value > self.min_value:
+            bucket = min(len(self.counts) - 1, math.frexp(value / self.min_value)[1])
+        else:
+            bucket = 0
+        self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        return
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.max, self.min_value * 2**bucket)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+        }
+
+
+class MetricsRegistry(object):
+
+    # metrics are named, and tagged with keyword arguments, say
+    # incr('requests', broker='host:9092', api='fetch'); each name and
+    # set of tags is a separate metric
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(int) # (name, tags) -> count
+        self.gauges = {} # (name, tags) -> value
+        self.histograms = {} # (name, tags) -> Histogram
+
+    def __repr__(self):
+        return "MetricsRegistry(counters=%i, gauges=%i, histograms=%i)" % (len(self.counters), len(self.gauges), len(self.histograms))
+
+    def incr(self, name, value=1, **tags):
+        key = (name, tuple(sorted(tags.items())))
+        with self.lock:
+            self.counters[key] += value
+        return
+
+    def gauge(self, name, value, **tags):
+        key = (name, tuple(sorted(tags.items())))
+        with self.lock:
+            self.gauges[key] = value
+        return
+
+    def observe(self, name, value, **tags):
+        key = (name, tuple(sorted(tags.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(value)
+        return
+
+    def get(self, name, **tags):
+        # a counter's or gauge's value (None if not set), or a histogram
+        key = (name, tuple(sorted(tags.items())))
+        with self.lock:
+            if key in self.counters:
+                return self.counters[key]
+            if key in self.gauges:
+                return self.gauges[key]
+            return self.histograms.get(key)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict((format_key(k), v) for k, v in self.counters.items()),
+                'gauges': dict((format_key(k), v) for k, v in self.gauges.items()),
+                'histograms': dict((format_key(k), h.summary()) for k, h in self.histograms.items()),
+            }
+
+    def items(self):
+        # -> ([(key, count)], [(key, value)], [(key, summary)]), for the sinks
+        with self.lock:
+            return self.counters.items(), self.gauges.items(), [(k, h.summary()) for k, h in self.histograms.items()]
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+        return
+
+
+REGISTRY = MetricsRegistry()
+
+
+class FileSink(object):
+
+    # appends the snapshot to the file, one JSON object per line
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "FileSink('%s')" % (self.path, )
+
+    def report(self, registry):
+        out = registry.snapshot()
+        out['time'] = time.time()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(out, sort_keys=True) + "\n")
+        return
+
+    def close(self):
+        return
+
+
+class StatsdSink(object):
+
+    # counters go out as increments since the previous report ('|c'),
+    # gauges as they are ('|g'), and histograms as gauges of their
+    # percentiles, in milliseconds, since statsd can't take the buckets
+
+    def __init__(self, host="127.0.0.1", port=STATSD_PORT, prefix=STATSD_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.reported = {} # counter key -> count at the previous report
+
+    def __repr__(self):
+        return "StatsdSink('%s', %i, '%s')" % (self.address[0], self.address[1], self.prefix)
+
+    def name(self, key, suffix=None):
+        # ('requests', (('api', 'fetch'), ('broker', 'host:9092'))) -> 'kafka.requests.api_fetch.broker_host_9092'
+        name, tags = key
+        parts = [self.prefix, name] + ["%s_%s" % tag for tag in tags] + ([suffix] if suffix else [])
+        return ".".join(str(p).replace(".", "_").replace(":", "_") for p in parts if p)
+
+    def lines(self, registry):
+        counters, gauges, histograms = registry.items()
+        out = []
+        for key, count in counters:
+            delta = count - self.reported.get(key, 0)
+            self.reported[key] = count
+            if delta:
+                out.append("%s:%i|c" % (self.name(key), delta))
+        for key, value in gauges:
+            out.append("%s:%s|g" % (self.name(key), value))
+        for key, summary in histograms:
+            for stat in ('p50', 'p99', 'p999', 'max'):
+                if summary[stat] is not None:
+                    out.append("%s:%.3f|g" % (self.name(key, stat), summary[stat] * 1000))
+        return out
+
+    def report(self, registry):
+        packet = []
+        size_b = 0
+        for line in self.lines(registry) + [None]:
+            if packet and (line is None or size_b + len(line) + 1 > STATSD_PACKET_BYTES):
+                try:
+                    self.sock.sendto("\n".join(packet), self.address)
+                except socket.error as exc:
+                    logger.debug("statsd: %r", exc)
+                packet, size_b = [], 0
+            if line is not None:
+                packet.append(line)
+                size_b += len(line) + 1
+        return
+
+    def close(self):
+        self.sock.close()
+        return
+
+
+class MetricsReporter(threading.Thread):
+
+    # reports the registry to the sinks every 'seconds', and once more
+    # when stopped
+
+    def __init__(self, sinks, registry=None, seconds=REPORT_EVERY_N_SECONDS):
+        super(MetricsReporter, self).__init__(name="kafka-metrics")
+        self.daemon = True
+        self.sinks = sinks
+        self.registry = registry if registry is not None else REGISTRY
+        self.seconds = seconds
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return "MetricsReporter(%r, seconds=%f)" % (self.sinks, self.seconds)
+
+    def stop(self):
+        self.stopped.set()
+        return
+
+    def report(self):
+        for sink in self.sinks:
+            try:
+                sink.report(self.registry)
+            except (IOError, OSError) as exc:
+                logger.warning("can't report metrics to %r: %r", sink, exc)
+        return
+
+    def run(self):
+        while not self.stopped.wait(self.seconds):
+            self.report()
+        self.report()
+        for sink in self.sinks:
+            sink.close()
+
+
+def start_reporter(path=None, statsd_port=None, seconds=REPORT_EVERY_N_SECONDS, registry=None):
+
+    # for the cli: a started MetricsReporter, to a file and / or a statsd
+    # on localhost, or None if neither is set
+    sinks = []
+    if path:
+        sinks.append(FileSink(path))
+    if statsd_port:
+        sinks.append(StatsdSink(port=statsd_port))
+    if not sinks:
+        return None
+    reporter = MetricsReporter(sinks, registry=registry, seconds=seconds)
+    reporter.start()
+    logger.debug("started %r", reporter)
+    return reporter
+
@@ -0,0 +1,270 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+
+import os
+import struct
+import logging
+import zlib
+import json
+import fcntl
+import threading
+import contextlib
+
+import kafka.protocol
+
+logger = logging.getLogger(__name__)
+
+MAGIC = "kafka-offsets-v1\n" # first bytes of the file, older files are json
+COMPACT_MIN_BYTES = 2**20 # 1MB, the log isn't compacted while smaller than this ...
+COMPACT_RATIO = 4 # ... or than this many times its size after the last compaction
+CHECKPOINT_EVERY_N_SECONDS = 1
+CHECKPOINT_EVERY_N_MESSAGES = 10000
+
+_RECORD_HEADER = struct.Struct('>iI') # payload size, crc32
+_PARTITION_OFFSET = struct.Struct('>iq')
+
+
+class OffsetLogError(RuntimeError): pass
+
+
+def encode_record(group, topic, offsets):
+
+    # offsets for some (or all) of the partitions of a group's topic;
+    # when the log is read, the last record for a partition wins
+    payload = kafka.protocol.write_short_string(group)
+    payload += kafka.protocol.write_short_string(topic)
+    payload += struct.pack('>i', len(offsets))
+    payload += "".join(_PARTITION_OFFSET.pack(p, o) for p, o in sorted(offsets.items()))
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def decode_records(data, cur=0):
+
+    # yields (group, topic, offsets, end of the record) for every good
+    # record; stops on the first truncated or corrupted record, which is
+    # what a crash in the middle of an append leaves behind
+    while cur + _RECORD_HEADER.size <= len(data):
+        (size, crc) = _RECORD_HEADER.unpack_from(data, cur)
+        start, end = cur + _RECORD_HEADER.size, cur + _RECORD_HEADER.size + size
+        if size < 0 or len(data) < end:
+            return
+        if zlib.crc32(buffer(data, start, size)) & 0xffffffff != crc:
+            logger.warning("bad checksum for offsets record at: %i", cur)
+            return
+        (group, start) = kafka.protocol.read_short_string(data, start)
+        (topic, start) = kafka.protocol.read_short_string(data, start)
+        ((count,), start) = kafka.protocol.relative_unpack('>i', data, start)
+        offsets = {}
+        for i in xrange(count):
+            (partition, offset) = _PARTITION_OFFSET.unpack_from(data, start)
+            start += _PARTITION_OFFSET.size
+            offsets[partition] = offset
+        yield group, topic, offsets, end
+        cur = end
+
+
+class OffsetLog(object):
+
+    # offsets of any number of consumer groups, kept in an append-only
+    # file: a save() appends (and fsyncs) a single small record with only
+    # the partitions which changed since the last save, and once the file
+    # grows large enough it is compacted (rewritten with one record per
+    # group and topic, and atomically renamed over the old one). The file
+    # is locked for every write, so consumers in many processes can share
+    # it; before writing, whatever the other processes appended is read
+    # in, and if the file was compacted by another process, it's reopened.
+
+    def __init__(self, path, compact_bytes=COMPACT_MIN_BYTES):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.fd = None
+        self.end = 0 # bytes of the file read (and known good) so far
+        self.compacted_b = 0 # size of the file after the last compaction
+        self.offsets = {} # (group, topic) -> {partition: offset}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "OffsetLog('%s')" % (self.path, )
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+            self.fd = None
+        return
+
+    def get(self, group, topic):
+        with self._locked():
+            return dict(self.offsets.get((group, topic), {}))
+
+    def save(self, group, topic, offsets):
+
+        # returns the number of partitions written
+        with self._locked():
+            saved = self.offsets.setdefault((group, topic), {})
+            changed = dict((p, o) for p, o in offsets.items() if saved.get(p) != o)
+            if not changed:
+                return 0
+            record = encode_record(group, topic, changed)
+            os.write(self.fd, record)
+            os.fsync(self.fd)
+            self.end += len(record)
+            saved.update(changed)
+            if self.end > max(self.compact_bytes, COMPACT_RATIO * self.compacted_b):
+                self._compact()
+        return len(changed)
+
+    def compact(self):
+        with self._locked():
+            self._compact()
+        return
+
+    @contextlib.contextmanager
+    def _locked(self):
+
+        # the thread lock, and the file lock for the other processes; by
+        # the time this yields, self.offsets are up to date with the file
+        with self.lock:
+            while True:
+                if self.fd is None:
+                    self._open()
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                try:
+                    # compacted (renamed over) while waiting for the lock
+                    if os.fstat(self.fd).st_ino == os.stat(self.path).st_ino:
+                        break
+                except OSError:
+                    pass
+                os.close(self.fd)
+                self.fd = None
+            try:
+                self._read()
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0644)
+        self.end = 0
+        self.offsets = {}
+        return
+
+    def _read(self):
+
+        os.lseek(self.fd, self.end, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self.fd, 2**16)
+            if not chunk: break
+            chunks.append(chunk)
+        data = "".join(chunks)
+
+        if self.end == 0:
+            # empty, or a crash before even the magic was all written
+            if MAGIC.startswith(data):
+                os.ftruncate(self.fd, 0)
+                os.write(self.fd, MAGIC)
+                self.end = self.compacted_b = len(MAGIC)
+                return
+            if not data.startswith(MAGIC):
+                self._import(data)
+                return
+            data = data[len(MAGIC):]
+            self.end = len(MAGIC)
+
+        cur = 0
+        for group, topic, offsets, cur in decode_records(data):
+            self.offsets.setdefault((group, topic), {}).update(offsets)
+        self.end += cur
+        if cur < len(data):
+            logger.warning("discarding %i bytes at the end of offsets file: %s", len(data) - cur, self.path)
+            os.ftruncate(self.fd, self.end)
+        return
+
+    def _import(self, data):
+
+        # {group: {topic: {"partition": offset}}}, the json file written
+        # by earlier versions of the consumer; rewritten as a log
+        try:
+            groups = json.loads(data)
+            for group, topics in groups.items():
+                for topic, offsets in topics.items():
+                    self.offsets[(group.encode('utf-8'), topic.encode('utf-8'))] = dict((int(p), o) for p, o in offsets.items())
+        except (ValueError, AttributeError, TypeError) as exc:
+            raise OffsetLogError("can't parse offsets file: %s, fix it by hand or delete it (%r)" % (self.path, exc))
+        logger.info("importing json offsets file: %s", self.path)
+        self._compact()
+        return
+
+    def _compact(self):
+
+        # the caller holds the lock on the old file, until after the new
+        # one is in place, so no appends are lost
+        tmp_path = "%s.%i.tmp" % (self.path, os.getpid())
+        data = MAGIC + "".join(encode_record(g, t, o) for (g, t), o in sorted(self.offsets.items()) if o)
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.rename(tmp_path, self.path)
+        except:
+            os.close(fd)
+            raise
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        # the old file is unlocked when closed
+        os.close(self.fd)
+        self.fd = fd
+        self.end = self.compacted_b = len(data)
+        logger.debug("compacted offsets file: %s, %i bytes", self.path, self.end)
+        return
+
+
+class Checkpointer(threading.Thread):
+
+    # calls save() every 'seconds', or as soon as 'messages' messages
+    # were committed (see committed()) since the last checkpoint
+
+    def __init__(self, save, seconds=CHECKPOINT_EVERY_N_SECONDS, messages=CHECKPOINT_EVERY_N_MESSAGES):
+        super(Checkpointer, self).__init__(name="kafka-checkpointer")
+        self.daemon = True
+        self.save = save
+        self.seconds = seconds
+        self.messages = messages
+        self.count = 0
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return "Checkpointer(%r, seconds=%f, messages=%i)" % (self.save, self.seconds, self.messages)
+
+    def committed(self, count):
+        self.count += count
+        if self.count >= self.messages:
+            self.wake.set()
+        return
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        return
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.seconds)
+            self.wake.clear()
+            if self.stopped.is_set():
+                break
+            self.count = 0
+            try:
+                self.save()
+            except Exception as exc:
+                logger.warning("checkpoint failed: %r", exc)
+        return
+
@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import itertools
+import zlib
+
+
+STICKY_BATCH_BYTES = 2**16 # 64KB, see StickyPartitioner
+
+
+class Partitioner(object):
+
+    # a partitioner is created for the list of partitions of a topic,
+    # and partition(key, value) returns one of them for each message
+
+    def __init__(self, partitions):
+        self.partitions = list(partitions)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.partitions)
+
+    def partition(self, key, value):
+        raise NotImplementedError()
+
+
+class RoundRobinPartitioner(Partitioner):
+
+    def __init__(self, partitions):
+        super(RoundRobinPartitioner, self).__init__(partitions)
+        self.cycle = itertools.cycle(self.partitions)
+
+    def partition(self, key, value):
+        return self.cycle.next()
+
+
+class HashPartitioner(RoundRobinPartitioner):
+
+    # messages with the same key go to the same partition (as long as
+    # the number of partitions doesn't change); messages without a key
+    # are spread round robin
+
+    def partition(self, key, value):
+        if key is None:
+            return super(HashPartitioner, self).partition(key, value)
+        return self.partitions[(zlib.crc32(key) & 0x7fffffff) % len(self.partitions)]
+
+
+class StickyPartitioner(RoundRobinPartitioner):
+
+    # sends to one partition until 'batch_bytes' have been sent to it,
+    # and only then moves on to the next one, so that there are fewer,
+    # larger, batches than with round robin
+
+    def __init__(self, partitions, batch_bytes=STICKY_BATCH_BYTES):
+        super(StickyPartitioner, self).__init__(partitions)
+        self.batch_bytes = batch_bytes
+        self.current = self.cycle.next()
+        self.size_b = 0
+
+    def __repr__(self):
+        return "StickyPartitioner(%r, %i)" % (self.partitions, self.batch_bytes)
+
+    def partition(self, key, value):
+        if self.size_b >= self.batch_bytes:
+            self.current = self.cycle.next()
+            self.size_b = 0
+        self.size_b += len(value or '')
+        return self.current
+
+
+PARTITIONERS = {
+    'roundrobin': RoundRobinPartitioner,
+    'hash': HashPartitioner,
+    'sticky': StickyPartitioner,
+}
+
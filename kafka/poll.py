@@ -0,0 +1,303 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+
+import struct
+import logging
+import socket
+import select
+import errno
+import os
+import time
+import collections
+
+import kafka.connection
+import kafka.client
+import kafka.protocol
+
+logger = logging.getLogger(__name__)
+
+
+class PollingConnection(kafka.connection.KafkaConnection):
+
+    # a non-blocking connection, driven by KafkaPoller: send() only
+    # queues the request, which is then written out as the socket
+    # becomes writable, and responses are read in handle_read() as the
+    # bytes arrive, so a single thread can keep any number of these busy
+
+    def __init__(self, host, port, timeout=kafka.connection.DEFAULT_SOCKET_TIMEOUT_SECONDS, pool=None, metrics=None):
+        super(PollingConnection, self).__init__(host, port, timeout=timeout, pool=pool, metrics=metrics)
+        self.connecting = False
+        self.outgoing = collections.deque() # memoryviews of requests not yet written
+        self.size = None # size of the response being read, once its header is in
+        self.received = 0 # bytes of the header, or of the response, read so far
+
+    def __repr__(self):
+        return "PollingConnection('%s', %i, %f)" % (self.host, self.port, self.timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self):
+        self.close()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        err = self.sock.connect_ex((self.host, self.port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, os.strerror(err))
+        self.connecting = (err != 0)
+        return
+
+    def close(self):
+        super(PollingConnection, self).close()
+        self.connecting = False
+        self.outgoing.clear()
+        self.size = None
+        self.received = 0
+        return
+
+    def send(self, request_id, payload):
+        api = self._api(payload)
+        try:
+            if not self.sock: self.connect()
+        except socket.error:
+            self.metrics.incr('errors', broker=self.broker, api=api)
+            raise
+        self.outgoing.append(memoryview(payload))
+        self._sent(request_id, api, len(payload))
+        return
+
+    def wants_write(self):
+        return self.connecting or bool(self.outgoing)
+
+    def handle_write(self):
+
+        if self.connecting:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._failed()
+                raise socket.error(err, os.strerror(err))
+            self.connecting = False
+
+        while self.outgoing:
+            try:
+                size_b = self.sock.send(self.outgoing[0])
+            except socket.error as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                self._failed()
+                raise
+            if size_b < len(self.outgoing[0]):
+                self.outgoing[0] = self.outgoing[0][size_b:]
+                return
+            self.outgoing.popleft()
+
+        return
+
+    def handle_read(self, ready_at=None):
+
+        # reads whatever there is to read, and yields (correlation_id,
+        # response) for each response completed; as with recv(), the
+        # response is a memoryview valid until the next one is read.
+        # Nothing blocks on a polling connection, so the wait for a
+        # response is from the request being sent until 'ready_at', when
+        # select() found the socket readable (and not when the response
+        # is read, which may be after callbacks for other responses)
+        ready_at = time.time() if ready_at is None else ready_at
+        while True:
+
+            if self.size is None:
+                view = memoryview(self.header)[self.received:]
+            else:
+                view = memoryview(self.buffer)[self.received:self.size]
+
+            try:
+                size_b = self.sock.recv_into(view, len(view))
+            except socket.error as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                self._failed()
+                raise
+            if not size_b:
+                self._failed()
+                raise socket.error(errno.ECONNRESET, "connection closed by broker")
+            self.received += size_b
+
+            if self.size is None:
+                if self.received < len(self.header):
+                    continue
+                (self.size,) = struct.unpack_from('>i', self.header)
+                if self.buffer is None or len(self.buffer) < self.size:
+                    if self.buffer is not None:
+                        self.pool.release(self.buffer)
+                    self.buffer = self.pool.acquire(self.size)
+                self.received = 0
+                continue
+
+            if self.received < self.size:
+                continue
+
+            data = memoryview(self.buffer)[:self.size]
+            self.size = None
+            self.received = 0
+            (correlation_id,) = struct.unpack_from('>i', data)
+            self.in_flight.discard(correlation_id)
+            if correlation_id in self.sent_at:
+                self._received(correlation_id, len(data) + 4, max(0, ready_at - self.sent_at[correlation_id][1]))
+            yield correlation_id, data
+
+
+class KafkaPoller(object):
+
+    # drives requests to any number of brokers from a single thread,
+    # with select(); requests are submitted with a callback, and the
+    # callbacks are called from poll() as the responses come in. The
+    # poller keeps its own (non-blocking) connections, and uses the
+    # client for metadata. Because it only needs fileno() and a call to
+    # poll(0) when a socket is ready, it can also be plugged into an
+    # existing event loop.
+
+    def __init__(self, client):
+        self.client = client
+        self.conns = {} # (host, port) -> PollingConnection
+        self.requests = {} # request_id -> (conn, deadline, callback, errback)
+
+    def __repr__(self):
+        return "KafkaPoller(%r)" % (self.client, )
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.requests.clear()
+        return
+
+    def get_connection(self, broker):
+        if not broker:
+            broker = self.client.conns[0]
+        key = (broker.host, broker.port)
+        if key not in self.conns:
+            self.conns[key] = PollingConnection(broker.host, broker.port, metrics=getattr(self.client, 'metrics', None))
+        return self.conns[key]
+
+    def filenos(self):
+        return [conn.fileno() for conn in self.conns.values() if conn.sock]
+
+    def submit(self, request_id, request, broker, callback, errback=None):
+
+        # callback(response) is called with the response memoryview,
+        # which is valid only for the duration of the call; on error
+        # errback(exc) is called (or the error is logged)
+        conn = self.get_connection(broker)
+        deadline = time.time() + conn.timeout
+        self.requests[request_id] = (conn, deadline, callback, errback)
+        try:
+            conn.send(request_id, request)
+        except IOError as exc:
+            self._fail(conn, exc)
+        return
+
+    def fetch(self, requests, callback, errback=None, views=False, **kwargs):
+
+        # same as KafkaClient.fetch_multi(), one request per leader, but
+        # callback(responses) is called once for every broker, as soon
+        # as that broker responds, with a list of FetchResponse (with
+        # messages as lists); kwargs go to encode_fetch_request()
+        def decode(response):
+            callback(self._check([r._replace(messages=list(r.messages)) for r in kafka.protocol.decode_fetch_response(response, views=views)]))
+
+        for leader, leader_requests in self.client.group_by_leader(requests).items():
+            request_id = kafka.client.ID_GEN.next()
+            encoded = kafka.protocol.encode_fetch_request(self.client.client_id, request_id, leader_requests, **kwargs)
+            self.submit(request_id, encoded, leader, decode, self._errback(leader_requests, errback))
+        return
+
+    def send(self, requests, callback, errback=None, **kwargs):
+
+        # same as KafkaClient.send_multi(), callback(responses) is called
+        # with the list of ProduceResponse, once for every broker
+        def decode(response):
+            callback(self._check(list(kafka.protocol.decode_produce_response(response))))
+
+        for leader, leader_requests in self.client.group_by_leader(requests).items():
+            request_id = kafka.client.ID_GEN.next()
+            encoded = kafka.protocol.encode_produce_request(self.client.client_id, request_id, leader_requests, **kwargs)
+            self.submit(request_id, encoded, leader, decode, self._errback(leader_requests, errback))
+        return
+
+    def _check(self, responses):
+        # as with the client, leader errors mean the metadata is stale
+        for r in responses:
+            if r.error in kafka.protocol.LEADER_ERRORS:
+                self.client.invalidate_topic(r.topic)
+        return responses
+
+    def _errback(self, requests, errback):
+        # the broker may have gone away, and the leadership moved
+        def failed(exc):
+            for request in requests:
+                self.client.invalidate_topic(request.topic)
+            if errback:
+                errback(exc)
+        return failed
+
+    def _fail(self, conn, exc):
+
+        logger.warning("conn: %s, %r", conn, exc)
+        failed = [(request_id, r) for request_id, r in self.requests.items() if r[0] is conn]
+        for request_id, r in failed:
+            del self.requests[request_id]
+        conn._failed()
+        conn.close()
+        for request_id, (_, _, _, errback) in failed:
+            if errback:
+                errback(exc)
+        return
+
+    def poll(self, timeout=None):
+
+        # one round of select(), returns the number of responses handled
+        conns = set(r[0] for r in self.requests.values() if r[0].sock)
+        if not conns:
+            return 0
+
+        if timeout is None:
+            timeout = max(0, min(r[1] for r in self.requests.values()) - time.time())
+        readable, writable, _ = select.select(list(conns), [c for c in conns if c.wants_write()], [], timeout)
+        ready_at = time.time()
+
+        for conn in writable:
+            try:
+                conn.handle_write()
+            except IOError as exc:
+                self._fail(conn, exc)
+
+        handled = 0
+        for conn in readable:
+            if not conn.sock:
+                continue
+            try:
+                for correlation_id, response in conn.handle_read(ready_at):
+                    if correlation_id not in self.requests:
+                        logger.warning("conn: %s, discarding response to unknown request: %i", conn, correlation_id)
+                        continue
+                    (_, _, callback, _) = self.requests.pop(correlation_id)
+                    callback(response)
+                    handled += 1
+            except IOError as exc:
+                self._fail(conn, exc)
+
+        now = time.time()
+        for conn in set(r[0] for r in self.requests.values() if r[1] < now):
+            self._fail(conn, socket.timeout("timed out"))
+
+        return handled
+
+    def run(self):
+
+        # poll until all the submitted requests are done
+        handled = 0
+        while self.requests:
+            handled += self.poll()
+        return handled
+
@@ -10,17 +10,27 @@ import os.path
 import json
 import sys
 import itertools
-import select
+import threading
 
 import kafka.log
 import kafka.client
 import kafka.protocol
+import kafka.partitioner
+import kafka.framing
+import kafka.metrics
 
 
 logger = logging.getLogger(__name__)
 
 SEND_EVERY_N_BYTES = 2**20 # 1MB
 SEND_EVERY_N_SECONDS = 2
+LINGER_SECONDS = 0.01 # KafkaAsyncProducer, how long a batch waits to fill up
+BUFFER_BYTES = 2**25 # KafkaAsyncProducer, 32MB, send() blocks when this much is waiting
+CODECS = {
+    'none': kafka.protocol.CODEC_NONE,
+    'gzip': kafka.protocol.CODEC_GZIP,
+    'snappy': kafka.protocol.CODEC_SNAPPY, # needs python-snappy
+}
 
 
 class KafkaProducerError(RuntimeError): pass
@@ -28,12 +38,13 @@ class KafkaProducerError(RuntimeError): pass
 
 class KafkaProducer(object):
 
-    def __init__(self, hosts="", topic="", failfast=False):
+    def __init__(self, hosts="", topic="", failfast=False, codec=kafka.protocol.CODEC_NONE, partitioner=kafka.partitioner.RoundRobinPartitioner):
         self.failfast = failfast
         self.hosts = hosts
-        self.client = kafka.client.KafkaClient(hosts)
+        self.client = kafka.client.KafkaClient(hosts, topics=([topic] if topic else None))
         self.topic = topic
-        self.router = itertools.cycle(self.client.topic_partitions[self.topic])
+        self.codec = codec
+        self.partitioner = partitioner(self.client.topic_partitions[self.topic])
         logger.debug("created producer: %r", self)
 
 
@@ -49,21 +60,240 @@ class KafkaProducer(object):
                 
     
     def __repr__(self):
-        return "KafkaProducer(hosts='%s', topic='%s', failfast=%s)" % (self.hosts, self.topic, self.failfast)
+        return "KafkaProducer(hosts='%s', topic='%s', failfast=%s, codec=%i, partitioner=%s)" % (self.hosts, self.topic, self.failfast, self.codec, self.partitioner.__class__.__name__)
 
 
-    def send(self, payloads): 
+    def send(self, payloads, keys=None): 
         
+        # 'keys', if given, is a list of message keys, one per payload
+        keys = itertools.repeat(None) if keys is None else keys
         partitioned = [[] for i in self.client.topic_partitions[self.topic]]
-        for payload in payloads:
-            partitioned[self.router.next()].append(kafka.protocol.Message(0, 0, None, payload))
+        for key, payload in itertools.izip(keys, payloads):
+            partitioned[self.partitioner.partition(key, payload)].append(kafka.protocol.Message(0, 0, key, payload))
         
-        for partition, messages in enumerate(partitioned):
-            response = self.client.send(self.topic, partition, messages)
+        # one request per broker, for all the partitions it leads
+        requests = [kafka.protocol.ProduceRequest(self.topic, partition, messages) for partition, messages in enumerate(partitioned) if messages]
+        responses = self.client.send_multi(requests, codec=self.codec)
+        for response in responses:
             if response.error: 
                 logger.error(response)
         
-        return (partitioned, response) # for testing
+        return (partitioned, responses) # for testing
+
+
+class ProduceFuture(object):
+
+    # returned by KafkaAsyncProducer.send(), one per message; result() is
+    # the ProduceResponse for that message (with the message's offset)
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.exception = None
+
+    def __repr__(self):
+        return "ProduceFuture(response=%r, exception=%r)" % (self.response, self.exception)
+
+    def done(self):
+        return self.event.is_set()
+
+    def set_result(self, response):
+        self.response = response
+        self.event.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self.event.set()
+
+    def result(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise KafkaProducerError("timed out waiting for produce response")
+        if self.exception:
+            raise self.exception
+        return self.response
+
+
+class Accumulator(object):
+
+    # messages waiting to be sent to a single partition
+
+    def __init__(self):
+        self.messages = []
+        self.futures = []
+        self.size_b = 0
+        self.created = time.time()
+
+    def append(self, message, future):
+        size_b = len(message.value or '') # a null message is empty
+        self.messages.append(message)
+        self.futures.append(future)
+        self.size_b += size_b
+
+    def fail(self, exception):
+        for future in self.futures:
+            future.set_exception(exception)
+
+
+class KafkaAsyncProducer(KafkaProducer):
+
+    # send() doesn't wait for the broker: messages are appended to
+    # per-partition accumulators, and a background thread sends them
+    # when a partition's batch reaches 'batch_bytes', or when the oldest
+    # message in it has waited 'linger_seconds', all the ready
+    # partitions going out in one request per broker (as with the
+    # synchronous send()); send() blocks only when 'buffer_bytes' are
+    # already waiting to be sent
+
+    def __init__(self, hosts="", topic="", failfast=False, codec=kafka.protocol.CODEC_NONE, partitioner=kafka.partitioner.RoundRobinPartitioner, batch_bytes=SEND_EVERY_N_BYTES, linger_seconds=LINGER_SECONDS, buffer_bytes=BUFFER_BYTES):
+        super(KafkaAsyncProducer, self).__init__(hosts=hosts, topic=topic, failfast=failfast, codec=codec, partitioner=partitioner)
+        self.batch_bytes = batch_bytes
+        self.linger_seconds = linger_seconds
+        self.buffer_bytes = buffer_bytes
+        self.accumulators = {} # partition -> Accumulator
+        self.buffered_b = 0 # accumulated or being sent
+        self.flushing = 0 # number of threads waiting in flush()
+        self.closed = False
+        self.lock = threading.Condition()
+        self.sender = threading.Thread(target=self._run, name="kafka-sender")
+        self.sender.daemon = True
+        self.sender.start()
+
+
+    def __exit__(self, exctype, value, tb):
+        self.close()
+        return super(KafkaAsyncProducer, self).__exit__(exctype, value, tb)
+
+
+    def __repr__(self):
+        return "KafkaAsyncProducer(hosts='%s', topic='%s', failfast=%s, codec=%i, partitioner=%s, batch_bytes=%i, linger_seconds=%f, buffer_bytes=%i)" % \
+            (self.hosts, self.topic, self.failfast, self.codec, self.partitioner.__class__.__name__, self.batch_bytes, self.linger_seconds, self.buffer_bytes)
+
+
+    def send(self, payloads, keys=None):
+
+        keys = itertools.repeat(None) if keys is None else keys
+        futures = []
+        with self.lock:
+            for key, payload in itertools.izip(keys, payloads):
+                while self.buffered_b >= self.buffer_bytes and not self.closed:
+                    self.lock.wait()
+                if self.closed:
+                    raise KafkaProducerError("producer is closed")
+                size_b = len(payload or '')
+                partition = self.partitioner.partition(key, payload)
+                if partition not in self.accumulators:
+                    self.accumulators[partition] = Accumulator()
+                future = ProduceFuture()
+                self.accumulators[partition].append(kafka.protocol.Message(0, 0, key, payload), future)
+                self.buffered_b += size_b
+                futures.append(future)
+            self.lock.notify_all()
+        return futures
+
+
+    def flush(self):
+
+        # send whatever is accumulated, and wait for the responses
+        with self.lock:
+            self.flushing += 1
+            self.lock.notify_all()
+            while self.buffered_b and self.sender.is_alive():
+                self.lock.wait(self.linger_seconds)
+            self.flushing -= 1
+        return
+
+
+    def queue_depth(self):
+
+        # (messages accumulated, not yet sent; bytes accumulated or being sent)
+        with self.lock:
+            return sum(len(acc.messages) for acc in self.accumulators.values()), self.buffered_b
+
+
+    def close(self):
+
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.sender.join()
+        return
+
+
+    def _ready(self):
+
+        # partitions to be sent now, and the time until the next one is
+        now = time.time()
+        if self.flushing or self.closed:
+            return self.accumulators.keys(), None
+        ready = [p for p, acc in self.accumulators.items() if acc.size_b >= self.batch_bytes or acc.created + self.linger_seconds <= now]
+        if ready or not self.accumulators:
+            return ready, None
+        return ready, min(acc.created for acc in self.accumulators.values()) + self.linger_seconds - now
+
+
+    def _run(self):
+
+        while True:
+            with self.lock:
+                ready, wait = self._ready()
+                while not ready:
+                    if self.closed:
+                        return
+                    self.lock.wait(wait)
+                    ready, wait = self._ready()
+                batches = dict((p, self.accumulators.pop(p)) for p in ready)
+
+            self._send(batches)
+
+            with self.lock:
+                self.buffered_b -= sum(acc.size_b for acc in batches.values())
+                self.lock.notify_all()
+
+
+    def _send(self, batches):
+
+        requests = [kafka.protocol.ProduceRequest(self.topic, partition, acc.messages) for partition, acc in batches.items()]
+        try:
+            responses = self.client.send_multi(requests, codec=self.codec)
+        except Exception as exc:
+            logger.warning("sending to topic: %s, partitions: %s; %r", self.topic, sorted(batches), exc)
+            for acc in batches.values():
+                acc.fail(exc)
+            return
+
+        batches = batches.copy()
+        for response in responses:
+            acc = batches.pop(response.partition, None)
+            if not acc:
+                continue
+            if response.error:
+                logger.error(response)
+                acc.fail(KafkaProducerError("produce error: %r" % (response, )))
+                continue
+            # the offset in the response is that of the first message
+            for n, future in enumerate(acc.futures):
+                future.set_result(response._replace(offset=response.offset + n))
+
+        for partition, acc in batches.items():
+            acc.fail(KafkaProducerError("no response for partition: %i" % partition))
+
+        return
+
+
+def split_keys(lines, separator):
+
+    # ["k1<sep>v1", "v2", None, ...] -> ["k1", None, None, ...], ["v1",
+    # "v2", None, ...]; a None (null, with length framing) stays a None
+    keys, values = [], []
+    for line in lines:
+        if line is None:
+            keys.append(None)
+            values.append(None)
+            continue
+        key, sep, value = line.partition(separator)
+        keys.append(key if sep else None)
+        values.append(value if sep else line)
+    return keys, values
 
 
 def args_parser():
@@ -82,7 +312,14 @@ connection will be retried.
     parser.add_argument('topic', type=str, action='store', default=None, help="topic name; (%(default)s)")
     parser.add_argument('--verbose', '-v', action='count', default=0, help="try -v, -vv, -vvv")
     parser.add_argument('--failfast', action='store_true', help="if set, exit on any error")
-    parser.add_argument('--input', metavar='PATH', type=str, action='store', default='/dev/stdin', help="one message per line; ('%(default)s')")
+    parser.add_argument('--input', metavar='PATH', type=str, action='store', default='/dev/stdin', help="messages, framed as set by --framing; ('%(default)s')")
+    parser.add_argument('--framing', choices=kafka.framing.FRAMINGS, action='store', default='newline', help="message separator in the input, 'length' for messages prefixed with their 4 byte big endian length; (%(default)s)")
+    parser.add_argument('--partitioner', choices=sorted(kafka.partitioner.PARTITIONERS), action='store', default='roundrobin', help="'hash' sends lines with the same key to the same partition, 'sticky' fills one partition's batch at a time; (%(default)s)")
+    parser.add_argument('--key-separator', metavar='SEP', type=str, action='store', default=None, help="if set, the part of each message up to the first SEP is its key; (%(default)s)")
+    parser.add_argument('--compression', choices=sorted(CODECS), action='store', default='none', help="compress each partition's batch; (%(default)s)")
+    parser.add_argument('--metrics-file', metavar='PATH', type=str, action='store', default=None, help="append client metrics to this file, as JSON lines; (%(default)s)")
+    parser.add_argument('--metrics-statsd', metavar='PORT', type=int, action='store', default=None, help="send client metrics to a statsd on localhost; (%(default)s)")
+    parser.add_argument('--metrics-seconds', metavar='N', type=float, action='store', default=kafka.metrics.REPORT_EVERY_N_SECONDS, help="(%(default)s)")
     
     return parser
 
@@ -92,42 +329,28 @@ def main():
     args = args_parser().parse_args()
     kafka.log.set_up_logging(level=logging.ERROR-(args.verbose*10))
 
+    input_fh = None
+    reporter = kafka.metrics.start_reporter(path=args.metrics_file, statsd_port=args.metrics_statsd, seconds=args.metrics_seconds)
     try: 
 
         if args.input in ['/dev/stdin', '-']: 
             input_fh = sys.stdin
         else:
-            input_fh = open(os.path.abspath(args.input), 'r', buffering=1)
-
-        with KafkaProducer(hosts=args.hosts, topic=args.topic, failfast=args.failfast) as producer:
-
-            input_exhausted = False
-            while not input_exhausted:
-
-                lines = []
-                size_b = 0
-                stop_at_bytes = SEND_EVERY_N_BYTES
-                stop_at_time = time.time() + SEND_EVERY_N_SECONDS
-        
-                while (size_b < stop_at_bytes) and (time.time() < stop_at_time):
-
-                    r, _, _ = select.select([input_fh], [], [], 1)
-        
-                    if not r:
-                        continue
-            
-                    line = r[0].readline()
-                    if line:
-                        lines.append(line.strip("\n"))
-                        size_b += len(line)
-                    else:
-                        input_exhausted = True
-                        logger.debug("input exhausted")
-                        break
-        
-                if lines:
+            input_fh = open(os.path.abspath(args.input), 'rb')
+
+        with KafkaProducer(hosts=args.hosts, topic=args.topic, failfast=args.failfast, codec=CODECS[args.compression], partitioner=kafka.partitioner.PARTITIONERS[args.partitioner]) as producer:
+
+            # lines are read in bulk, and sent a batch (of about
+            # SEND_EVERY_N_BYTES, or whatever came in over
+            # SEND_EVERY_N_SECONDS) at a time
+            for lines in kafka.framing.read_batches(input_fh, framing=args.framing, batch_bytes=SEND_EVERY_N_BYTES, batch_seconds=SEND_EVERY_N_SECONDS):
+                if args.key_separator:
+                    keys, lines = split_keys(lines, args.key_separator)
+                    producer.send(lines, keys)
+                else:
                     producer.send(lines)
-                    logger.debug(lines)
+                logger.debug("sent %i messages", len(lines))
+            logger.debug("input exhausted")
 
 
     except KeyboardInterrupt:
@@ -140,6 +363,9 @@ def main():
         if input_fh:
             input_fh.close()
             logger.debug("closed input file: %r (%s)", input_fh, args.input)
+        if reporter:
+            reporter.stop()
+            reporter.join()
 
 
 if __name__ == "__main__":
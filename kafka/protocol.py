@@ -18,6 +18,8 @@ import logging
 import base64
 import zlib
 
+import kafka.codec
+
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +36,19 @@ CODEC_NONE = 0x00
 CODEC_GZIP = 0x01
 CODEC_SNAPPY = 0x02
 
+CRC_CHUNK_BYTES = 2**16 # see _crc32()
+
+FETCH_MAX_WAIT_MS = 100 # how long the broker waits for min_bytes to arrive
+FETCH_MIN_BYTES = 4096
+
+ERROR_NONE = 0
+ERROR_OFFSET_OUT_OF_RANGE = 1
+ERROR_UNKNOWN_TOPIC_OR_PARTITION = 3
+ERROR_LEADER_NOT_AVAILABLE = 5
+ERROR_NOT_LEADER_FOR_PARTITION = 6
+# errors which mean that the client's metadata for the topic is stale
+LEADER_ERRORS = (ERROR_UNKNOWN_TOPIC_OR_PARTITION, ERROR_LEADER_NOT_AVAILABLE, ERROR_NOT_LEADER_FOR_PARTITION)
+
 
 ProduceRequest = collections.namedtuple("ProduceRequest", ["topic", "partition", "messages"])
 FetchRequest = collections.namedtuple("FetchRequest", ["topic", "partition", "offset", "max_bytes"])
@@ -70,6 +85,50 @@ class UnknownTopicError(KafkaError): pass
 class CompressionNotSupportedError(KafkaError): pass
 
 
+# structs are compiled once, and used with unpack_from() at an offset
+# into the buffer, so that decoding doesn't slice (copy) the input
+_STRUCTS = {}
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_OFFSET_AND_SIZE = struct.Struct('>qi')
+_MESSAGE_HEADER = struct.Struct('>iBBi') # crc, magic, attributes, key size
+
+
+def _struct(fmt):
+    try:
+        return _STRUCTS[fmt]
+    except KeyError:
+        _STRUCTS[fmt] = struct.Struct(fmt)
+        return _STRUCTS[fmt]
+
+
+def _bytes(data):
+    # responses are received into reusable buffers and handed over as
+    # memoryviews; anything that outlives the decoding has to be copied
+    return data.tobytes() if isinstance(data, memoryview) else data
+
+
+def _slice(data, start, end, views):
+    # with 'views' set, return a memoryview into 'data' (no copy, but
+    # only valid for as long as 'data' is), otherwise copy out bytes
+    if views:
+        return (data if isinstance(data, memoryview) else memoryview(data))[start:end]
+    return data[start:end].tobytes() if isinstance(data, memoryview) else data[start:end]
+
+
+def _crc32(data, start, end):
+    if not isinstance(data, memoryview):
+        return zlib.crc32(buffer(data, start, end - start))
+    # zlib won't take a memoryview, so checksum it in chunks, to keep
+    # the copies small even for very large messages
+    if end - start <= CRC_CHUNK_BYTES:
+        return zlib.crc32(data[start:end].tobytes())
+    crc = 0
+    for cur in xrange(start, end, CRC_CHUNK_BYTES):
+        crc = zlib.crc32(data[cur:min(cur + CRC_CHUNK_BYTES, end)].tobytes(), crc)
+    return crc
+
+
 def write_int_string(s):
     if s is None:
         return struct.pack('>i', -1)
@@ -88,7 +147,7 @@ def read_short_string(data, cur):
     if len(data) < cur + 2:
         raise BufferUnderflowError("Not enough data left")
 
-    (strlen,) = struct.unpack('>h', data[cur:cur + 2])
+    (strlen,) = _INT16.unpack_from(data, cur)
     if strlen == -1:
         return None, cur + 2
 
@@ -96,17 +155,17 @@ def read_short_string(data, cur):
     if len(data) < cur + strlen:
         raise BufferUnderflowError("Not enough data left")
 
-    out = data[cur:cur + strlen]
+    out = _bytes(data[cur:cur + strlen])
     return out, cur + strlen
 
 
-def read_int_string(data, cur):
+def read_int_string(data, cur, views=False):
     if len(data) < cur + 4:
         raise BufferUnderflowError(
             "Not enough data left to read string len (%d < %d)" %
             (len(data), cur + 4))
 
-    (strlen,) = struct.unpack('>i', data[cur:cur + 4])
+    (strlen,) = _INT32.unpack_from(data, cur)
     if strlen == -1:
         return None, cur + 4
 
@@ -114,21 +173,21 @@ def read_int_string(data, cur):
     if len(data) < cur + strlen:
         raise BufferUnderflowError("Not enough data left")
 
-    out = data[cur:cur + strlen]
+    out = _slice(data, cur, cur + strlen, views)
     return out, cur + strlen
 
 
 def relative_unpack(fmt, data, cur):
-    size = struct.calcsize(fmt)
-    if len(data) < cur + size:
+    s = _struct(fmt)
+    if len(data) < cur + s.size:
         raise BufferUnderflowError("Not enough data left")
 
-    out = struct.unpack(fmt, data[cur:cur + size])
-    return out, cur + size
+    out = s.unpack_from(data, cur)
+    return out, cur + s.size
 
 
 def group_by_topic_and_partition(tuples):
-    out = defaultdict(dict)
+    out = collections.defaultdict(dict)
     for t in tuples:
         out[t.topic][t.partition] = t
     return out
@@ -194,13 +253,20 @@ def decode_metadata_response(data):
 
 
 
-def encode_produce_request(client_id, correlation_id, request, acks=1, timeout=1000):
+def encode_produce_request(client_id, correlation_id, requests, acks=1, timeout=1000, codec=CODEC_NONE):
 
+    # 'requests' is a list of ProduceRequest, for any number of topics
+    # and partitions, all led by the broker the request is sent to; with
+    # 'codec' set, each partition's message set is compressed
+    grouped = group_by_topic_and_partition(requests)
     message = encode_message_header(client_id, correlation_id, PRODUCE_KEY)
-    message += struct.pack('>hii', acks, timeout, 1)
-    message += struct.pack('>h%dsi' % len(request.topic), len(request.topic), request.topic, 1)
-    message_set = encode_message_set(request.messages)
-    message += struct.pack('>ii%ds' % len(message_set), request.partition, len(message_set), message_set)
+    message += struct.pack('>hii', acks, timeout, len(grouped))
+    for topic, partitions in grouped.items():
+        message += write_short_string(topic)
+        message += struct.pack('>i', len(partitions))
+        for partition, request in partitions.items():
+            message_set = encode_message_set(request.messages, codec=codec)
+            message += struct.pack('>ii%ds' % len(message_set), partition, len(message_set), message_set)
 
 #     return struct.pack('>i%ds' % len(message), len(message), message)
     data = write_int_string(message)
@@ -213,7 +279,7 @@ def decode_produce_response(data):
 
     for i in range(num_topics):
         ((strlen,), cur) = relative_unpack('>h', data, cur)
-        topic = data[cur:cur + strlen]
+        topic = _bytes(data[cur:cur + strlen])
         cur += strlen
         ((num_partitions,), cur) = relative_unpack('>i', data, cur)
 
@@ -258,20 +324,98 @@ def decode_offset_response(data):
             yield OffsetResponse(topic, partition, error, tuple(offsets))
 
 
-def encode_fetch_request(client_id, correlation_id, request, max_wait_time=100, min_bytes=4096):
+def encode_offset_commit_request(client_id, correlation_id, group, requests):
+
+    # 'requests' is a list of OffsetCommitRequest, for any number of
+    # topics and partitions; (v0 of the api, offsets are kept in
+    # zookeeper, so any broker can take the request)
+    grouped = group_by_topic_and_partition(requests)
+    message = encode_message_header(client_id, correlation_id, OFFSET_COMMIT_KEY)
+    message += write_short_string(group)
+    message += struct.pack('>i', len(grouped))
+    for topic, partitions in grouped.items():
+        message += write_short_string(topic)
+        message += struct.pack('>i', len(partitions))
+        for partition, request in partitions.items():
+            message += struct.pack('>iq', partition, request.offset)
+            message += write_short_string(request.metadata)
+
+    data = write_int_string(message)
+    return data
+
+
+def decode_offset_commit_response(data):
+
+    ((correlation_id, num_topics), cur) = relative_unpack('>ii', data, 0)
+
+    for i in range(num_topics):
+        (topic, cur) = read_short_string(data, cur)
+        ((num_partitions,), cur) = relative_unpack('>i', data, cur)
+
+        for i in range(num_partitions):
+            ((partition, error), cur) = relative_unpack('>ih', data, cur)
+
+            yield OffsetCommitResponse(topic, partition, error)
+
+
+def encode_offset_fetch_request(client_id, correlation_id, group, requests):
+
+    # 'requests' is a list of OffsetFetchRequest
+    grouped = group_by_topic_and_partition(requests)
+    message = encode_message_header(client_id, correlation_id, OFFSET_FETCH_KEY)
+    message += write_short_string(group)
+    message += struct.pack('>i', len(grouped))
+    for topic, partitions in grouped.items():
+        message += write_short_string(topic)
+        message += struct.pack('>i', len(partitions))
+        for partition in partitions:
+            message += struct.pack('>i', partition)
 
+    data = write_int_string(message)
+    return data
+
+
+def decode_offset_fetch_response(data):
+
+    # offset is -1 for partitions with no offset committed
+    ((correlation_id, num_topics), cur) = relative_unpack('>ii', data, 0)
+
+    for i in range(num_topics):
+        (topic, cur) = read_short_string(data, cur)
+        ((num_partitions,), cur) = relative_unpack('>i', data, cur)
+
+        for i in range(num_partitions):
+            ((partition, offset), cur) = relative_unpack('>iq', data, cur)
+            (metadata, cur) = read_short_string(data, cur)
+            ((error,), cur) = relative_unpack('>h', data, cur)
+
+            yield OffsetFetchResponse(topic, partition, offset, metadata, error)
+
+
+def encode_fetch_request(client_id, correlation_id, requests, max_wait_time=FETCH_MAX_WAIT_MS, min_bytes=FETCH_MIN_BYTES):
+
+    # 'requests' is a list of FetchRequest, possibly for many topics and
+    # partitions; they all go out in a single request (so they all
+    # should be led by the same broker)
+    grouped = group_by_topic_and_partition(requests)
     message = encode_message_header(client_id, correlation_id, FETCH_KEY)
-    message += struct.pack('>iiii', -1, max_wait_time, min_bytes, 1)
-    message += write_short_string(request.topic)
-    message += struct.pack('>i', 1)
-    message += struct.pack('>iqi', request.partition, request.offset, request.max_bytes)
+    message += struct.pack('>iiii', -1, max_wait_time, min_bytes, len(grouped))
+    for topic, partitions in grouped.items():
+        message += write_short_string(topic)
+        message += struct.pack('>i', len(partitions))
+        for partition, request in partitions.items():
+            message += struct.pack('>iqi', partition, request.offset, request.max_bytes)
 
     data = write_int_string(message)
     return(data)
 
 
-def decode_fetch_response(data):
+def decode_fetch_response(data, views=False):
 
+    # message sets are decoded in place, from 'data'; if 'views' is set,
+    # then message keys and values are memoryviews into 'data' (see
+    # KafkaConnection.recv() for how long these are valid), otherwise
+    # they are copied out as strings
     ((correlation_id, num_topics), cur) = relative_unpack('>ii', data, 0)
 
     for i in range(num_topics):
@@ -279,19 +423,35 @@ def decode_fetch_response(data):
         ((num_partitions,), cur) = relative_unpack('>i', data, cur)
 
         for i in range(num_partitions):
-            ((partition, error, highwater_mark_offset), cur) = relative_unpack('>ihq', data, cur)
-            (message_set, cur) = read_int_string(data, cur)
-            yield FetchResponse(topic, partition, error, highwater_mark_offset, decode_message_set_iter(message_set))
+            ((partition, error, highwater_mark_offset, size), cur) = relative_unpack('>ihqi', data, cur)
+            if len(data) < cur + size:
+                raise BufferUnderflowError("Not enough data left")
+            messages = _iter_message_set(data, cur, cur + size, views)
+            yield FetchResponse(topic, partition, error, highwater_mark_offset, messages)
+            cur += size
 
 
-def encode_message_set(messages):
+def encode_message_set(messages, codec=CODEC_NONE):
 
     message_set = ""
     for message in messages:
         encoded_message = encode_message(message)
         message_set += struct.pack('>qi%ds' % len(encoded_message), 0, len(encoded_message), encoded_message)
 
-    return message_set
+    if codec == CODEC_NONE:
+        return message_set
+
+    # compressed, the whole message set becomes the value of a single
+    # 'wrapper' message, with the codec set in its attributes
+    if codec == CODEC_GZIP:
+        compressed = kafka.codec.gzip_encode(message_set)
+    elif codec == CODEC_SNAPPY:
+        if not kafka.codec.has_snappy():
+            raise CompressionNotSupportedError('snappy needs python-snappy installed')
+        compressed = kafka.codec.snappy_encode(message_set)
+    else:
+        raise CompressionNotSupportedError('codec not supported: %i' % codec)
+    return encode_message_set([Message(0, codec & ATTRIBUTE_CODEC_MASK, None, compressed)])
 
 
 def encode_message(message):
@@ -308,21 +468,24 @@ def encode_message(message):
     return msg
 
 
-def decode_message_set_iter(data):
+def decode_message_set_iter(data, views=False):
+
+    return _iter_message_set(data, 0, len(data), views)
+
+
+def _iter_message_set(data, cur, end, views):
 
-    cur = 0
     read_message = False
 
-    while cur < len(data):
+    while cur < end:
 
-        try:
-            ((offset, ), cur) = relative_unpack('>q', data, cur)
-            (msg, cur) = read_int_string(data, cur)
-            for (offset, message) in decode_message(msg, offset):
-                read_message = True
-                yield OffsetAndMessage(offset, message)
+        if end < cur + _OFFSET_AND_SIZE.size:
+            size = None
+        else:
+            (offset, size) = _OFFSET_AND_SIZE.unpack_from(data, cur)
+            cur += _OFFSET_AND_SIZE.size
 
-        except BufferUnderflowError as exc:
+        if size is None or end < cur + size:
             # this happens when there is a partial message - according
             # to the spec, the last message may be partial; here the
             # default behavior is to discard the unfinished message,
@@ -330,33 +493,49 @@ def decode_message_set_iter(data):
             # message too large to fit, there is a problem - it will
             # never make it through
             if read_message is False: raise ConsumerFetchSizeTooSmall("try adjusting client.FETCH_BUFFER_SIZE_BYTES")
-            else: raise StopIteration()
+            else: return
+
+        for (offset, message) in _decode_message(data, cur, cur + size, offset, views):
+            read_message = True
+            yield OffsetAndMessage(offset, message)
+        cur += size
 
 
 def decode_message(data, offset):
 
-    ((crc, magic, att), cur) = relative_unpack('>iBB', data, 0)
-    if crc != zlib.crc32(data[4:]):
+    return _decode_message(data, 0, len(data), offset, False)
+
+
+def _decode_message(data, start, end, offset, views):
+
+    (crc, magic, att, key_size) = _MESSAGE_HEADER.unpack_from(data, start)
+    if crc != _crc32(data, start + 4, end):
         raise ChecksumError("message checksum failed")
 
-    (key, cur) = read_int_string(data, cur)
-    (value, cur) = read_int_string(data, cur)
+    # the checksum passed, so the sizes can be trusted to be in bounds
+    cur = start + _MESSAGE_HEADER.size
+    if key_size == -1:
+        key = None
+    else:
+        key = _slice(data, cur, cur + key_size, views)
+        cur += key_size
+    (value_size,) = _INT32.unpack_from(data, cur)
+    cur += 4
+    value = None if value_size == -1 else _slice(data, cur, cur + value_size, views)
     codec = att & ATTRIBUTE_CODEC_MASK
 
     if codec == CODEC_NONE:
         yield (offset, Message(magic, att, key, value))
 
     elif codec == CODEC_GZIP:
-#         gz = gzip_decode(value)
-#         for (offset, msg) in decode_message_set_iter(gz):
-#             yield (offset, msg)
-        raise CompressionNotSupportedError('gzip not supported yet')
-        pass
+        # the value is a compressed message set, with its own offsets
+        gz = kafka.codec.gzip_decode(_bytes(value))
+        for (offset, msg) in decode_message_set_iter(gz, views=views):
+            yield (offset, msg)
 
     elif codec == CODEC_SNAPPY:
-#         snp = snappy_decode(value)
-#         for (offset, msg) in decode_message_set_iter(snp):
-#             yield (offset, msg)
-        raise CompressionNotSupportedError('snappy not supported yet')
-        pass
-
+        if not kafka.codec.has_snappy():
+            raise CompressionNotSupportedError('snappy needs python-snappy installed')
+        snp = kafka.codec.snappy_decode(_bytes(value))
+        for (offset, msg) in decode_message_set_iter(snp, views=views):
+            yield (offset, msg)
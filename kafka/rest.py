@@ -0,0 +1,295 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+
+import logging
+import time
+import argparse
+import json
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import kafka.log
+import kafka.protocol
+import kafka.producer
+import kafka.partitioner
+import kafka.framing
+import kafka.metrics
+
+
+logger = logging.getLogger(__name__)
+
+REST_PORT = 8080
+MAX_BODY_BYTES = 2**26 # 64MB, larger POSTs get a 413
+ACK_TIMEOUT_SECONDS = 30 # how long a POST waits for the broker's acks
+
+
+class RestStats(object):
+
+    # counters for /stats; 'recent' rates are since the previous /stats
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = self.checked = time.time()
+        self.requests = 0
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        self.checked_messages = 0
+        self.checked_bytes = 0
+
+    def add(self, messages, size_b):
+        with self.lock:
+            self.requests += 1
+            self.messages += messages
+            self.bytes += size_b
+        return
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+        return
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            recent_s = max(now - self.checked, 1e-6)
+            out = {
+                'uptime_seconds': now - self.started,
+                'requests': self.requests,
+                'messages': self.messages,
+                'bytes': self.bytes,
+                'errors': self.errors,
+                'messages_per_second': self.messages / max(now - self.started, 1e-6),
+                'bytes_per_second': self.bytes / max(now - self.started, 1e-6),
+                'recent_messages_per_second': (self.messages - self.checked_messages) / recent_s,
+                'recent_bytes_per_second': (self.bytes - self.checked_bytes) / recent_s,
+            }
+            self.checked, self.checked_messages, self.checked_bytes = now, self.messages, self.bytes
+        return out
+
+
+class RestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # POST /topics/<topic>            the body is a single message; the
+    #                                 'key' query parameter is its key
+    # POST /topics/<topic>/bulk       newline delimited messages
+    # GET  /stats                     throughput, and queue depth
+    # GET  /metrics                   client metrics, see kafka.metrics
+    #
+    # a POST returns once the broker acked the messages, unless the
+    # 'async' query parameter is set, in which case it returns as soon as
+    # the messages are queued; messages from all the clients go through
+    # the one KafkaAsyncProducer per topic, so they are batched together
+
+    protocol_version = "HTTP/1.1" # keep-alive
+    server_version = "kafka-rest/%s" % kafka.__version__
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s %s", self.address_string(), fmt % args)
+
+    def respond(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+        return
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == "/stats":
+            self.respond(200, self.server.stats())
+        elif path == "/metrics":
+            self.respond(200, kafka.metrics.REGISTRY.snapshot())
+        else:
+            self.respond(404, {'error': "not found: %s" % path})
+        return
+
+    def do_POST(self):
+
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        # without a valid content length, there is no telling where the
+        # next request on the connection starts, so it is closed
+        length = self.headers.getheader("Content-Length")
+        if length is None:
+            self.close_connection = 1
+            self.respond(411, {'error': "Content-Length required"})
+            return
+        try:
+            size_b = int(length)
+        except ValueError:
+            size_b = -1
+        if size_b < 0:
+            self.close_connection = 1
+            self.respond(400, {'error': "bad Content-Length: %s" % length})
+            return
+        if size_b > MAX_BODY_BYTES:
+            self.close_connection = 1
+            self.respond(413, {'error': "body larger than %i bytes" % MAX_BODY_BYTES})
+            return
+        body = self.read_body(size_b)
+
+        if len(parts) not in (2, 3) or parts[0] != "topics" or (len(parts) == 3 and parts[2] != "bulk"):
+            self.respond(404, {'error': "not found: %s" % url.path})
+            return
+
+        topic = parts[1]
+        if len(parts) == 3:
+            messages, last = kafka.framing.split_delimited(body, "\n")
+            if last: messages.append(last)
+            keys = None
+        else:
+            messages = [body]
+            keys = query.get("key", [None])[:1]
+
+        try:
+            producer = self.server.get_producer(topic)
+            futures = producer.send(messages, keys)
+            if "async" not in query:
+                for future in futures:
+                    future.result(ACK_TIMEOUT_SECONDS)
+
+        except (kafka.protocol.KafkaError, kafka.producer.KafkaProducerError, IOError, KeyError) as exc:
+            logger.warning("topic: %s, %r", topic, exc)
+            self.server.rest_stats.error()
+            self.respond(503, {'error': repr(exc)})
+            return
+
+        self.server.rest_stats.add(len(messages), len(body))
+        self.respond(202 if "async" in query else 200, {'messages': len(messages)})
+        return
+
+    def read_body(self, size_b):
+        return self.rfile.read(size_b) if size_b else ""
+
+
+class RestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    # a thread per connection; the producers (one per topic, created on
+    # first use) are shared by all the connections
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, hosts, producer_class=kafka.producer.KafkaAsyncProducer, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RestHandler)
+        self.hosts = hosts
+        self.producer_class = producer_class
+        self.producer_kwargs = kwargs # passed on to producer_class
+        self.producers = {} # topic -> producer
+        self.producers_lock = threading.Lock()
+        self.topic_locks = {} # topic -> lock held while its producer is created
+        self.rest_stats = RestStats()
+
+    def __repr__(self):
+        return "RestServer(%r, '%s')" % (self.server_address, self.hosts)
+
+    def get_producer(self, topic):
+
+        # creating a producer takes a metadata round trip, so it is done
+        # holding only the topic's lock, and requests for other topics
+        # aren't held up behind it
+        with self.producers_lock:
+            if topic in self.producers:
+                return self.producers[topic]
+            lock = self.topic_locks.setdefault(topic, threading.Lock())
+        with lock:
+            with self.producers_lock:
+                if topic in self.producers:
+                    return self.producers[topic]
+            producer = self.producer_class(hosts=self.hosts, topic=topic, **self.producer_kwargs)
+            logger.info("created producer: %r", producer)
+            with self.producers_lock:
+                self.producers[topic] = producer
+            return producer
+
+    def stats(self):
+        out = self.rest_stats.snapshot()
+        with self.producers_lock:
+            producers = self.producers.items()
+        out['topics'] = {}
+        for topic, producer in producers:
+            messages, size_b = producer.queue_depth()
+            out['topics'][topic] = {'queued_messages': messages, 'queued_bytes': size_b}
+        return out
+
+    def close(self):
+        self.server_close()
+        with self.producers_lock:
+            for producer in self.producers.values():
+                producer.close()
+                producer.client.close()
+            self.producers.clear()
+        return
+
+
+def args_parser():
+
+    epilog = """
+POST /topics/<topic> sends the body as a single message (with the 'key'
+query parameter as its key), POST /topics/<topic>/bulk sends the body
+as newline delimited messages. Requests return once the messages are
+acked by the broker, or right away with the 'async' query parameter.
+Messages from all the clients are batched together, per partition. GET
+/stats returns throughput and queue depth. Connections are kept alive.
+
+"""
+
+    parser = argparse.ArgumentParser(description="Kafka producer REST server (%s)" % (kafka.__version__, ), epilog=epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('hosts', type=str, action='store', default='localhost:9092', help="broker1:port1,broker2:port2; (%(default)s)")
+    parser.add_argument('--verbose', '-v', action='count', default=0, help="try -v, -vv, -vvv")
+    parser.add_argument('--bind', metavar='ADDRESS', type=str, action='store', default='127.0.0.1', help="(%(default)s)")
+    parser.add_argument('--port', type=int, action='store', default=REST_PORT, help="(%(default)s)")
+    parser.add_argument('--partitioner', choices=sorted(kafka.partitioner.PARTITIONERS), action='store', default='roundrobin', help="(%(default)s)")
+    parser.add_argument('--compression', choices=sorted(kafka.producer.CODECS), action='store', default='none', help="(%(default)s)")
+    parser.add_argument('--linger', metavar='SECONDS', type=float, action='store', default=kafka.producer.LINGER_SECONDS, help="how long a partition's batch waits to fill up; (%(default)s)")
+    parser.add_argument('--batch-bytes', metavar='BYTES', type=int, action='store', default=kafka.producer.SEND_EVERY_N_BYTES, help="(%(default)s)")
+    parser.add_argument('--metrics-file', metavar='PATH', type=str, action='store', default=None, help="append client metrics to this file, as JSON lines; (%(default)s)")
+    parser.add_argument('--metrics-statsd', metavar='PORT', type=int, action='store', default=None, help="send client metrics to a statsd on localhost; (%(default)s)")
+    parser.add_argument('--metrics-seconds', metavar='N', type=float, action='store', default=kafka.metrics.REPORT_EVERY_N_SECONDS, help="(%(default)s)")
+
+    return parser
+
+
+def main():
+
+    args = args_parser().parse_args()
+    kafka.log.set_up_logging(level=logging.ERROR-(args.verbose*10))
+
+    server = RestServer(
+        (args.bind, args.port),
+        args.hosts,
+        codec=kafka.producer.CODECS[args.compression],
+        partitioner=kafka.partitioner.PARTITIONERS[args.partitioner],
+        linger_seconds=args.linger,
+        batch_bytes=args.batch_bytes,
+    )
+    logger.info("listening on: %s:%i", args.bind, args.port)
+    reporter = kafka.metrics.start_reporter(path=args.metrics_file, statsd_port=args.metrics_statsd, seconds=args.metrics_seconds)
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        logger.info("keyboard interrupt")
+
+    finally:
+        server.close()
+        if reporter:
+            reporter.stop()
+            reporter.join()
+
+
+if __name__ == "__main__":
+    main()
+
@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+# Micro-benchmarks for the protocol encoders and decoders, on synthetic
+# message sets, from 10 byte to 1MB messages, 1 to 100k messages per set:
+#
+#     python -m kafka.test.bench_protocol --output 0.0.5.json
+#     python -m kafka.test.bench_protocol --baseline 0.0.5.json
+#
+# Each case runs in a forked process, so that its peak memory (the growth
+# of ru_maxrss over what the input took) isn't hidden by an earlier case.
+# Results are saved as JSON, and compared with --baseline, to catch codec
+# regressions between releases. This isn't part of the unit tests.
+
+import sys
+import os
+import time
+import json
+import random
+import struct
+import resource
+import platform
+import argparse
+
+import kafka
+import kafka.protocol
+import kafka.codec
+
+MESSAGE_BYTES = [10, 100, 1000, 10000, 100000, 2**20]
+MESSAGES = [1, 100, 10000, 100000]
+MAX_SET_BYTES = 2**28 # 256MB, bigger cases (say 100k 1MB messages) are skipped
+MIN_SECONDS = 1.0 # each case is repeated for at least this long
+SEED = 42 # payloads are the same from run to run
+CODECS = {
+    'none': kafka.protocol.CODEC_NONE,
+    'gzip': kafka.protocol.CODEC_GZIP,
+    'snappy': kafka.protocol.CODEC_SNAPPY,
+}
+WORDS = ["kafka", "broker", "partition", "offset", "message", "topic", "leader", "replica", "12345", "0.8", "{", "}", ":", ","]
+
+
+def payload(size):
+    # text-like, so that it compresses about as well as log lines do
+    rnd = random.Random(SEED)
+    chunk = " ".join(rnd.choice(WORDS) for i in range(4096))
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def message_set(size, count):
+    value = payload(size)
+    return [kafka.protocol.Message(0, 0, None, value) for i in range(count)]
+
+
+def fetch_response(size, count, codec):
+    # as the broker sends it, one partition, minus the size prefix
+    data = kafka.protocol.encode_message_set(message_set(size, count), codec=codec)
+    return struct.pack('>ii', 0, 1) + kafka.protocol.write_short_string("bench") + struct.pack('>iihqi', 1, 0, 0, count, len(data)) + data
+
+
+def metadata_response(count):
+    # 'count' partitions, 3 brokers, 3 replicas each
+    out = struct.pack('>ii', 0, 3)
+    for broker in range(3):
+        out += struct.pack('>i', broker) + kafka.protocol.write_short_string("broker%i.example.com" % broker) + struct.pack('>i', 9092)
+    out += struct.pack('>ih', 1, 0) + kafka.protocol.write_short_string("bench") + struct.pack('>i', count)
+    for partition in range(count):
+        replicas = [(partition + i) % 3 for i in range(3)]
+        out += struct.pack('>hii', 0, partition, replicas[0]) + struct.pack('>i3i', 3, *replicas) + struct.pack('>i3i', 3, *replicas)
+    return out
+
+
+# each path takes (message_bytes, messages, codec), builds its input, and
+# returns a function doing the work once, on that input
+
+def bench_encode_message_set(size, count, codec):
+    messages = message_set(size, count)
+    return lambda: kafka.protocol.encode_message_set(messages, codec=codec)
+
+
+def bench_encode_produce_request(size, count, codec):
+    requests = [kafka.protocol.ProduceRequest("bench", 0, message_set(size, count))]
+    return lambda: kafka.protocol.encode_produce_request("bench", 0, requests, codec=codec)
+
+
+def bench_decode_message_set_iter(size, count, codec):
+    data = kafka.protocol.encode_message_set(message_set(size, count), codec=codec)
+    def run():
+        for m in kafka.protocol.decode_message_set_iter(data):
+            pass
+    return run
+
+
+def bench_decode_fetch_response(size, count, codec, views=False):
+    data = fetch_response(size, count, codec)
+    def run():
+        for r in kafka.protocol.decode_fetch_response(data, views=views):
+            for m in r.messages:
+                pass
+    return run
+
+
+def bench_decode_fetch_response_views(size, count, codec):
+    return bench_decode_fetch_response(size, count, codec, views=True)
+
+
+def bench_decode_metadata_response(size, count, codec):
+    # 'count' is the number of partitions; message size and codec don't apply
+    data = metadata_response(count)
+    return lambda: kafka.protocol.decode_metadata_response(data)
+
+
+PATHS = {
+    'encode_message_set': bench_encode_message_set,
+    'encode_produce_request': bench_encode_produce_request,
+    'decode_message_set_iter': bench_decode_message_set_iter,
+    'decode_fetch_response': bench_decode_fetch_response,
+    'decode_fetch_response_views': bench_decode_fetch_response_views,
+    'decode_metadata_response': bench_decode_metadata_response,
+}
+CODEC_PATHS = set(PATHS) - set(['decode_metadata_response'])
+
+
+def maxrss_bytes():
+    # ru_maxrss is in kilobytes on linux, in bytes on os x
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(path, size, count, codec, min_seconds=MIN_SECONDS):
+
+    # -> result dict; runs in the forked child
+    run = PATHS[path](size, count, CODECS[codec])
+    rss = maxrss_bytes()
+    iterations = 0
+    started = time.time()
+    elapsed = 0
+    while iterations == 0 or elapsed < min_seconds:
+        run()
+        iterations += 1
+        elapsed = time.time() - started
+    messages = iterations * count
+    return {
+        'path': path,
+        'codec': codec,
+        'message_bytes': size,
+        'messages': count,
+        'iterations': iterations,
+        'seconds': elapsed,
+        'messages_per_second': messages / elapsed,
+        'mb_per_second': messages * size / elapsed / 2**20,
+        'peak_bytes': max(0, maxrss_bytes() - rss),
+    }
+
+
+def measure_forked(path, size, count, codec, min_seconds=MIN_SECONDS):
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            out = measure(path, size, count, codec, min_seconds)
+        except Exception as exc:
+            out = {'path': path, 'codec': codec, 'message_bytes': size, 'messages': count, 'error': repr(exc)}
+        with os.fdopen(w, 'w') as f:
+            f.write(json.dumps(out))
+        os._exit(0)
+
+    os.close(w)
+    with os.fdopen(r) as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        return {'path': path, 'codec': codec, 'message_bytes': size, 'messages': count, 'error': "benchmark process died"}
+    return json.loads(data)
+
+
+def cases(paths, codecs, sizes, counts, max_set_bytes=MAX_SET_BYTES):
+
+    # -> [(path, message_bytes, messages, codec), ...]
+    out = []
+    for path in paths:
+        for codec in (codecs if path in CODEC_PATHS else ['none']):
+            for count in counts:
+                for size in (sizes if path in CODEC_PATHS else [0]):
+                    if size * count > max_set_bytes:
+                        continue
+                    out.append((path, size, count, codec))
+    return out
+
+
+def key(result):
+    return (result['path'], result['codec'], result['message_bytes'], result['messages'])
+
+
+def run(paths, codecs, sizes, counts, min_seconds=MIN_SECONDS, max_set_bytes=MAX_SET_BYTES, baseline=None):
+
+    # runs the cases, prints a line for each, returns the report; if
+    # 'baseline' (an earlier report) is given, each line has the change
+    # in messages/s against it
+    base = {key(r): r for r in (baseline or {}).get('results', []) if 'error' not in r}
+    report = {
+        'version': kafka.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'snappy': kafka.codec.has_snappy(),
+        'started': time.time(),
+        'min_seconds': min_seconds,
+        'results': [],
+    }
+    for path, size, count, codec in cases(paths, codecs, sizes, counts, max_set_bytes):
+        result = measure_forked(path, size, count, codec, min_seconds)
+        report['results'].append(result)
+        line = "%-28s %-6s %8i B x %6i" % (path, codec, size, count)
+        if 'error' in result:
+            print "%s  %s" % (line, result['error'])
+            continue
+        line += "  %12.0f msg/s %10.2f MB/s %10.2f MB peak" % (result['messages_per_second'], result['mb_per_second'], result['peak_bytes'] / 2.0**20)
+        if key(result) in base:
+            line += "  %+6.1f%%" % (100.0 * result['messages_per_second'] / base[key(result)]['messages_per_second'] - 100)
+        print line
+        sys.stdout.flush()
+    return report
+
+
+def args_parser():
+
+    parser = argparse.ArgumentParser(description="Kafka protocol codec benchmarks (%s)" % (kafka.__version__, ))
+    parser.add_argument('--paths', metavar='PATH', nargs='+', choices=sorted(PATHS), default=sorted(PATHS), help="(all)")
+    parser.add_argument('--codecs', metavar='CODEC', nargs='+', choices=sorted(CODECS), default=None, help="(none, gzip, and snappy if installed)")
+    parser.add_argument('--sizes', metavar='BYTES', type=int, nargs='+', default=MESSAGE_BYTES, help="message sizes; (%(default)s)")
+    parser.add_argument('--counts', metavar='N', type=int, nargs='+', default=MESSAGES, help="messages per set; (%(default)s)")
+    parser.add_argument('--seconds', type=float, action='store', default=MIN_SECONDS, help="minimum time per case; (%(default)s)")
+    parser.add_argument('--max-set-bytes', metavar='BYTES', type=int, action='store', default=MAX_SET_BYTES, help="skip bigger cases; (%(default)s)")
+    parser.add_argument('--output', metavar='FILE', type=str, action='store', default=None, help="save the results as JSON")
+    parser.add_argument('--baseline', metavar='FILE', type=str, action='store', default=None, help="compare with results saved earlier")
+    return parser
+
+
+def main():
+
+    args = args_parser().parse_args()
+    codecs = args.codecs or (['none', 'gzip'] + (['snappy'] if kafka.codec.has_snappy() else []))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report = run(args.paths, codecs, sorted(args.sizes), sorted(args.counts), args.seconds, args.max_set_bytes, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
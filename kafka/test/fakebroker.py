@@ -0,0 +1,421 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+# An in-process, in-memory stand-in for a cluster of Kafka 0.8 brokers,
+# speaking the metadata, produce, fetch, offset, and offset commit /
+# fetch apis over real sockets on localhost, so that the client, the
+# consumer, and the producer can be tested (and load tested) without a
+# network or a VM:
+#
+#     cluster = FakeCluster(brokers=2)
+#     cluster.create_topic("topic1", partitions=4)
+#     client = kafka.client.KafkaClient(cluster.hosts)
+#     ...
+#     cluster.close()
+#
+# Latency is added with cluster.latency (or broker.latency), faults are
+# injected with cluster.inject(), brokers can be stopped, and partition
+# leadership moved.
+
+import struct
+import socket
+import logging
+import threading
+import time
+import collections
+import SocketServer
+
+import kafka.protocol
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITIONS = 2 # for topics created on first use
+POLL_SECONDS = 0.05 # how long stop() may wait for the listener thread
+REQUESTS_KEPT = 1000 # the last N requests are kept, so a long load run doesn't grow
+
+
+class FakeBrokerError(RuntimeError): pass
+
+
+class Fault(object):
+
+    # the next 'count' requests matching 'api_key' (any if None) and
+    # 'broker_id' (any if None) either get 'error' as the error code for
+    # every partition in the response, or get the connection closed
+    # without a response (if 'disconnect' is set)
+
+    def __init__(self, api_key=None, broker_id=None, error=None, disconnect=False, count=1):
+        self.api_key = api_key
+        self.broker_id = broker_id
+        self.error = error
+        self.disconnect = disconnect
+        self.count = count
+
+    def __repr__(self):
+        return "Fault(api_key=%r, broker_id=%r, error=%r, disconnect=%r, count=%i)" % (self.api_key, self.broker_id, self.error, self.disconnect, self.count)
+
+    def matches(self, api_key, broker_id):
+        return self.count > 0 and self.api_key in (None, api_key) and self.broker_id in (None, broker_id)
+
+
+class FakeCluster(object):
+
+    def __init__(self, brokers=1, auto_create=True, latency=0):
+        self.auto_create = auto_create
+        self.latency = latency # seconds, added to every response
+        self.lock = threading.Condition() # notified on every produce
+        self.logs = {} # TopicAndPartition -> [encoded message, ...]
+        self.leaders = {} # TopicAndPartition -> broker id
+        self.offsets = {} # (group, TopicAndPartition) -> (offset, metadata)
+        self.faults = []
+        self.requests = collections.deque(maxlen=REQUESTS_KEPT) # (broker id, api key), of the recent requests
+        self.brokers = [FakeBroker(self, broker_id) for broker_id in range(brokers)]
+        for broker in self.brokers:
+            broker.start()
+
+    def __repr__(self):
+        return "FakeCluster('%s')" % (self.hosts, )
+
+    @property
+    def hosts(self):
+        return ",".join("%s:%i" % (b.host, b.port) for b in self.brokers)
+
+    def close(self):
+        for broker in self.brokers:
+            broker.stop()
+        return
+
+    def create_topic(self, topic, partitions=DEFAULT_PARTITIONS):
+        # leadership goes round the brokers
+        with self.lock:
+            for partition in range(partitions):
+                topic_part = kafka.protocol.TopicAndPartition(topic, partition)
+                self.logs.setdefault(topic_part, [])
+                self.leaders.setdefault(topic_part, partition % len(self.brokers))
+        return
+
+    def move_leader(self, topic, partition, broker_id):
+        with self.lock:
+            self.leaders[kafka.protocol.TopicAndPartition(topic, partition)] = broker_id
+        return
+
+    def inject(self, **kwargs):
+        # see Fault
+        fault = Fault(**kwargs)
+        with self.lock:
+            self.faults.append(fault)
+        return fault
+
+    def messages(self, topic, partition):
+        # [Message, ...] in the partition's log
+        with self.lock:
+            log = list(self.logs[kafka.protocol.TopicAndPartition(topic, partition)])
+        data = "".join(struct.pack('>qi', n, len(m)) + m for n, m in enumerate(log))
+        return [m.message for m in kafka.protocol.decode_message_set_iter(data)]
+
+    def _fault(self, api_key, broker_id):
+        with self.lock:
+            self.requests.append((broker_id, api_key))
+            for fault in self.faults:
+                if fault.matches(api_key, broker_id):
+                    fault.count -= 1
+                    return fault
+        return None
+
+
+class FakeRequestHandler(SocketServer.BaseRequestHandler):
+
+    # one per connection, reads requests until the client goes away
+
+    def setup(self):
+        self.server.broker.connections.add(self.request)
+
+    def finish(self):
+        self.server.broker.connections.discard(self.request)
+
+    def handle(self):
+        while True:
+            data = self.read(4)
+            if not data:
+                return
+            (size,) = struct.unpack('>i', data)
+            data = self.read(size)
+            if len(data) < size:
+                return
+            response = self.server.broker.handle(data)
+            if response is False:
+                return # disconnect
+            if response is not None:
+                self.request.sendall(kafka.protocol.write_int_string(response))
+
+    def read(self, size):
+        chunks = []
+        while size:
+            try:
+                chunk = self.request.recv(size)
+            except socket.error:
+                return ""
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+
+class FakeBrokerServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeBroker(object):
+
+    def __init__(self, cluster, broker_id, host="127.0.0.1", port=0):
+        self.cluster = cluster
+        self.broker_id = broker_id
+        self.host = host
+        self.port = port
+        self.latency = 0 # seconds, on top of the cluster's
+        self.server = None
+        self.connections = set()
+        self.handlers = {
+            kafka.protocol.METADATA_KEY: self.handle_metadata,
+            kafka.protocol.PRODUCE_KEY: self.handle_produce,
+            kafka.protocol.FETCH_KEY: self.handle_fetch,
+            kafka.protocol.OFFSET_KEY: self.handle_offset,
+            kafka.protocol.OFFSET_COMMIT_KEY: self.handle_offset_commit,
+            kafka.protocol.OFFSET_FETCH_KEY: self.handle_offset_fetch,
+        }
+
+    def __repr__(self):
+        return "FakeBroker(%i, '%s', %i)" % (self.broker_id, self.host, self.port)
+
+    def start(self):
+        # on the same port, if restarted
+        self.server = FakeBrokerServer((self.host, self.port), FakeRequestHandler)
+        self.server.broker = self
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, args=(POLL_SECONDS, ), name="fake-broker-%i" % self.broker_id)
+        thread.daemon = True
+        thread.start()
+        return
+
+    def stop(self):
+        # as if the broker went away: listener and connections closed
+        if not self.server:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            conn.close()
+        return
+
+    def handle(self, data):
+
+        # returns the encoded response, None for no response, or False
+        # to close the connection
+        ((api_key, api_version, correlation_id), cur) = kafka.protocol.relative_unpack('>hhi', data, 0)
+        (client_id, cur) = kafka.protocol.read_short_string(data, cur)
+        fault = self.cluster._fault(api_key, self.broker_id)
+        if fault and fault.disconnect:
+            return False
+        if api_key not in self.handlers:
+            logger.warning("%r: unsupported api key: %i", self, api_key)
+            return False
+        latency = self.cluster.latency + self.latency
+        if latency:
+            time.sleep(latency)
+        body = self.handlers[api_key](data, cur, fault.error if fault else None)
+        if body is None:
+            return None
+        return struct.pack('>i', correlation_id) + body
+
+    def _leader(self, topic_part):
+        # -> error code for requests for the partition
+        leader = self.cluster.leaders.get(topic_part)
+        if leader is None:
+            return kafka.protocol.ERROR_UNKNOWN_TOPIC_OR_PARTITION
+        if leader != self.broker_id:
+            return kafka.protocol.ERROR_NOT_LEADER_FOR_PARTITION
+        return kafka.protocol.ERROR_NONE
+
+    def handle_metadata(self, data, cur, error):
+
+        ((num_topics,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        topics = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            topics.append(topic)
+
+        with self.cluster.lock:
+            known = set(tp.topic for tp in self.cluster.leaders)
+        for topic in topics:
+            if topic not in known and self.cluster.auto_create:
+                self.cluster.create_topic(topic)
+
+        with self.cluster.lock:
+            leaders = dict(self.cluster.leaders)
+        if not topics:
+            topics = sorted(set(tp.topic for tp in leaders))
+
+        out = struct.pack('>i', len(self.cluster.brokers))
+        for broker in self.cluster.brokers:
+            out += struct.pack('>i', broker.broker_id) + kafka.protocol.write_short_string(broker.host) + struct.pack('>i', broker.port)
+        out += struct.pack('>i', len(topics))
+        for topic in topics:
+            partitions = sorted(tp.partition for tp in leaders if tp.topic == topic)
+            topic_error = error or (kafka.protocol.ERROR_NONE if partitions else kafka.protocol.ERROR_UNKNOWN_TOPIC_OR_PARTITION)
+            out += struct.pack('>h', topic_error) + kafka.protocol.write_short_string(topic)
+            out += struct.pack('>i', len(partitions))
+            for partition in partitions:
+                leader = leaders[kafka.protocol.TopicAndPartition(topic, partition)]
+                out += struct.pack('>hiiiiii', kafka.protocol.ERROR_NONE, partition, leader, 1, leader, 1, leader)
+        return out
+
+    def handle_produce(self, data, cur, error):
+
+        ((acks, timeout, num_topics), cur) = kafka.protocol.relative_unpack('>hii', data, cur)
+        results = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+                (message_set, cur) = kafka.protocol.read_int_string(data, cur)
+                topic_part = kafka.protocol.TopicAndPartition(topic, partition)
+                # compressed sets are stored decompressed, a message each
+                messages = [kafka.protocol.encode_message(m.message) for m in kafka.protocol.decode_message_set_iter(message_set)]
+                with self.cluster.lock:
+                    partition_error = error or self._leader(topic_part)
+                    offset = -1
+                    if not partition_error:
+                        log = self.cluster.logs[topic_part]
+                        offset = len(log)
+                        log.extend(messages)
+                        self.cluster.lock.notify_all()
+                results.append((topic, partition, partition_error, offset))
+
+        if acks == 0:
+            return None
+        return self._encode_by_topic(results, lambda (topic, partition, error, offset): struct.pack('>ihq', partition, error, offset))
+
+    def handle_fetch(self, data, cur, error):
+
+        ((replica, max_wait_time, min_bytes, num_topics), cur) = kafka.protocol.relative_unpack('>iiii', data, cur)
+        requests = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, offset, max_bytes), cur) = kafka.protocol.relative_unpack('>iqi', data, cur)
+                requests.append(kafka.protocol.FetchRequest(topic, partition, offset, max_bytes))
+
+        # long poll: wait for min_bytes to be produced, up to max_wait_time
+        deadline = time.time() + max_wait_time / 1000.0
+        with self.cluster.lock:
+            while True:
+                results = [self._fetch(r, error) for r in requests]
+                available = sum(len(r[4]) for r in results)
+                wait = deadline - time.time()
+                if available >= min_bytes or wait <= 0:
+                    break
+                self.cluster.lock.wait(wait)
+
+        return self._encode_by_topic(results, lambda (topic, partition, error, highwater, message_set): struct.pack('>ihq', partition, error, highwater) + kafka.protocol.write_int_string(message_set))
+
+    def _fetch(self, request, error):
+
+        # the caller holds the cluster lock
+        topic_part = kafka.protocol.TopicAndPartition(request.topic, request.partition)
+        error = error or self._leader(topic_part)
+        if error:
+            return (request.topic, request.partition, error, -1, "")
+        log = self.cluster.logs[topic_part]
+        # fetching at the end of the log is fine (and gets nothing), past
+        # it is an error, as with kafka
+        if not 0 <= request.offset <= len(log):
+            return (request.topic, request.partition, kafka.protocol.ERROR_OFFSET_OUT_OF_RANGE, len(log), "")
+        chunks = []
+        size_b = 0
+        for offset in xrange(request.offset, len(log)):
+            chunk = struct.pack('>qi', offset, len(log[offset])) + log[offset]
+            chunks.append(chunk)
+            size_b += len(chunk)
+            if size_b >= request.max_bytes:
+                break
+        # as with kafka, the last message may be partial
+        message_set = "".join(chunks)[:request.max_bytes]
+        return (request.topic, request.partition, kafka.protocol.ERROR_NONE, len(log), message_set)
+
+    def handle_offset(self, data, cur, error):
+
+        ((replica, num_topics), cur) = kafka.protocol.relative_unpack('>ii', data, cur)
+        results = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, when, max_offsets), cur) = kafka.protocol.relative_unpack('>iqi', data, cur)
+                topic_part = kafka.protocol.TopicAndPartition(topic, partition)
+                with self.cluster.lock:
+                    partition_error = error or self._leader(topic_part)
+                    offsets = []
+                    if not partition_error:
+                        # -1 is the latest offset, -2 the earliest
+                        offsets = [0] if when == -2 else [len(self.cluster.logs[topic_part])]
+                results.append((topic, partition, partition_error, offsets))
+
+        return self._encode_by_topic(results, lambda (topic, partition, error, offsets): struct.pack('>ihi', partition, error, len(offsets)) + "".join(struct.pack('>q', o) for o in offsets))
+
+    def handle_offset_commit(self, data, cur, error):
+
+        (group, cur) = kafka.protocol.read_short_string(data, cur)
+        ((num_topics,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        results = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, offset), cur) = kafka.protocol.relative_unpack('>iq', data, cur)
+                (metadata, cur) = kafka.protocol.read_short_string(data, cur)
+                if not error:
+                    with self.cluster.lock:
+                        self.cluster.offsets[(group, kafka.protocol.TopicAndPartition(topic, partition))] = (offset, metadata)
+                results.append((topic, partition, error or kafka.protocol.ERROR_NONE))
+
+        return self._encode_by_topic(results, lambda (topic, partition, error): struct.pack('>ih', partition, error))
+
+    def handle_offset_fetch(self, data, cur, error):
+
+        (group, cur) = kafka.protocol.read_short_string(data, cur)
+        ((num_topics,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        results = []
+        for i in range(num_topics):
+            (topic, cur) = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition,), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+                with self.cluster.lock:
+                    (offset, metadata) = self.cluster.offsets.get((group, kafka.protocol.TopicAndPartition(topic, partition)), (-1, ""))
+                results.append((topic, partition, offset, metadata, error or kafka.protocol.ERROR_NONE))
+
+        return self._encode_by_topic(results, lambda (topic, partition, offset, metadata, error): struct.pack('>iq', partition, offset) + kafka.protocol.write_short_string(metadata) + struct.pack('>h', error))
+
+    def _encode_by_topic(self, results, encode_partition):
+
+        # results are tuples starting with (topic, partition, ...), which
+        # get encoded grouped by topic, with encode_partition(result)
+        by_topic = {}
+        for result in results:
+            by_topic.setdefault(result[0], []).append(result)
+        out = struct.pack('>i', len(by_topic))
+        for topic, topic_results in by_topic.items():
+            out += kafka.protocol.write_short_string(topic) + struct.pack('>i', len(topic_results))
+            out += "".join(encode_partition(r) for r in topic_results)
+        return out
+
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+
+import kafka.protocol
+import kafka.bench
+from kafka.test.fakebroker import FakeCluster
+
+
+class BenchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = FakeCluster(brokers=2)
+        self.cluster.create_topic("unittest1", partitions=4)
+
+    def tearDown(self):
+        self.cluster.close()
+
+    def test_payload(self):
+        payload = kafka.bench.encode_payload(7, 100, sent=1.5)
+        self.assertEqual(len(payload), 100)
+        self.assertEqual(kafka.bench.decode_payload(payload), (1.5, 7))
+
+    def test_percentile(self):
+        values = range(1000)
+        self.assertEqual([kafka.bench.percentile(values, p) for p in (0.5, 0.99, 0.999, 1)], [500, 990, 999, 999])
+        self.assertEqual(kafka.bench.percentile([], 0.5), None)
+
+    def test_run(self):
+        report = kafka.bench.run(self.cluster.hosts, topic="unittest1", size=50, batch=100, messages=1000, seconds=0, drain_seconds=2)
+        self.assertEqual((report['sent'], report['errors'], report['received']), (1000, 0, 1000))
+        self.assertEqual(report['message_bytes'], 50)
+        latency = report['latency_ms']
+        self.assertTrue(0 <= latency['p50'] <= latency['p99'] <= latency['p999'] <= latency['max'])
+        self.assertTrue(kafka.bench.format_report(report))
+
+    def test_rate(self):
+        # 300 messages at 1000/s take at least 0.2s (the first batch goes right away)
+        report = kafka.bench.run(self.cluster.hosts, topic="unittest1", size=20, batch=100, rate=1000, messages=300, seconds=0, async=True, drain_seconds=2)
+        self.assertEqual(report['received'], 300)
+        self.assertTrue(report['produce_seconds'] >= 0.2)
+
+    def test_async_errors(self):
+        # the failed messages are counted, so the consumer doesn't wait
+        # out the drain for them
+        self.cluster.inject(api_key=kafka.protocol.PRODUCE_KEY, error=kafka.protocol.ERROR_LEADER_NOT_AVAILABLE, count=1000)
+        report = kafka.bench.run(self.cluster.hosts, topic="unittest1", size=20, batch=100, messages=300, seconds=0, async=True, drain_seconds=10)
+        self.assertEqual((report['sent'], report['errors'], report['received']), (300, 300, 0))
+        self.assertTrue(report['consume_seconds'] < 5)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+
+import kafka.test.bench_protocol as bench
+
+
+class BenchProtocolTest(unittest.TestCase):
+
+    def test_cases(self):
+        cases = bench.cases(["encode_message_set", "decode_metadata_response"], ["none", "gzip"], [10, 2**20], [1, 1000], max_set_bytes=2**20)
+        self.assertEqual(cases, [
+            ("encode_message_set", 10, 1, "none"),
+            ("encode_message_set", 2**20, 1, "none"),
+            ("encode_message_set", 10, 1000, "none"),
+            ("encode_message_set", 10, 1, "gzip"),
+            ("encode_message_set", 2**20, 1, "gzip"),
+            ("encode_message_set", 10, 1000, "gzip"),
+            ("decode_metadata_response", 0, 1, "none"),
+            ("decode_metadata_response", 0, 1000, "none"),
+        ])
+
+    def test_paths(self):
+        # every path runs, on the smallest input
+        for path in sorted(bench.PATHS):
+            result = bench.measure(path, 10, 2, "gzip", min_seconds=0)
+            self.assertEqual((result['iterations'], result['messages']), (1, 2))
+
+    def test_forked(self):
+        result = bench.measure_forked("decode_fetch_response", 100, 10, "none", min_seconds=0)
+        self.assertAlmostEqual(result['mb_per_second'], result['messages_per_second'] * 100 / 2**20)
+        self.assertTrue(result['peak_bytes'] >= 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
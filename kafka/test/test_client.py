@@ -5,6 +5,7 @@
 import unittest
 import logging
 import base64
+import struct
 
 import kafka.protocol
 import kafka.connection
@@ -12,6 +13,42 @@ import kafka.client
 import kafka.test.test_connection
 
 
+def encode_metadata_response(correlation_id, brokers, topics):
+    # brokers: [BrokerMetadata, ...], topics: {topic: {partition: leader}}
+    data = struct.pack('>ii', correlation_id, len(brokers))
+    for broker in brokers:
+        data += struct.pack('>i', broker.nodeId) + kafka.protocol.write_short_string(broker.host) + struct.pack('>i', broker.port)
+    data += struct.pack('>i', len(topics))
+    for topic, partitions in topics.items():
+        data += struct.pack('>h', 0) + kafka.protocol.write_short_string(topic) + struct.pack('>i', len(partitions))
+        for partition, leader in partitions.items():
+            data += struct.pack('>hiiiiii', 0, partition, leader, 1, leader, 1, leader)
+    return data
+
+
+class MetadataClient(kafka.client.KafkaClient):
+
+    # answers metadata requests from self.cluster, records the topics
+    # asked for
+    def send_request(self, request_id, request, broker=None):
+        (correlation_id, ), cur = kafka.protocol.relative_unpack('>i', request, 8)
+        client_id, cur = kafka.protocol.read_short_string(request, cur)
+        (num_topics, ), cur = kafka.protocol.relative_unpack('>i', request, cur)
+        topics = []
+        for i in range(num_topics):
+            topic, cur = kafka.protocol.read_short_string(request, cur)
+            topics.append(topic)
+        self.requested.append(topics)
+        brokers, cluster = CLUSTER
+        return encode_metadata_response(correlation_id, brokers, dict((t, p) for t, p in cluster.items() if t in topics or not topics))
+
+
+CLUSTER = (
+    [kafka.protocol.BrokerMetadata(0, "192.168.33.10", 9092), kafka.protocol.BrokerMetadata(1, "192.168.33.10", 9093)],
+    {"topic1": {0: 0, 1: 1}, "topic2": {0: 1}},
+)
+
+
 class ClientTest(unittest.TestCase):
 
     def test_init(self):
@@ -29,6 +66,25 @@ class ClientTest(unittest.TestCase):
         self.assertTrue('foo' in data)
         self.assertTrue('bar' in data)
 
+    def test_fetch_multi(self):
+        client = kafka.client.KafkaClient("192.168.33.10:9092")
+        requests = [kafka.protocol.FetchRequest("unittest1", n, 0, kafka.client.FETCH_BUFFER_SIZE_BYTES) for n in range(4)]
+        messages = client.fetch_multi(requests)
+        self.assertEqual(sorted(messages.keys()), [kafka.protocol.TopicAndPartition("unittest1", n) for n in range(4)])
+        data = [m.message.value for p in messages.values() for m in p]
+        self.assertTrue('foo' in data)
+        self.assertTrue('bar' in data)
+
+    def test_send_requests(self):
+        client = kafka.client.KafkaClient("192.168.33.10:9092")
+        broker = client.get_topic_leader("unittest1", 0)
+        request_ids = [kafka.client.ID_GEN.next() for _ in range(20)]
+        requests = [(i, kafka.protocol.encode_metadata_request(client.client_id, i, ["unittest1"]), broker) for i in request_ids]
+        responses = [(i, kafka.protocol.relative_unpack('>i', r, 0)[0][0]) for i, r in client.send_requests(requests, max_in_flight=4)]
+        # responses are matched to requests on correlation id
+        self.assertEqual(responses, [(i, i) for i in request_ids])
+        self.assertEqual(client.get_connection(broker).in_flight, set())
+
     def test_get_offsets(self):
         client = kafka.client.KafkaClient("192.168.33.10:9092")
         client.get_offset(topic='unittest1', partition=0)
@@ -59,6 +115,86 @@ class ClientTest(unittest.TestCase):
 
 
 
+class MetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        MetadataClient.requested = []
+
+    def test_all_topics(self):
+        client = MetadataClient("192.168.33.10:9092")
+        self.assertEqual(client.requested, [[]])
+        self.assertEqual(sorted(client.topic_partitions), ["topic1", "topic2"])
+
+    def test_topics(self):
+        client = MetadataClient("192.168.33.10:9092", topics=["topic1"])
+        self.assertEqual(client.requested, [["topic1"]])
+        self.assertEqual(client.topic_partitions, {"topic1": [0, 1]})
+        self.assertEqual(client.get_topic_leader("topic1", 1), CLUSTER[0][1])
+        # other topics are fetched when first used
+        self.assertEqual(client.get_topic_leader("topic2", 0), CLUSTER[0][1])
+        self.assertEqual(client.requested, [["topic1"], ["topic2"]])
+        self.assertEqual(sorted(client.topic_partitions), ["topic1", "topic2"])
+
+    def test_ttl(self):
+        client = MetadataClient("192.168.33.10:9092", topics=["topic1", "topic2"], metadata_ttl=60)
+        client.get_topic_leader("topic1", 0)
+        self.assertEqual(client.requested, [["topic1", "topic2"]])
+        client.topics_refreshed["topic1"] -= 61
+        client.get_topic_leader("topic1", 0)
+        client.get_topic_leader("topic2", 0)
+        self.assertEqual(client.requested, [["topic1", "topic2"], ["topic1"]])
+
+    def test_invalidate_topic(self):
+        client = MetadataClient("192.168.33.10:9092", topics=["topic1", "topic2"])
+        topics_to_brokers = client.topics_to_brokers
+        client.invalidate_topic("topic2")
+        client.get_topic_leader("topic1", 0)
+        client.get_topic_leader("topic2", 0)
+        self.assertEqual(client.requested, [["topic1", "topic2"], ["topic2"]])
+        # the refresh updates the same dict
+        self.assertTrue(client.topics_to_brokers is topics_to_brokers)
+        self.assertEqual(len(topics_to_brokers), 3)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        MetadataClient.requested = []
+
+    def test_get_connection(self):
+        client = MetadataClient("192.168.33.10:9092")
+        broker0, broker1 = client.brokers[0], client.brokers[1]
+        conn0 = client.get_connection(broker0)
+        self.assertEqual((conn0.host, conn0.port), (broker0.host, broker0.port))
+        self.assertTrue(client.get_connection(broker0) is conn0)
+        conn1 = client.get_connection(broker1)
+        self.assertFalse(conn1 is conn0)
+        self.assertEqual(sorted(client.broker_conns), [0, 1])
+        # the seed list is not changed
+        self.assertEqual(len(client.conns), 1)
+
+    def test_seed_connection_reused(self):
+        client = MetadataClient("%s:%i" % (CLUSTER[0][0].host, CLUSTER[0][0].port))
+        self.assertTrue(client.get_connection(client.brokers[0]) is client.conns[0])
+
+    def test_broker_moved(self):
+        client = MetadataClient("192.168.33.10:9092")
+        conn = client.get_connection(client.brokers[1])
+        moved = client.brokers[1]._replace(port=9094)
+        client.brokers[1] = moved
+        self.assertEqual(client.get_connection(moved).port, 9094)
+        self.assertFalse(client.get_connection(moved) is conn)
+
+    def test_close_idle(self):
+        client = MetadataClient("192.168.33.10:9092")
+        conn0 = client.get_connection(client.brokers[0])
+        client.get_connection(client.brokers[1])
+        client.broker_conns_used[1] -= kafka.client.CONNECTION_IDLE_SECONDS + 1
+        client.close_idle(kafka.client.CONNECTION_IDLE_SECONDS)
+        self.assertEqual(sorted(client.broker_conns), [0])
+        self.assertTrue(client.get_connection(client.brokers[0]) is conn0)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
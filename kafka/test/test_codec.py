@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import gzip
+import StringIO
+import struct
+
+import kafka.codec
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_gzip(self):
+        payload = "foo" * 1000
+        self.assertEqual(kafka.codec.gzip_decode(kafka.codec.gzip_encode(payload)), payload)
+
+    def test_gzip_compat(self):
+        # payloads written by other clients are plain gzip files
+        buf = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj=buf, mode='w')
+        f.write("foo")
+        f.close()
+        self.assertEqual(kafka.codec.gzip_decode(buf.getvalue()), "foo")
+        f = gzip.GzipFile(fileobj=StringIO.StringIO(kafka.codec.gzip_encode("bar")))
+        self.assertEqual(f.read(), "bar")
+
+    @unittest.skipUnless(kafka.codec.has_snappy(), "python-snappy not installed")
+    def test_snappy(self):
+        payload = "foo" * 1000
+        self.assertEqual(kafka.codec.snappy_decode(kafka.codec.snappy_encode(payload, xerial=False)), payload)
+
+    @unittest.skipUnless(kafka.codec.has_snappy(), "python-snappy not installed")
+    def test_snappy_xerial(self):
+        payload = "".join(str(i) for i in range(100000))
+        encoded = kafka.codec.snappy_encode(payload, block_size=1024)
+        self.assertTrue(kafka.codec.is_xerial(encoded))
+        self.assertEqual(kafka.codec.snappy_decode(encoded), payload)
+        # as written by snappy-java
+        encoded = kafka.codec.XERIAL_HEADER
+        for block in ("foo", "bar"):
+            compressed = kafka.codec.snappy.compress(block)
+            encoded += struct.pack('>i', len(compressed)) + compressed
+        self.assertEqual(kafka.codec.snappy_decode(encoded), "foobar")
+
+    def test_is_xerial(self):
+        self.assertEqual(kafka.codec.XERIAL_HEADER, '\x82SNAPPY\x00\x00\x00\x00\x01\x00\x00\x00\x01')
+        self.assertTrue(kafka.codec.is_xerial(kafka.codec.XERIAL_HEADER + "foo"))
+        self.assertFalse(kafka.codec.is_xerial("foo"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -21,6 +21,11 @@ class MockSocket(object):
     def connect(self, (host, port)): pass
     def sendall(self, data): MockSocket.SEND = data
     def recv(self, size_b): return "".join(itertools.islice(MockSocket.RECV, 0, size_b))
+    def recv_into(self, buf, size_b):
+        data = self.recv(size_b)
+        buf[:len(data)] = data
+        return len(data)
+    def close(self): pass
 
 
 class ConnectionTest(unittest.TestCase):
@@ -47,9 +52,55 @@ class ConnectionTest(unittest.TestCase):
 
     def test_recv(self):
         c = kafka.connection.KafkaConnection("192.168.33.10", 9092)
-        MockSocket.RECV = iter(struct.pack(">i%ds" % 3, 3, "bar"))
+        MockSocket.RECV = iter(struct.pack(">ii%ds" % 3, 7, 1, "bar"))
         data = c.recv(1)
-        self.assertEqual(data, "bar")
+        self.assertTrue(isinstance(data, memoryview))
+        self.assertEqual(data.tobytes(), struct.pack(">i", 1) + "bar")
+
+    def test_recv_out_of_order(self):
+        c = kafka.connection.KafkaConnection("192.168.33.10", 9092)
+        c.send(1, "foo")
+        c.send(2, "bar")
+        MockSocket.RECV = iter(struct.pack(">ii", 4, 1) + struct.pack(">ii", 4, 2))
+        # response to 1 comes first, and gets set aside
+        self.assertEqual(c.recv(2).tobytes(), struct.pack(">i", 2))
+        self.assertEqual(c.pending, {1: struct.pack(">i", 1)})
+        self.assertEqual(c.recv(1).tobytes(), struct.pack(">i", 1))
+        self.assertEqual((c.in_flight, c.pending), (set(), {}))
+
+    def test_recv_unknown_response(self):
+        c = kafka.connection.KafkaConnection("192.168.33.10", 9092)
+        c.send(2, "bar")
+        MockSocket.RECV = iter(struct.pack(">ii", 4, 1) + struct.pack(">ii", 4, 2))
+        self.assertEqual(c.recv(2).tobytes(), struct.pack(">i", 2))
+        self.assertEqual(c.pending, {})
+
+    def test_recv_reuses_buffer(self):
+        c = kafka.connection.KafkaConnection("192.168.33.10", 9092, pool=kafka.connection.BufferPool())
+        MockSocket.RECV = iter(struct.pack(">ii3s", 7, 1, "foo") + struct.pack(">ii2s", 6, 2, "ba"))
+        self.assertEqual(c.recv(1).tobytes(), struct.pack(">i", 1) + "foo")
+        buf = c.buffer
+        self.assertEqual(c.recv(2).tobytes(), struct.pack(">i", 2) + "ba")
+        self.assertTrue(c.buffer is buf)
+        c.close()
+        self.assertEqual(c.buffer, None)
+        self.assertTrue(c.pool.acquire(3) is buf)
+
+    def test_recv_closed(self):
+        c = kafka.connection.KafkaConnection("192.168.33.10", 9092)
+        MockSocket.RECV = iter(struct.pack(">i", 3) + "ba")
+        self.assertRaises(IOError, c.recv, 1)
+
+    def test_buffer_pool(self):
+        pool = kafka.connection.BufferPool(min_bytes=16, max_free=1)
+        self.assertEqual(pool.size_class(1), 16)
+        self.assertEqual(pool.size_class(17), 32)
+        b1, b2 = pool.acquire(20), pool.acquire(32)
+        self.assertEqual((len(b1), len(b2)), (32, 32))
+        pool.release(b1)
+        pool.release(b2) # only one free buffer per size class is kept
+        self.assertTrue(pool.acquire(30) is b1)
+        self.assertFalse(pool.acquire(30) is b2)
 
 
 
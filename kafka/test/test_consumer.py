@@ -4,10 +4,21 @@
 
 import unittest
 import logging
+import tempfile
+import shutil
+import os.path
+import json
+import time
+import sys
+import struct
 
 import kafka.connection
 import kafka.client
 import kafka.consumer
+import kafka.protocol
+import kafka.offsets
+import kafka.framing
+from kafka.test.fakebroker import FakeCluster
 
 
 class ConsumerTest(unittest.TestCase):
@@ -21,8 +32,12 @@ class ConsumerTest(unittest.TestCase):
     def test_init(self):
         consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1')        
         self.assertEqual(sorted(consumer.__dict__.keys()), 
-            ['client', 'failfast', 'group', 'hosts', 'offsets', 
-             'offsets_file_path', 'offsets_pending', 'topic', 'whence'])
+            ['broker_offsets', 'checkpoint_messages', 'checkpoint_seconds', 
+             'checkpointer', 'client', 'failfast', 'fetch_memory', 
+             'fetch_sizes', 'group', 'hosts', 'max_fetch_bytes', 
+             'max_wait_time', 'min_bytes', 'offsets', 'offsets_client', 
+             'offsets_committed_at', 'offsets_file_path', 'offsets_log', 
+             'offsets_pending', 'prefetch', 'prefetcher', 'topic', 'whence'])
 
     def test_seek(self):
         consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1')
@@ -40,6 +55,272 @@ class ConsumerTest(unittest.TestCase):
         self.assertTrue("foo" in messages)
         self.assertTrue("bar" in messages)
 
+    def test_fetch_prefetch(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1', whence=kafka.consumer.WHENCE_HEAD, prefetch=2)
+        messages = consumer.fetch()
+        self.assertTrue("foo" in messages)
+        consumer.rollback()
+        self.assertEqual(consumer.fetch(), messages)
+        consumer.__exit__(None, None, None)
+
+
+class MockConsumer(object):
+    # every fetch returns one value, the offset of partition 0
+    def _fetch(self, offsets):
+        return [offsets[0]], {0: offsets[0] + 1}
+
+
+class PrefetcherTest(unittest.TestCase):
+
+    def test_get(self):
+        prefetcher = kafka.consumer.Prefetcher(MockConsumer(), {0: 0}, 2)
+        prefetcher.start()
+        self.assertEqual(prefetcher.get({0: 0}), ([0], {0: 1}))
+        self.assertEqual(prefetcher.get({0: 1}), ([1], {0: 2}))
+        # 'rollback', batches fetched ahead are discarded
+        self.assertEqual(prefetcher.get({0: 1}), ([1], {0: 2}))
+        self.assertEqual(prefetcher.get({0: 2}), ([2], {0: 3}))
+        prefetcher.stop()
+        prefetcher.join()
+
+    def test_get_error(self):
+        prefetcher = kafka.consumer.Prefetcher(None, {0: 0}, 2)
+        prefetcher.start()
+        self.assertRaises(AttributeError, prefetcher.get, {0: 0})
+        prefetcher.join()
+        self.assertRaises(kafka.consumer.KafkaConsumerError, prefetcher.get, {0: 0})
+
+
+class MockClient(object):
+
+    # partition 0 has a single message of 'size' bytes at offset 0, the
+    # other partitions have small messages; records max_bytes requested
+    def __init__(self, hosts, topics=None, metrics=None):
+        self.topic_partitions = {'unittest1': [0, 1, 2, 3]}
+        self.size = 0
+        self.requests = []
+        self.decoded = 0
+        self.committed = {} # group -> {partition: offset}
+
+    def fetch_iter(self, requests, views=False, max_wait_time=100, min_bytes=4096):
+        self.long_poll = (max_wait_time, min_bytes)
+        self.requests.append(dict((r.partition, r.max_bytes) for r in requests))
+        for r in requests:
+            yield kafka.protocol.FetchResponse(r.topic, r.partition, 0, r.offset + 1, self._messages(r))
+
+    def _messages(self, request):
+        # decoded lazily, as with the real client
+        size = self.size if request.partition == 0 else 10
+        if size > request.max_bytes:
+            raise kafka.protocol.ConsumerFetchSizeTooSmall()
+        self.decoded += 1
+        yield kafka.protocol.OffsetAndMessage(request.offset, kafka.protocol.Message(0, 0, None, 'x' * size))
+
+    def commit_offsets(self, group, requests):
+        self.committed.setdefault(group, {}).update((r.partition, r.offset) for r in requests)
+        return [kafka.protocol.OffsetCommitResponse(r.topic, r.partition, 0) for r in requests]
+
+    def fetch_offsets(self, group, requests):
+        offsets = self.committed.get(group, {})
+        return [kafka.protocol.OffsetFetchResponse(r.topic, r.partition, offsets.get(r.partition, -1), "", 0) for r in requests]
+
+    def close(self):
+        pass
+
+
+class FetchSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+
+    def tearDown(self):
+        kafka.client.KafkaClient = self.tmp_client
+
+    def test_budget(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1', fetch_memory=2**20)
+        consumer.offsets = {0: 0, 1: 0, 2: 0, 3: 0}
+        consumer.client.size = 10
+        consumer._fetch(consumer.offsets)
+        self.assertEqual(consumer.client.requests, [{0: 2**18, 1: 2**18, 2: 2**18, 3: 2**18}])
+        # the budget is shared with the prefetched batches
+        consumer.prefetch = 1
+        self.assertEqual(consumer._fetch_sizes([0, 1, 2, 3])[1], 2**17)
+        # but a partition gets at least the minimum
+        consumer.fetch_memory = 0
+        self.assertEqual(consumer._fetch_sizes([0, 1, 2, 3])[1], kafka.consumer.FETCH_MIN_PARTITION_BYTES)
+
+    def test_grow(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1', fetch_memory=2**20)
+        consumer.client.size = 2**20
+        values, pending = consumer._fetch({0: 0, 1: 0, 2: 0, 3: 0})
+        self.assertEqual(len(values), 4)
+        self.assertEqual(pending, {0: 1, 1: 1, 2: 1, 3: 1})
+        # only partition 0 is fetched again, with max_bytes doubled
+        self.assertEqual([r.get(0) for r in consumer.client.requests], [2**18, 2**19, 2**20])
+        self.assertEqual([len(r) for r in consumer.client.requests], [4, 1, 1])
+        # and the others shrink to fit the budget
+        self.assertEqual(consumer._fetch_sizes([0, 1, 2, 3])[0], {0: 2**20, 1: 2**16, 2: 2**16, 3: 2**16})
+        # once the large messages are through, partition 0 shrinks back
+        consumer.client.size = 10
+        for _ in range(3):
+            consumer._fetch(pending)
+        self.assertEqual(consumer.fetch_sizes, {})
+
+    def test_max_fetch_bytes(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1', fetch_memory=2**18, max_fetch_bytes=2**19)
+        consumer.client.size = 2**20
+        values, pending = consumer._fetch({0: 0, 1: 0})
+        self.assertEqual(len(values), 1)
+        self.assertEqual(pending, {0: 0, 1: 1})
+        self.assertEqual(consumer.fetch_sizes, {0: 2**19})
+        consumer.failfast = True
+        self.assertRaises(kafka.protocol.ConsumerFetchSizeTooSmall, consumer._fetch, {0: 0, 1: 0})
+
+    def test_long_poll(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1', max_wait_time=500, min_bytes=1)
+        consumer._fetch({0: 0})
+        self.assertEqual(consumer.client.long_poll, (500, 1))
+        # the broker can't be asked to wait longer than the socket timeout
+        self.assertRaises(kafka.consumer.KafkaConsumerError, kafka.consumer.KafkaConsumer, hosts='192.168.33.10:9092', topic='unittest1', max_wait_time=10000)
+
+
+class IterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+
+    def tearDown(self):
+        kafka.client.KafkaClient = self.tmp_client
+
+    def test_iter(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1')
+        consumer.client.size = 10
+        messages = iter(consumer)
+        message = messages.next()
+        self.assertEqual(message, kafka.consumer.ConsumedMessage(message.partition, 0, None, 'x' * 10))
+        # messages are decoded only as they are asked for
+        self.assertEqual(consumer.client.decoded, 1)
+        self.assertEqual(consumer.offsets_pending, {0: 0, 1: 0, 2: 0, 3: 0, message.partition: 1})
+        for _ in range(3):
+            messages.next()
+        self.assertEqual(consumer.offsets_pending, {0: 1, 1: 1, 2: 1, 3: 1})
+        # the next fetch commits what was consumed
+        message = messages.next()
+        self.assertEqual(message.offset, 1)
+        self.assertEqual(consumer.offsets, {0: 1, 1: 1, 2: 1, 3: 1})
+        messages.close()
+
+    def test_iter_prefetch(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', topic='unittest1')
+        consumer.prefetcher = True
+        self.assertRaises(kafka.consumer.KafkaConsumerError, iter(consumer).next)
+
+
+class BrokerOffsetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+
+    def tearDown(self):
+        kafka.client.KafkaClient = self.tmp_client
+
+    def test_load_save(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', group='group1', topic='unittest1', broker_offsets=True)
+        consumer.client.committed['group1'] = {1: 10, 2: 20}
+        consumer.seek()
+        self.assertEqual(consumer.offsets, {0: 0, 1: 10, 2: 20, 3: 0})
+        consumer.offsets[0] = 5
+        consumer.save_offsets()
+        self.assertEqual(consumer.client.committed['group1'], {0: 5, 1: 10, 2: 20, 3: 0})
+
+    def test_commit_interval(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', group='group1', topic='unittest1', broker_offsets=True)
+        consumer.offsets_pending = {0: 1}
+        consumer.commit()
+        self.assertEqual(consumer.client.committed, {})
+        consumer.offsets_committed_at -= kafka.consumer.OFFSETS_COMMIT_INTERVAL_SECONDS + 1
+        consumer.offsets_pending = {0: 2}
+        consumer.commit()
+        self.assertEqual(consumer.client.committed, {'group1': {0: 2}})
+
+
+class FileOffsetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "offsets")
+
+    def tearDown(self):
+        kafka.client.KafkaClient = self.tmp_client
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_save(self):
+        # the json file written by earlier versions is imported
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"group1": {"unittest1": {"1": 10}}}))
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', group='group1', topic='unittest1', offsets_file_path=self.path)
+        consumer.seek()
+        self.assertEqual(consumer.offsets, {0: 0, 1: 10, 2: 0, 3: 0})
+        consumer.offsets[0] = 5
+        consumer.__exit__(None, None, None)
+        self.assertEqual(kafka.offsets.OffsetLog(self.path).get("group1", "unittest1"), {0: 5, 1: 10, 2: 0, 3: 0})
+
+    def test_checkpoint(self):
+        consumer = kafka.consumer.KafkaConsumer(hosts='192.168.33.10:9092', group='group1', topic='unittest1', offsets_file_path=self.path, checkpoint_seconds=60, checkpoint_messages=2)
+        consumer.client.size = 10
+        consumer.fetch()
+        self.assertTrue(consumer.checkpointer.is_alive())
+        # the second fetch commits the first one's messages (one per partition)
+        consumer.fetch()
+        log = kafka.offsets.OffsetLog(self.path)
+        for _ in range(500):
+            if log.get("group1", "unittest1"): break
+            time.sleep(0.01)
+        self.assertEqual(log.get("group1", "unittest1"), {0: 1, 1: 1, 2: 1, 3: 1})
+        consumer.checkpointer.stop()
+        consumer.checkpointer.join()
+
+
+class MainTest(unittest.TestCase):
+
+    # the cli, against a fake broker; it runs until interrupted, so the
+    # first time it backs off (once the topic is drained) it is stopped
+
+    class Interrupted(object):
+        time = staticmethod(time.time)
+        def sleep(self, seconds):
+            raise KeyboardInterrupt()
+
+    def setUp(self):
+        self.cluster = FakeCluster()
+        self.cluster.create_topic("unittest1", partitions=1)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tmp_argv = sys.argv
+        kafka.consumer.time = self.Interrupted()
+
+    def tearDown(self):
+        kafka.consumer.time = time
+        sys.argv = self.tmp_argv
+        shutil.rmtree(self.tmp_dir)
+        self.cluster.close()
+
+    def test_null(self):
+        # null messages are written out, with length framing, as length -1
+        messages = [kafka.protocol.Message(0, 0, None, "foo"), kafka.protocol.Message(0, 0, None, None)]
+        client = kafka.client.KafkaClient(self.cluster.hosts)
+        client.send("unittest1", 0, messages)
+        client.close()
+        path = os.path.join(self.tmp_dir, "output")
+        sys.argv = ["kafka-consumer", self.cluster.hosts, "unittest1", "--head", "--framing", "length", "--output", path]
+        kafka.consumer.main()
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), struct.pack('>i', 3) + "foo" + struct.pack('>i', -1))
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import time
+
+import kafka.client
+import kafka.protocol
+import kafka.producer
+import kafka.consumer
+import kafka.test.fakebroker
+from kafka.test.fakebroker import FakeCluster
+
+
+class FakeBrokerTest(unittest.TestCase):
+
+    # the real client, producer, and consumer, against the fake brokers
+
+    def setUp(self):
+        self.cluster = FakeCluster(brokers=2)
+        self.cluster.create_topic("unittest1", partitions=4)
+        self.client = kafka.client.KafkaClient(self.cluster.hosts)
+
+    def tearDown(self):
+        self.client.close()
+        self.cluster.close()
+
+    def test_metadata(self):
+        self.assertEqual(sorted(self.client.brokers), [0, 1])
+        self.assertEqual(sorted(self.client.topic_partitions["unittest1"]), [0, 1, 2, 3])
+        self.assertEqual(self.client.get_topic_leader("unittest1", 3).nodeId, 1)
+        # topics are created on first use
+        self.client.get_metadata(["unittest2"])
+        self.assertEqual(sorted(self.client.topic_partitions["unittest2"]), [0, 1])
+
+    def test_send_fetch(self):
+        for codec in (kafka.protocol.CODEC_NONE, kafka.protocol.CODEC_GZIP):
+            messages = [kafka.protocol.Message(0, 0, None, "foo"), kafka.protocol.Message(0, 0, "k", "bar")]
+            requests = [kafka.protocol.ProduceRequest("unittest1", p, messages) for p in range(4)]
+            responses = self.client.send_multi(requests, codec=codec)
+            self.assertEqual(sorted((r.partition, r.error) for r in responses), [(p, 0) for p in range(4)])
+        self.assertEqual(self.client.get_offset("unittest1", 2).offsets, (4,))
+        self.assertEqual([m.value for m in self.cluster.messages("unittest1", 2)], ["foo", "bar", "foo", "bar"])
+        fetched = self.client.fetch("unittest1", 2, 1)
+        self.assertEqual([(m.offset, m.message.key, m.message.value) for m in fetched], [(1, "k", "bar"), (2, None, "foo"), (3, "k", "bar")])
+
+    def test_partial(self):
+        self.client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "x" * 100)] * 2)
+        request = kafka.protocol.FetchRequest("unittest1", 0, 0, 150)
+        self.assertEqual(len(self.client.fetch_multi([request])[("unittest1", 0)]), 1)
+        too_small = set()
+        request = kafka.protocol.FetchRequest("unittest1", 0, 0, 50)
+        self.client.fetch_multi([request], too_small=too_small)
+        self.assertEqual(too_small, set([("unittest1", 0)]))
+
+    def test_out_of_range(self):
+        self.client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        responses = list(self.client.fetch_iter([kafka.protocol.FetchRequest("unittest1", 0, 2, 1024)]))
+        self.assertEqual([(r.error, r.highwaterMark) for r in responses], [(kafka.protocol.ERROR_OFFSET_OUT_OF_RANGE, 1)])
+        # at the end of the log is fine
+        self.assertEqual(self.client.fetch("unittest1", 0, 1), [])
+
+    def test_requests_kept(self):
+        for i in range(kafka.test.fakebroker.REQUESTS_KEPT + 10):
+            self.client.get_offset("unittest1", 0)
+        self.assertEqual(len(self.cluster.requests), kafka.test.fakebroker.REQUESTS_KEPT)
+        self.assertEqual(self.cluster.requests[-1], (0, kafka.protocol.OFFSET_KEY))
+
+    def test_long_poll(self):
+        request = kafka.protocol.FetchRequest("unittest1", 0, 0, 1024)
+        t1 = time.time()
+        self.assertEqual(self.client.fetch_multi([request], max_wait_time=200, min_bytes=1)[("unittest1", 0)], [])
+        self.assertTrue(time.time() - t1 >= 0.2)
+
+    def test_not_leader(self):
+        # the client finds out about the move on the next metadata refresh
+        self.cluster.move_leader("unittest1", 0, 1)
+        response = self.client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(response.error, kafka.protocol.ERROR_NOT_LEADER_FOR_PARTITION)
+        self.assertEqual(self.client.get_topic_leader("unittest1", 0).nodeId, 1)
+        response = self.client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(response.error, 0)
+
+    def test_inject(self):
+        self.cluster.inject(api_key=kafka.protocol.PRODUCE_KEY, error=kafka.protocol.ERROR_LEADER_NOT_AVAILABLE)
+        response = self.client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(response.error, kafka.protocol.ERROR_LEADER_NOT_AVAILABLE)
+        self.cluster.inject(api_key=kafka.protocol.OFFSET_KEY, disconnect=True)
+        self.assertRaises(kafka.protocol.BrokerResponseError, self.client.get_offset, "unittest1", 0)
+        # the connection gets reopened
+        self.assertEqual(self.client.get_offset("unittest1", 0).offsets, (0,))
+
+    def test_latency(self):
+        self.cluster.latency = 0.1
+        t1 = time.time()
+        self.client.get_offset("unittest1", 0)
+        self.assertTrue(time.time() - t1 >= 0.1)
+
+    def test_stop(self):
+        self.cluster.brokers[1].stop()
+        self.assertRaises(kafka.protocol.BrokerResponseError, self.client.get_offset, "unittest1", 1)
+        self.cluster.brokers[1].start()
+        self.assertEqual(self.client.get_offset("unittest1", 1).offsets, (0,))
+
+    def test_producer_consumer(self):
+        with kafka.producer.KafkaProducer(hosts=self.cluster.hosts, topic="unittest1") as producer:
+            producer.send(["m%i" % i for i in range(100)])
+        consumer = kafka.consumer.KafkaConsumer(hosts=self.cluster.hosts, group="g1", topic="unittest1", broker_offsets=True)
+        with consumer:
+            values = consumer.fetch()
+            consumer.commit()
+            consumer.save_offsets()
+        self.assertEqual(sorted(values), sorted("m%i" % i for i in range(100)))
+        self.assertEqual(sorted((tp.partition, o) for (g, tp), (o, _) in self.cluster.offsets.items()), [(p, 25) for p in range(4)])
+        # a new consumer in the group picks up where the last one left off
+        with kafka.consumer.KafkaConsumer(hosts=self.cluster.hosts, group="g1", topic="unittest1", broker_offsets=True) as consumer:
+            self.assertEqual(consumer.fetch(), [])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
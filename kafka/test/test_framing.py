@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import tempfile
+import shutil
+import os.path
+import errno
+import struct
+
+import kafka.framing
+
+
+class BrokenPipe(object):
+    # a file whose reader went away
+    def write(self, data):
+        raise IOError(errno.EPIPE, "Broken pipe")
+    def close(self):
+        raise IOError(errno.EPIPE, "Broken pipe")
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_encode_batch(self):
+        self.assertEqual(kafka.framing.encode_batch(["foo", "bar"]), "foo\nbar\n")
+        self.assertEqual(kafka.framing.encode_batch(["foo", None], framing='nul'), "foo\0\0")
+        self.assertEqual(kafka.framing.encode_batch([], framing='nul'), "")
+        self.assertEqual(kafka.framing.encode_batch(["foo", "", None], framing='length'), struct.pack('>i3si', 3, "foo", 0) + struct.pack('>i', -1))
+
+
+class OutputSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "output")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write(self):
+        sink = kafka.framing.OutputSink(self.path)
+        self.assertEqual(sink.write(["foo", "bar"]), 8)
+        self.assertEqual(sink.write([]), 0)
+        sink.write(["baz"])
+        # each batch is flushed as it is written
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "foo\nbar\nbaz\n")
+        sink.close()
+
+    def test_reopen(self):
+        sink = kafka.framing.OutputSink(self.path)
+        sink.fh = BrokenPipe()
+        sink.write(["foo"])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "foo\n")
+        sink.fh = BrokenPipe()
+        sink.write(["bar"])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "foo\nbar\n")
+        sink.close()
+
+    def test_retries(self):
+        sink = kafka.framing.OutputSink(os.path.join(self.tmp_dir, "missing", "output"))
+        self.assertRaises(IOError, sink.write, ["foo"])
+
+    def test_framing(self):
+        self.assertRaises(ValueError, kafka.framing.OutputSink, self.path, framing='foo')
+
+
+class ReadBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "input")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_file(self, data, **kwargs):
+        with open(self.path, "wb") as f:
+            f.write(data)
+        with open(self.path, "rb") as f:
+            return list(kafka.framing.read_batches(f, **kwargs))
+
+    def read_pipe(self, data, **kwargs):
+        r, w = os.pipe()
+        os.write(w, data)
+        os.close(w)
+        with os.fdopen(r, "rb") as f:
+            return list(kafka.framing.read_batches(f, **kwargs))
+
+    def test_split(self):
+        self.assertEqual(kafka.framing.split_delimited("foo\nbar\nba", "\n"), (["foo", "bar"], "ba"))
+        data = kafka.framing.encode_batch(["foo", None, "bar"], framing='length')
+        self.assertEqual(kafka.framing.split_length(data[:-1]), (["foo", None], data[-7:-1]))
+
+    def test_file(self):
+        self.assertEqual(self.read_file("foo\nbar\n\nbaz"), [["foo", "bar", "", "baz"]])
+        self.assertEqual(self.read_file(""), [])
+        # cut on the last delimiter before batch_bytes, or after it for a
+        # message larger than that
+        self.assertEqual(self.read_file("foo\0bar\0bazbazbaz\0x\0", framing='nul', batch_bytes=9), [["foo", "bar"], ["bazbazbaz"], ["x"]])
+
+    def test_pipe(self):
+        self.assertEqual(self.read_pipe("foo\nbar\n\nbaz"), [["foo", "bar", "", "baz"]])
+        self.assertEqual(self.read_pipe("foo\nbar\n", batch_bytes=1), [["foo", "bar"]])
+        data = kafka.framing.encode_batch(["foo", "bar\n"], framing='length')
+        self.assertEqual(self.read_pipe(data, framing='length'), [["foo", "bar\n"]])
+        # a partial message at the end is discarded
+        self.assertEqual(self.read_pipe(data[:-1], framing='length'), [["foo"]])
+
+    def test_pipe_chunks(self):
+        # messages spanning several chunks
+        chunk_bytes = kafka.framing.INPUT_CHUNK_BYTES
+        kafka.framing.INPUT_CHUNK_BYTES = 4
+        try:
+            values = ["foo", "x" * 30, "", "bar\nbaz", "y" * 9]
+            for framing in ('newline', 'nul'):
+                data = kafka.framing.encode_batch(values[:3] + values[4:], framing=framing)
+                self.assertEqual(sum(self.read_pipe(data, framing=framing), []), values[:3] + values[4:])
+            data = kafka.framing.encode_batch(values + [None], framing='length')
+            self.assertEqual(sum(self.read_pipe(data, framing='length'), []), values + [None])
+            self.assertEqual(sum(self.read_pipe(data[:-5], framing='length'), []), values[:-1])
+            self.assertEqual(sum(self.read_pipe("foo\nbarbazbar", framing='newline'), []), ["foo", "barbazbar"])
+        finally:
+            kafka.framing.INPUT_CHUNK_BYTES = chunk_bytes
+
+    def test_pipe_slow(self):
+        # a batch goes out when nothing more comes in for batch_seconds
+        r, w = os.pipe()
+        with os.fdopen(r, "rb") as f:
+            batches = kafka.framing.read_batches(f, batch_seconds=0.01)
+            os.write(w, "foo\n")
+            self.assertEqual(batches.next(), ["foo"])
+            os.write(w, "bar\n")
+            os.close(w)
+            self.assertEqual(list(batches), [["bar"]])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
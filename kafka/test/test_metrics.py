@@ -0,0 +1,163 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import tempfile
+import shutil
+import os.path
+import socket
+import json
+
+import kafka.metrics
+import kafka.client
+import kafka.consumer
+import kafka.protocol
+from kafka.test.fakebroker import FakeCluster
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentile(self):
+        h = kafka.metrics.Histogram(min_value=0.001)
+        self.assertEqual(h.percentile(0.5), None)
+        for i in range(98):
+            h.add(0.0015) # bucket up to 0.002
+        h.add(0.1) # up to 0.128
+        h.add(0.3)
+        self.assertEqual(h.percentile(0.5), 0.002)
+        self.assertEqual(h.percentile(0.99), 0.128)
+        self.assertEqual(h.percentile(0.999), 0.3) # never more than the max
+        summary = h.summary()
+        self.assertEqual((summary['count'], summary['max']), (100, 0.3))
+        # out of range values go in the first and last buckets
+        h.add(0)
+        h.add(10**6)
+        self.assertEqual((h.counts[0], h.counts[-1]), (1, 1))
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = kafka.metrics.MetricsRegistry()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_registry(self):
+        self.registry.incr('requests', broker='host:9092', api='fetch')
+        self.registry.incr('requests', 2, api='fetch', broker='host:9092')
+        self.registry.gauge('lag', 10, topic='topic1', partition=0)
+        self.registry.observe('wait_seconds', 0.01, broker='host:9092', api='fetch')
+        self.assertEqual(self.registry.get('requests', broker='host:9092', api='fetch'), 3)
+        self.assertEqual(self.registry.get('lag', topic='topic1', partition=1), None)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['counters'], {'requests{api=fetch,broker=host:9092}': 3})
+        self.assertEqual(snapshot['gauges'], {'lag{partition=0,topic=topic1}': 10})
+        self.assertEqual(snapshot['histograms']['wait_seconds{api=fetch,broker=host:9092}']['count'], 1)
+        self.registry.reset()
+        self.assertEqual(self.registry.snapshot()['counters'], {})
+
+    def test_file_sink(self):
+        path = os.path.join(self.tmp_dir, "metrics")
+        reporter = kafka.metrics.MetricsReporter([kafka.metrics.FileSink(path)], registry=self.registry, seconds=60)
+        reporter.start()
+        self.registry.incr('requests', api='fetch')
+        # reported once more when stopped
+        reporter.stop()
+        reporter.join()
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[-1]['counters'], {'requests{api=fetch}': 1})
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        sink = kafka.metrics.StatsdSink(port=server.getsockname()[1])
+        self.registry.incr('requests', 2, broker='10.0.0.1:9092', api='fetch')
+        self.registry.gauge('lag', 10, topic='topic1', partition=0)
+        self.registry.observe('wait_seconds', 0.5, api='fetch')
+        sink.report(self.registry)
+        lines = server.recv(65536).split("\n")
+        self.assertEqual(sorted(lines), [
+            "kafka.lag.partition_0.topic_topic1:10|g",
+            "kafka.requests.api_fetch.broker_10_0_0_1_9092:2|c",
+            "kafka.wait_seconds.api_fetch.max:500.000|g",
+            "kafka.wait_seconds.api_fetch.p50:500.000|g",
+            "kafka.wait_seconds.api_fetch.p999:500.000|g",
+            "kafka.wait_seconds.api_fetch.p99:500.000|g",
+        ])
+        # counters go out as increments
+        self.registry.incr('requests', 1, broker='10.0.0.1:9092', api='fetch')
+        sink.report(self.registry)
+        self.assertTrue("kafka.requests.api_fetch.broker_10_0_0_1_9092:1|c" in server.recv(65536).split("\n"))
+        sink.close()
+        server.close()
+
+
+class ClientMetricsTest(unittest.TestCase):
+
+    # against the fake broker
+
+    def setUp(self):
+        self.cluster = FakeCluster(brokers=2)
+        self.cluster.create_topic("unittest1", partitions=2)
+        self.registry = kafka.metrics.MetricsRegistry()
+
+    def tearDown(self):
+        self.cluster.close()
+
+    def test_client(self):
+        client = kafka.client.KafkaClient(self.cluster.hosts, metrics=self.registry)
+        client.send("unittest1", 1, [kafka.protocol.Message(0, 0, None, "foo")] * 3)
+        client.close()
+        broker = "127.0.0.1:%i" % self.cluster.brokers[1].port
+        self.assertEqual(self.registry.get('requests', broker=broker, api='produce'), 1)
+        self.assertEqual(self.registry.get('wait_seconds', broker=broker, api='produce').count, 1)
+        self.assertTrue(self.registry.get('bytes_out', broker=broker, api='produce') > 9)
+        self.assertTrue(self.registry.get('bytes_in', broker=broker, api='produce') > 0)
+        self.assertEqual(self.registry.get('messages_out', topic='unittest1', partition=1), 3)
+        self.assertEqual(self.registry.get('message_bytes_out', topic='unittest1', partition=1), 9)
+
+    def test_errors(self):
+        client = kafka.client.KafkaClient(self.cluster.hosts, metrics=self.registry)
+        self.cluster.inject(api_key=kafka.protocol.PRODUCE_KEY, error=kafka.protocol.ERROR_LEADER_NOT_AVAILABLE)
+        client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(self.registry.get('partition_errors', topic='unittest1', partition=0, api='produce', error=kafka.protocol.ERROR_LEADER_NOT_AVAILABLE), 1)
+        # only acked messages count as out
+        self.assertEqual(self.registry.get('messages_out', topic='unittest1', partition=0), None)
+        self.cluster.inject(api_key=kafka.protocol.PRODUCE_KEY, disconnect=True)
+        self.assertRaises(IOError, client.send, "unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(self.registry.get('messages_out', topic='unittest1', partition=0), None)
+        client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])
+        self.assertEqual(self.registry.get('messages_out', topic='unittest1', partition=0), 1)
+        self.cluster.inject(api_key=kafka.protocol.OFFSET_KEY, disconnect=True)
+        self.assertRaises(kafka.protocol.BrokerResponseError, client.get_offset, "unittest1", 0)
+        broker = "127.0.0.1:%i" % self.cluster.brokers[0].port
+        self.assertEqual(self.registry.get('errors', broker=broker, api='offset'), 1)
+        client.close()
+
+    def test_lag(self):
+        client = kafka.client.KafkaClient(self.cluster.hosts)
+        client.send("unittest1", 0, [kafka.protocol.Message(0, 0, None, "x" * 20000)] * 10)
+        client.close()
+        # max_bytes for the partition is 64KB, so a fetch gets 3 messages
+        consumer = kafka.consumer.KafkaConsumer(hosts=self.cluster.hosts, topic="unittest1", max_fetch_bytes=2**16, metrics=self.registry)
+        with consumer:
+            values, offsets = consumer._fetch({0: 0})
+            self.assertEqual((len(values), offsets), (3, {0: 3}))
+            self.assertEqual(self.registry.get('lag', topic='unittest1', partition=0), 7)
+            consumer._fetch({0: 9})
+        self.assertEqual(self.registry.get('highwater', topic='unittest1', partition=0), 10)
+        self.assertEqual(self.registry.get('lag', topic='unittest1', partition=0), 0)
+        self.assertEqual(self.registry.get('messages_in', topic='unittest1', partition=0), 4)
+        self.assertEqual(self.registry.get('message_bytes_in', topic='unittest1', partition=0), 80000)
+        self.assertEqual(self.registry.get('fetch_seconds', topic='unittest1').count, 2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import tempfile
+import shutil
+import os.path
+import json
+import threading
+
+import kafka.offsets
+
+
+class OffsetLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "offsets")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_get(self):
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertEqual(log.get("group1", "topic1"), {})
+        self.assertEqual(log.save("group1", "topic1", {0: 10, 1: 20}), 2)
+        self.assertEqual(log.save("group2", "topic1", {0: 5}), 1)
+        log.close()
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertEqual(log.get("group1", "topic1"), {0: 10, 1: 20})
+        self.assertEqual(log.get("group2", "topic1"), {0: 5})
+
+    def test_incremental(self):
+        log = kafka.offsets.OffsetLog(self.path)
+        log.save("group1", "topic1", {0: 10, 1: 20, 2: 30})
+        size = os.path.getsize(self.path)
+        # nothing changed, nothing written
+        self.assertEqual(log.save("group1", "topic1", {0: 10, 1: 20, 2: 30}), 0)
+        self.assertEqual(os.path.getsize(self.path), size)
+        # only the changed partition is appended
+        self.assertEqual(log.save("group1", "topic1", {0: 10, 1: 21, 2: 30}), 1)
+        self.assertEqual(os.path.getsize(self.path) - size, len(kafka.offsets.encode_record("group1", "topic1", {1: 21})))
+        self.assertEqual(kafka.offsets.OffsetLog(self.path).get("group1", "topic1"), {0: 10, 1: 21, 2: 30})
+
+    def test_truncated(self):
+        log = kafka.offsets.OffsetLog(self.path)
+        log.save("group1", "topic1", {0: 10})
+        log.save("group1", "topic1", {0: 11})
+        log.close()
+        # a crash in the middle of an append
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(size - 3)
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertEqual(log.get("group1", "topic1"), {0: 10})
+        # the partial record is dropped before the next append
+        log.save("group1", "topic1", {0: 12})
+        self.assertEqual(kafka.offsets.OffsetLog(self.path).get("group1", "topic1"), {0: 12})
+
+    def test_checksum(self):
+        log = kafka.offsets.OffsetLog(self.path)
+        log.save("group1", "topic1", {0: 10})
+        log.save("group1", "topic1", {0: 11})
+        log.close()
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write("\xff")
+        self.assertEqual(kafka.offsets.OffsetLog(self.path).get("group1", "topic1"), {0: 10})
+
+    def test_import_json(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"group1": {"topic1": {"0": 10, "1": 20}}}))
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertEqual(log.get("group1", "topic1"), {0: 10, 1: 20})
+        with open(self.path, "rb") as f:
+            self.assertTrue(f.read().startswith(kafka.offsets.MAGIC))
+
+    def test_bad_file(self):
+        with open(self.path, "w") as f:
+            f.write("foo")
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertRaises(kafka.offsets.OffsetLogError, log.get, "group1", "topic1")
+
+    def test_compact(self):
+        log = kafka.offsets.OffsetLog(self.path, compact_bytes=1024)
+        for n in range(100):
+            log.save("group1", "topic1", {0: n, 1: n})
+        # one record, after the last compaction
+        self.assertTrue(os.path.getsize(self.path) < 1024)
+        self.assertEqual(kafka.offsets.OffsetLog(self.path).get("group1", "topic1"), {0: 99, 1: 99})
+        self.assertEqual(os.listdir(self.tmp_dir), ["offsets"])
+
+    def test_shared(self):
+        # two processes (here two logs) appending to the same file
+        log1 = kafka.offsets.OffsetLog(self.path)
+        log2 = kafka.offsets.OffsetLog(self.path)
+        log1.save("group1", "topic1", {0: 10})
+        log2.save("group2", "topic1", {0: 20})
+        log1.save("group1", "topic1", {0: 11})
+        # log2 picks up the new file after log1 compacts
+        log1.compact()
+        log2.save("group2", "topic1", {0: 21})
+        self.assertEqual(log2.get("group1", "topic1"), {0: 11})
+        log = kafka.offsets.OffsetLog(self.path)
+        self.assertEqual(log.get("group1", "topic1"), {0: 11})
+        self.assertEqual(log.get("group2", "topic1"), {0: 21})
+
+
+class CheckpointerTest(unittest.TestCase):
+
+    def test_messages(self):
+        saved = threading.Event()
+        checkpointer = kafka.offsets.Checkpointer(saved.set, seconds=60, messages=10)
+        checkpointer.start()
+        checkpointer.committed(5)
+        self.assertFalse(saved.wait(0.05))
+        checkpointer.committed(5)
+        self.assertTrue(saved.wait(5))
+        checkpointer.stop()
+        checkpointer.join()
+
+    def test_seconds(self):
+        saved = threading.Event()
+        checkpointer = kafka.offsets.Checkpointer(saved.set, seconds=0.01, messages=10)
+        checkpointer.start()
+        self.assertTrue(saved.wait(5))
+        checkpointer.stop()
+        checkpointer.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,37 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+
+import kafka.partitioner
+
+
+class PartitionerTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        p = kafka.partitioner.RoundRobinPartitioner([0, 1, 2])
+        self.assertEqual([p.partition(None, "foo") for _ in range(5)], [0, 1, 2, 0, 1])
+
+    def test_hash(self):
+        p = kafka.partitioner.HashPartitioner([0, 1, 2, 3])
+        partitions = [p.partition("key%i" % (i % 10), "foo") for i in range(100)]
+        # same key, same partition
+        for i in range(10):
+            self.assertEqual(len(set(partitions[i::10])), 1)
+        self.assertTrue(len(set(partitions)) > 1)
+        # no key, round robin
+        self.assertEqual([p.partition(None, "foo") for _ in range(5)], [0, 1, 2, 3, 0])
+
+    def test_sticky(self):
+        p = kafka.partitioner.StickyPartitioner([0, 1, 2], batch_bytes=6)
+        self.assertEqual([p.partition(None, "foo") for _ in range(7)], [0, 0, 1, 1, 2, 2, 0])
+        # a null message counts as empty
+        p = kafka.partitioner.StickyPartitioner([0, 1], batch_bytes=3)
+        self.assertEqual([p.partition(None, v) for v in (None, "foo", None, None)], [0, 0, 1, 1])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
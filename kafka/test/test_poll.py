@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import socket
+import struct
+import threading
+
+import kafka.protocol
+import kafka.metrics
+import kafka.poll
+import kafka.client
+from kafka.test.fakebroker import FakeCluster
+
+
+def read_requests(sock, count):
+    data = ""
+    requests = []
+    while len(requests) < count:
+        data += sock.recv(4096)
+        while len(data) >= 4 and len(data) >= 4 + struct.unpack('>i', data[:4])[0]:
+            size = 4 + struct.unpack('>i', data[:4])[0]
+            requests.append(data[:size])
+            data = data[size:]
+    return requests
+
+
+class ReverseServer(threading.Thread):
+
+    # accepts one connection, reads 'count' requests, and then answers
+    # them in reverse order, each response being just the correlation id
+    # and the request's client id, sent a byte at a time
+
+    def __init__(self, count):
+        super(ReverseServer, self).__init__()
+        self.daemon = True
+        self.count = count
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        conn, _ = self.sock.accept()
+        requests = read_requests(conn, self.count)
+        for request in reversed(requests):
+            (_, _, _, correlation_id), cur = kafka.protocol.relative_unpack('>ihhi', request, 0)
+            client_id, cur = kafka.protocol.read_short_string(request, cur)
+            response = kafka.protocol.write_int_string(struct.pack('>i', correlation_id) + client_id)
+            for c in response:
+                conn.sendall(c)
+        conn.close()
+        self.sock.close()
+
+
+class PollTest(unittest.TestCase):
+
+    def test_submit(self):
+        server = ReverseServer(3)
+        server.start()
+        broker = kafka.protocol.BrokerMetadata(0, "127.0.0.1", server.port)
+        poller = kafka.poll.KafkaPoller(None)
+        responses = []
+        for request_id in range(3):
+            request = kafka.protocol.encode_metadata_request("client%i" % request_id, request_id)
+            poller.submit(request_id, request, broker, lambda r: responses.append(r.tobytes()))
+        self.assertEqual(poller.run(), 3)
+        self.assertEqual(responses, [struct.pack('>i', i) + "client%i" % i for i in (2, 1, 0)])
+        poller.close()
+
+    def test_connection_refused(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        broker = kafka.protocol.BrokerMetadata(0, "127.0.0.1", sock.getsockname()[1])
+        sock.close()
+        poller = kafka.poll.KafkaPoller(None)
+        errors = []
+        poller.submit(1, kafka.protocol.encode_metadata_request("client", 1), broker, lambda r: None, errors.append)
+        self.assertEqual(poller.run(), 0)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], IOError))
+        self.assertEqual(poller.requests, {})
+        conn = poller.conns.values()[0]
+        self.assertEqual(conn.metrics.get('errors', broker=conn.broker, api='metadata'), 1)
+
+    def test_metrics(self):
+        server = ReverseServer(2)
+        server.start()
+        broker = kafka.protocol.BrokerMetadata(0, "127.0.0.1", server.port)
+        metrics = kafka.metrics.MetricsRegistry()
+        conn = kafka.poll.PollingConnection("127.0.0.1", server.port, metrics=metrics)
+        poller = kafka.poll.KafkaPoller(None)
+        poller.conns[("127.0.0.1", server.port)] = conn
+        for request_id in range(2):
+            poller.submit(request_id, kafka.protocol.encode_metadata_request("client", request_id), broker, lambda r: None)
+        self.assertEqual(poller.run(), 2)
+        tags = {'broker': "127.0.0.1:%i" % server.port, 'api': 'metadata'}
+        self.assertEqual(metrics.get('requests', **tags), 2)
+        self.assertEqual(metrics.get('bytes_out', **tags), 2 * len(kafka.protocol.encode_metadata_request("client", 0)))
+        self.assertEqual(metrics.get('bytes_in', **tags), 2 * (4 + 4 + len("client")))
+        self.assertEqual(metrics.get('wait_seconds', **tags).count, 2)
+        self.assertEqual(conn.sent_at, {})
+        poller.close()
+
+
+class MetadataTest(unittest.TestCase):
+
+    # against the fake broker, the poller invalidates the client's
+    # metadata for a topic on leader errors, and on socket errors
+
+    def setUp(self):
+        self.cluster = FakeCluster(brokers=2)
+        self.cluster.create_topic("unittest1", partitions=2)
+        self.client = kafka.client.KafkaClient(self.cluster.hosts)
+        self.poller = kafka.poll.KafkaPoller(self.client)
+
+    def tearDown(self):
+        self.poller.close()
+        self.client.close()
+        self.cluster.close()
+
+    def test_not_leader(self):
+        self.cluster.move_leader("unittest1", 0, 1)
+        responses = []
+        self.poller.send([kafka.protocol.ProduceRequest("unittest1", 0, [kafka.protocol.Message(0, 0, None, "foo")])], responses.extend)
+        self.poller.run()
+        self.assertEqual([r.error for r in responses], [kafka.protocol.ERROR_NOT_LEADER_FOR_PARTITION])
+        self.assertEqual(self.client.topics_refreshed["unittest1"], 0)
+        # the next request goes to the new leader
+        self.assertEqual(self.client.get_topic_leader("unittest1", 0).nodeId, 1)
+
+    def test_socket_error(self):
+        self.cluster.inject(api_key=kafka.protocol.FETCH_KEY, disconnect=True)
+        errors = []
+        self.poller.fetch([kafka.protocol.FetchRequest("unittest1", 0, 0, 1024)], lambda r: None, errors.append)
+        self.poller.run()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.client.topics_refreshed["unittest1"], 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -4,10 +4,12 @@
 
 import unittest
 import logging
+import threading
 
 import kafka.connection
 import kafka.client
 import kafka.producer
+import kafka.partitioner
 
 
 class ProducerTest(unittest.TestCase):
@@ -22,6 +24,110 @@ class ProducerTest(unittest.TestCase):
         # this tests if messages are partitioned appropriately
         self.assertEqual(partitioned, [[kafka.protocol.Message(magic=0, attributes=0, key=None, value='5')], [kafka.protocol.Message(magic=0, attributes=0, key=None, value='6')], [kafka.protocol.Message(magic=0, attributes=0, key=None, value='3'), kafka.protocol.Message(magic=0, attributes=0, key=None, value='7')], [kafka.protocol.Message(magic=0, attributes=0, key=None, value='4')]])
 
+    def test_split_keys(self):
+        keys, values = kafka.producer.split_keys(["k1\tv1", "v2", "k3\tv3\tv3"], "\t")
+        self.assertEqual(keys, ["k1", None, "k3"])
+        self.assertEqual(values, ["v1", "v2", "v3\tv3"])
+        # null messages, with length framing, are left alone
+        self.assertEqual(kafka.producer.split_keys(["k1\tv1", None], "\t"), (["k1", None], ["v1", None]))
+
+
+class MockClient(object):
+
+    # records the requests, acks every message; offsets of the messages
+    # in each partition start at 100 * partition
+    def __init__(self, hosts, topics=None):
+        self.topic_partitions = {'unittest1': [0, 1, 2, 3]}
+        self.offsets = dict((p, 100 * p) for p in self.topic_partitions['unittest1'])
+        self.requests = []
+        self.error = None
+        self.lock = threading.Lock()
+
+    def send_multi(self, requests, codec=0):
+        with self.lock:
+            if self.error:
+                raise self.error
+            self.requests.append(requests)
+            responses = []
+            for request in requests:
+                responses.append(kafka.protocol.ProduceResponse(request.topic, request.partition, 0, self.offsets[request.partition]))
+                self.offsets[request.partition] += len(request.messages)
+            return responses
+
+    def close(self):
+        pass
+
+
+class AsyncProducerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+
+    def tearDown(self):
+        kafka.client.KafkaClient = self.tmp_client
+
+    def test_send(self):
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', linger_seconds=60) as producer:
+            futures = producer.send(['1', '2', '3', '4', '5'])
+            self.assertFalse(any(f.done() for f in futures))
+            producer.flush()
+            self.assertTrue(all(f.done() for f in futures))
+            # all the partitions went out in a single call
+            self.assertEqual(len(producer.client.requests), 1)
+            self.assertEqual([(f.result().partition, f.result().offset) for f in futures], [(0, 0), (1, 100), (2, 200), (3, 300), (0, 1)])
+
+    def test_batch_bytes(self):
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', batch_bytes=2, linger_seconds=60) as producer:
+            futures = producer.send(['1', '2', '3', '4', '5'])
+            # only partition 0 has a full batch
+            self.assertEqual(futures[0].result(timeout=5).offset, 0)
+            self.assertEqual(futures[4].result(timeout=5).offset, 1)
+            self.assertFalse(futures[1].done())
+
+    def test_linger(self):
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', linger_seconds=0.01) as producer:
+            futures = producer.send(['1', '2'])
+            self.assertEqual([f.result(timeout=5).offset for f in futures], [0, 100])
+
+    def test_keys(self):
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', partitioner=kafka.partitioner.HashPartitioner) as producer:
+            futures = producer.send(['1', '2', '3'], keys=['a', 'b', 'a'])
+            producer.flush()
+            self.assertEqual(futures[0].result().partition, futures[2].result().partition)
+            messages = [m for requests in producer.client.requests for r in requests for m in r.messages]
+            self.assertEqual(sorted((m.key, m.value) for m in messages), [('a', '1'), ('a', '3'), ('b', '2')])
+
+    def test_error(self):
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1') as producer:
+            producer.client.error = IOError("broker went away")
+            futures = producer.send(['1', '2'])
+            self.assertRaises(IOError, futures[0].result, 5)
+            self.assertRaises(IOError, futures[1].result, 5)
+
+    def test_null(self):
+        # null messages (with length framing) go out as such, on both paths
+        producer = kafka.producer.KafkaProducer(hosts='192.168.33.10:9092', topic='unittest1', partitioner=kafka.partitioner.StickyPartitioner)
+        partitioned, responses = producer.send([None, 'foo'])
+        self.assertEqual([m.value for m in partitioned[0]], [None, 'foo'])
+        with kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', linger_seconds=60) as producer:
+            futures = producer.send([None, 'foo', None])
+            self.assertEqual(producer.buffered_b, 3)
+            self.assertEqual(sorted(a.size_b for a in producer.accumulators.values()), [0, 0, 3])
+            producer.flush()
+            self.assertEqual([f.result().offset for f in futures], [0, 100, 200])
+            self.assertEqual(producer.buffered_b, 0)
+            messages = [m for requests in producer.client.requests for r in requests for m in r.messages]
+            self.assertEqual(sorted(m.value for m in messages), [None, None, 'foo'])
+
+    def test_close(self):
+        producer = kafka.producer.KafkaAsyncProducer(hosts='192.168.33.10:9092', topic='unittest1', linger_seconds=60)
+        futures = producer.send(['1'])
+        producer.close()
+        self.assertEqual(futures[0].result(timeout=0).offset, 0)
+        self.assertRaises(kafka.producer.KafkaProducerError, producer.send, ['2'])
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
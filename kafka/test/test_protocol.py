@@ -0,0 +1,243 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import struct
+
+import kafka.protocol
+import kafka.codec
+
+
+def encode_fetch_response(correlation_id, responses):
+    # responses: {topic: {partition: (error, highwater_mark, [Message, ...])}}
+    data = struct.pack('>ii', correlation_id, len(responses))
+    for topic, partitions in responses.items():
+        data += kafka.protocol.write_short_string(topic)
+        data += struct.pack('>i', len(partitions))
+        for partition, (error, highwater_mark, messages) in partitions.items():
+            message_set = kafka.protocol.encode_message_set(messages)
+            data += struct.pack('>ihq', partition, error, highwater_mark)
+            data += kafka.protocol.write_int_string(message_set)
+    return data
+
+
+class ProtocolTest(unittest.TestCase):
+
+    def test_encode_fetch_request(self):
+        requests = [
+            kafka.protocol.FetchRequest("topic1", 0, 10, 1024),
+            kafka.protocol.FetchRequest("topic1", 1, 20, 1024),
+            kafka.protocol.FetchRequest("topic2", 0, 30, 1024),
+        ]
+        data = kafka.protocol.encode_fetch_request("client", 1, requests, max_wait_time=100, min_bytes=1)
+        (size, ), cur = kafka.protocol.relative_unpack('>i', data, 0)
+        self.assertEqual(size, len(data) - 4)
+        # skip the header: api key, version, correlation id, client id
+        cur += 2 + 2 + 4 + 2 + len("client")
+        ((replica, max_wait_time, min_bytes, num_topics), cur) = kafka.protocol.relative_unpack('>iiii', data, cur)
+        self.assertEqual((replica, max_wait_time, min_bytes, num_topics), (-1, 100, 1, 2))
+        decoded = []
+        for i in range(num_topics):
+            topic, cur = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, offset, max_bytes), cur) = kafka.protocol.relative_unpack('>iqi', data, cur)
+                decoded.append(kafka.protocol.FetchRequest(topic, partition, offset, max_bytes))
+        self.assertEqual(cur, len(data))
+        self.assertEqual(sorted(decoded), sorted(requests))
+
+    def test_decode_fetch_response(self):
+        m1 = kafka.protocol.Message(0, 0, None, "foo")
+        m2 = kafka.protocol.Message(0, 0, "key", "bar")
+        data = encode_fetch_response(1, {
+            "topic1": {0: (0, 5, [m1]), 1: (0, 7, [m1, m2])},
+            "topic2": {3: (0, 0, [])},
+        })
+        responses = {(r.topic, r.partition): (r.highwaterMark, [m.message for m in r.messages]) for r in kafka.protocol.decode_fetch_response(data)}
+        self.assertEqual(responses, {
+            ("topic1", 0): (5, [m1]),
+            ("topic1", 1): (7, [m1, m2]),
+            ("topic2", 3): (0, []),
+        })
+        # responses come off the connection as memoryviews
+        responses = {(r.topic, r.partition): [m.message for m in r.messages] for r in kafka.protocol.decode_fetch_response(memoryview(data))}
+        self.assertEqual(responses[("topic1", 1)], [m1, m2])
+        self.assertEqual(type(responses[("topic1", 1)][1].value), str)
+
+    def test_decode_fetch_response_views(self):
+        m1 = kafka.protocol.Message(0, 0, "key", "foo")
+        m2 = kafka.protocol.Message(0, 0, None, "")
+        data = encode_fetch_response(1, {"topic1": {0: (0, 5, [m1, m2])}})
+        (r, ) = list(kafka.protocol.decode_fetch_response(memoryview(data), views=True))
+        (o1, o2) = list(r.messages)
+        self.assertTrue(isinstance(o1.message.value, memoryview))
+        self.assertEqual((o1.message.key.tobytes(), o1.message.value.tobytes()), ("key", "foo"))
+        self.assertEqual((o2.message.key, o2.message.value.tobytes()), (None, ""))
+
+    def test_decode_message_set_partial(self):
+        m = kafka.protocol.Message(0, 0, None, "foo")
+        message_set = kafka.protocol.encode_message_set([m, m])
+        # a trailing partial message is discarded...
+        messages = list(kafka.protocol.decode_message_set_iter(message_set[:-2]))
+        self.assertEqual([o.message for o in messages], [m])
+        # ...unless it is the only message
+        with self.assertRaises(kafka.protocol.ConsumerFetchSizeTooSmall):
+            list(kafka.protocol.decode_message_set_iter(message_set[:10]))
+
+    def test_decode_large_message(self):
+        # checksummed in chunks when coming from a memoryview
+        m = kafka.protocol.Message(0, 0, None, "x" * (kafka.protocol.CRC_CHUNK_BYTES * 3 + 1))
+        message_set = kafka.protocol.encode_message_set([m])
+        messages = list(kafka.protocol.decode_message_set_iter(memoryview(message_set)))
+        self.assertEqual([o.message for o in messages], [m])
+
+    def test_decode_message_checksum(self):
+        message_set = kafka.protocol.encode_message_set([kafka.protocol.Message(0, 0, None, "foo")])
+        with self.assertRaises(kafka.protocol.ChecksumError):
+            list(kafka.protocol.decode_message_set_iter(memoryview(message_set[:-1] + "x")))
+
+    def test_gzip(self):
+        messages = [kafka.protocol.Message(0, 0, None, "foo"), kafka.protocol.Message(0, 0, "key", "bar" * 100)]
+        message_set = kafka.protocol.encode_message_set(messages, codec=kafka.protocol.CODEC_GZIP)
+        self.assertTrue(len(message_set) < len(kafka.protocol.encode_message_set(messages)))
+        decoded = list(kafka.protocol.decode_message_set_iter(message_set))
+        self.assertEqual([o.message for o in decoded], messages)
+        decoded = list(kafka.protocol.decode_message_set_iter(memoryview(message_set), views=True))
+        self.assertEqual([o.message.value.tobytes() for o in decoded], ["foo", "bar" * 100])
+
+    @unittest.skipUnless(kafka.codec.has_snappy(), "python-snappy not installed")
+    def test_snappy(self):
+        messages = [kafka.protocol.Message(0, 0, None, "foo"), kafka.protocol.Message(0, 0, "key", "bar" * 100)]
+        message_set = kafka.protocol.encode_message_set(messages, codec=kafka.protocol.CODEC_SNAPPY)
+        decoded = list(kafka.protocol.decode_message_set_iter(message_set))
+        self.assertEqual([o.message for o in decoded], messages)
+
+    @unittest.skipIf(kafka.codec.has_snappy(), "python-snappy installed")
+    def test_snappy_not_installed(self):
+        messages = [kafka.protocol.Message(0, 0, None, "foo")]
+        with self.assertRaises(kafka.protocol.CompressionNotSupportedError):
+            kafka.protocol.encode_message_set(messages, codec=kafka.protocol.CODEC_SNAPPY)
+
+    def test_gzip_produce_request(self):
+        messages = [kafka.protocol.Message(0, 0, None, str(i)) for i in range(10)]
+        data = kafka.protocol.encode_produce_request("client", 1, [kafka.protocol.ProduceRequest("topic1", 0, messages)], codec=kafka.protocol.CODEC_GZIP)
+        cur = 4 + 2 + 2 + 4 + 2 + len("client") + 2 + 4 + 4
+        cur += 2 + len("topic1") + 4 + 4
+        message_set, cur = kafka.protocol.read_int_string(data, cur)
+        self.assertEqual(cur, len(data))
+        # a single wrapper message, with the codec in its attributes...
+        ((offset, size, crc, magic, attributes), _) = kafka.protocol.relative_unpack('>qiiBB', message_set, 0)
+        self.assertEqual(len(message_set), 8 + 4 + size)
+        self.assertEqual(attributes, kafka.protocol.CODEC_GZIP)
+        # ...which decodes into the original messages
+        decoded = list(kafka.protocol.decode_message_set_iter(message_set))
+        self.assertEqual([o.message for o in decoded], messages)
+
+    def test_encode_produce_request(self):
+        m1 = kafka.protocol.Message(0, 0, None, "foo")
+        m2 = kafka.protocol.Message(0, 0, None, "bar")
+        requests = [
+            kafka.protocol.ProduceRequest("topic1", 0, [m1]),
+            kafka.protocol.ProduceRequest("topic1", 1, [m1, m2]),
+            kafka.protocol.ProduceRequest("topic2", 0, [m2]),
+        ]
+        data = kafka.protocol.encode_produce_request("client", 1, requests)
+        cur = 4 + 2 + 2 + 4 + 2 + len("client")
+        ((acks, timeout, num_topics), cur) = kafka.protocol.relative_unpack('>hii', data, cur)
+        self.assertEqual((acks, timeout, num_topics), (1, 1000, 2))
+        decoded = []
+        for i in range(num_topics):
+            topic, cur = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+                message_set, cur = kafka.protocol.read_int_string(data, cur)
+                messages = [m.message for m in kafka.protocol.decode_message_set_iter(message_set)]
+                decoded.append(kafka.protocol.ProduceRequest(topic, partition, messages))
+        self.assertEqual(cur, len(data))
+        self.assertEqual(sorted(decoded), sorted(requests))
+
+    def test_decode_produce_response(self):
+        data = struct.pack('>ii', 1, 2)
+        data += kafka.protocol.write_short_string("topic1") + struct.pack('>i', 2)
+        data += struct.pack('>ihq', 0, 0, 10) + struct.pack('>ihq', 1, 0, 20)
+        data += kafka.protocol.write_short_string("topic2") + struct.pack('>i', 1)
+        data += struct.pack('>ihq', 0, 6, -1)
+        self.assertEqual(list(kafka.protocol.decode_produce_response(data)), [
+            kafka.protocol.ProduceResponse("topic1", 0, 0, 10),
+            kafka.protocol.ProduceResponse("topic1", 1, 0, 20),
+            kafka.protocol.ProduceResponse("topic2", 0, 6, -1),
+        ])
+
+    def test_encode_offset_commit_request(self):
+        requests = [
+            kafka.protocol.OffsetCommitRequest("topic1", 0, 10, ""),
+            kafka.protocol.OffsetCommitRequest("topic1", 1, 20, "foo"),
+            kafka.protocol.OffsetCommitRequest("topic2", 0, 30, ""),
+        ]
+        data = kafka.protocol.encode_offset_commit_request("client", 1, "group1", requests)
+        (size, ), cur = kafka.protocol.relative_unpack('>i', data, 0)
+        self.assertEqual(size, len(data) - 4)
+        ((api_key, ), _) = kafka.protocol.relative_unpack('>h', data, cur)
+        self.assertEqual(api_key, kafka.protocol.OFFSET_COMMIT_KEY)
+        cur += 2 + 2 + 4 + 2 + len("client")
+        group, cur = kafka.protocol.read_short_string(data, cur)
+        self.assertEqual(group, "group1")
+        ((num_topics, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        decoded = []
+        for i in range(num_topics):
+            topic, cur = kafka.protocol.read_short_string(data, cur)
+            ((num_partitions, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+            for j in range(num_partitions):
+                ((partition, offset), cur) = kafka.protocol.relative_unpack('>iq', data, cur)
+                metadata, cur = kafka.protocol.read_short_string(data, cur)
+                decoded.append(kafka.protocol.OffsetCommitRequest(topic, partition, offset, metadata))
+        self.assertEqual(cur, len(data))
+        self.assertEqual(sorted(decoded), sorted(requests))
+
+    def test_decode_offset_commit_response(self):
+        data = struct.pack('>ii', 1, 1)
+        data += kafka.protocol.write_short_string("topic1") + struct.pack('>i', 2)
+        data += struct.pack('>ih', 0, 0) + struct.pack('>ih', 1, 3)
+        self.assertEqual(list(kafka.protocol.decode_offset_commit_response(data)), [
+            kafka.protocol.OffsetCommitResponse("topic1", 0, 0),
+            kafka.protocol.OffsetCommitResponse("topic1", 1, 3),
+        ])
+
+    def test_encode_offset_fetch_request(self):
+        requests = [
+            kafka.protocol.OffsetFetchRequest("topic1", 0),
+            kafka.protocol.OffsetFetchRequest("topic1", 1),
+        ]
+        data = kafka.protocol.encode_offset_fetch_request("client", 1, "group1", requests)
+        (size, ), cur = kafka.protocol.relative_unpack('>i', data, 0)
+        self.assertEqual(size, len(data) - 4)
+        ((api_key, ), _) = kafka.protocol.relative_unpack('>h', data, cur)
+        self.assertEqual(api_key, kafka.protocol.OFFSET_FETCH_KEY)
+        cur += 2 + 2 + 4 + 2 + len("client")
+        group, cur = kafka.protocol.read_short_string(data, cur)
+        self.assertEqual(group, "group1")
+        ((num_topics, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        self.assertEqual(num_topics, 1)
+        topic, cur = kafka.protocol.read_short_string(data, cur)
+        ((num_partitions, ), cur) = kafka.protocol.relative_unpack('>i', data, cur)
+        (partitions, cur) = kafka.protocol.relative_unpack('>%di' % num_partitions, data, cur)
+        self.assertEqual(cur, len(data))
+        self.assertEqual((topic, sorted(partitions)), ("topic1", [0, 1]))
+
+    def test_decode_offset_fetch_response(self):
+        data = struct.pack('>ii', 1, 1)
+        data += kafka.protocol.write_short_string("topic1") + struct.pack('>i', 2)
+        data += struct.pack('>iq', 0, 10) + kafka.protocol.write_short_string("foo") + struct.pack('>h', 0)
+        data += struct.pack('>iq', 1, -1) + kafka.protocol.write_short_string("") + struct.pack('>h', 3)
+        self.assertEqual(list(kafka.protocol.decode_offset_fetch_response(data)), [
+            kafka.protocol.OffsetFetchResponse("topic1", 0, 10, "foo", 0),
+            kafka.protocol.OffsetFetchResponse("topic1", 1, -1, "", 3),
+        ])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+# (c)2014 Mik Kocikowski, MIT License (http://opensource.org/licenses/MIT)
+# https://github.com/mkocikowski/kafka-python-basic
+
+import unittest
+import logging
+import threading
+import httplib
+import json
+import time
+
+import kafka.client
+import kafka.rest
+from kafka.test.test_producer import MockClient
+
+
+class RestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_client = kafka.client.KafkaClient
+        kafka.client.KafkaClient = MockClient
+        self.server = kafka.rest.RestServer(("127.0.0.1", 0), "192.168.33.10:9092", linger_seconds=0.01)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.conn = httplib.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.close()
+        kafka.client.KafkaClient = self.tmp_client
+
+    def request(self, method, path, body=None):
+        self.conn.request(method, path, body)
+        response = self.conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_post(self):
+        self.assertEqual(self.request("POST", "/topics/unittest1", "foo"), (200, {'messages': 1}))
+        # same connection (keep-alive)
+        self.assertEqual(self.request("POST", "/topics/unittest1/bulk", "foo\nbar\nbaz"), (200, {'messages': 3}))
+        self.assertEqual(self.request("POST", "/topics/unittest1/bulk?async=1", "foo\n"), (202, {'messages': 1}))
+        producer = self.server.producers['unittest1']
+        producer.flush()
+        messages = [m.value for requests in producer.client.requests for r in requests for m in r.messages]
+        self.assertEqual(sorted(messages), ["bar", "baz", "foo", "foo", "foo"])
+
+    def test_key(self):
+        self.request("POST", "/topics/unittest1?key=k1", "foo")
+        producer = self.server.producers['unittest1']
+        self.assertEqual([(m.key, m.value) for r in producer.client.requests[0] for m in r.messages], [("k1", "foo")])
+
+    def test_error(self):
+        self.request("POST", "/topics/unittest1", "foo")
+        self.server.producers['unittest1'].client.error = IOError("broker went away")
+        status, body = self.request("POST", "/topics/unittest1", "foo")
+        self.assertEqual(status, 503)
+        self.assertEqual(self.request("GET", "/stats")[1]['errors'], 1)
+
+    def test_not_found(self):
+        self.assertEqual(self.request("POST", "/foo", "foo")[0], 404)
+        self.assertEqual(self.request("GET", "/foo")[0], 404)
+
+    def test_content_length(self):
+        for length, status in ((None, 411), ("foo", 400), ("-1", 400), (str(kafka.rest.MAX_BODY_BYTES + 1), 413)):
+            self.conn.putrequest("POST", "/topics/unittest1")
+            if length is not None:
+                self.conn.putheader("Content-Length", length)
+            self.conn.endheaders()
+            response = self.conn.getresponse()
+            self.assertEqual(response.status, status)
+            response.read()
+            # the connection is closed, since the body can't be skipped
+            self.assertTrue(response.will_close)
+            self.conn.close()
+
+    def test_get_producer(self):
+        # a producer being created for one topic doesn't hold up the others
+        creating = threading.Event()
+        release = threading.Event()
+        class SlowProducer(object):
+            def __init__(self, hosts, topic, **kwargs):
+                if topic == "slow":
+                    creating.set()
+                    release.wait(5)
+                self.client = self
+            def close(self):
+                return
+        self.server.producer_class = SlowProducer
+        thread = threading.Thread(target=self.server.get_producer, args=("slow", ))
+        thread.start()
+        creating.wait(5)
+        t1 = time.time()
+        producer = self.server.get_producer("fast")
+        self.assertTrue(time.time() - t1 < 1)
+        release.set()
+        thread.join()
+        self.assertTrue(self.server.get_producer("fast") is producer)
+        self.assertEqual(sorted(self.server.producers), ["fast", "slow"])
+
+    def test_stats(self):
+        self.request("POST", "/topics/unittest1/bulk", "foo\nbar\n")
+        status, stats = self.request("GET", "/stats")
+        self.assertEqual(status, 200)
+        self.assertEqual((stats['requests'], stats['messages'], stats['bytes']), (1, 2, 8))
+        self.assertEqual(stats['topics'], {'unittest1': {'queued_messages': 0, 'queued_bytes': 0}})
+
+    def test_metrics(self):
+        status, metrics = self.request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(metrics), ['counters', 'gauges', 'histograms'])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -20,6 +20,9 @@ setup(
 #         'requests >= 2.1.0',
 # #         'pyrax >= 1.6.2',
 #     ],
+    extras_require = {
+        'snappy': ['python-snappy'],
+    },
     packages = [
         'kafka',
         'kafka.test',
@@ -34,6 +37,8 @@ setup(
         'console_scripts': [
             'kafka-consumer = kafka.consumer:main',
             'kafka-producer = kafka.producer:main',
+            'kafka-rest = kafka.rest:main',
+            'kafka-bench = kafka.bench:main',
         ]
     },
     classifiers = [